@@ -0,0 +1,146 @@
+''' Times the Controller operations on synthetic clinics of growing size.
+
+Run from the "Medical Clinic System" directory:
+
+    python -m benchmarks.bench_clinic --sizes 1000 10000 --output results.json
+    python -m benchmarks.bench_clinic --sizes 1000 --compare results.json
+'''
+import argparse
+import datetime
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import SyntheticClinic, USERNAME, PASSWORD
+from clinic.controller import Controller
+from clinic.storage_config import StorageConfig
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(size, operation, samples):
+    ''' Summary of one operation at one size, times in milliseconds '''
+    return {
+        "size": size,
+        "operation": operation,
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "max_ms": max(samples) * 1000
+    }
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_size(clinic, repeat, startup_repeat):
+    ''' Time every operation on one clinic and return the summaries '''
+    rng = random.Random(clinic.seed)
+    results = []
+    root = tempfile.mkdtemp(prefix='clinic-bench-')
+    try:
+        # Every run gets its own data root, so several benchmarks can run in parallel
+        config = StorageConfig(root)
+        clinic.write(config)
+        samples = []
+        for _ in range(startup_repeat):
+            elapsed, controller = timed(Controller, True, config)
+            samples.append(elapsed)
+        results.append(summarize(clinic.patients, 'startup', samples))
+        controller.login(USERNAME, PASSWORD)
+
+        phns = [clinic.phn(rng.randint(1, clinic.patients)) for _ in range(repeat)]
+        results.append(summarize(clinic.patients, 'search_patient',
+            [timed(controller.search_patient, phn)[0] for phn in phns]))
+
+        names = [rng.choice(controller.search_patient(phn).name.split()) for phn in phns]
+        results.append(summarize(clinic.patients, 'retrieve_patients',
+            [timed(controller.retrieve_patients, name)[0] for name in names]))
+
+        samples = []
+        for i in range(repeat):
+            samples.append(timed(controller.create_patient, clinic.phn(clinic.patients + i + 1),
+                'Bench Patient', '2000-01-01', '250 000 0000', 'bench@example.com', '1 Moss St, Victoria')[0])
+        results.append(summarize(clinic.patients, 'create_patient', samples))
+
+        note_samples, retrieve_samples, list_samples = [], [], []
+        for phn in phns:
+            controller.set_current_patient(phn)
+            note_samples.append(timed(controller.create_note, 'Patient comes with headache.')[0])
+            retrieve_samples.append(timed(controller.retrieve_notes, 'headache')[0])
+            list_samples.append(timed(controller.list_notes)[0])
+            controller.unset_current_patient()
+        results.append(summarize(clinic.patients, 'create_note', note_samples))
+        results.append(summarize(clinic.patients, 'retrieve_notes', retrieve_samples))
+        results.append(summarize(clinic.patients, 'list_notes', list_samples))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    ''' Print the p50 ratio of every operation against a previous run '''
+    previous = {(entry["size"], entry["operation"]): entry for entry in baseline["results"]}
+    print('%-8s %-18s %12s %12s %8s' % ('size', 'operation', 'base p50 ms', 'p50 ms', 'ratio'))
+    for entry in results:
+        base = previous.get((entry["size"], entry["operation"]))
+        if base:
+            ratio = entry["p50_ms"] / base["p50_ms"] if base["p50_ms"] else float('inf')
+            print('%-8d %-18s %12.3f %12.3f %7.2fx' % (entry["size"], entry["operation"],
+                base["p50_ms"], entry["p50_ms"], ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_clinic',
+        description='Benchmark the clinic Controller on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+        help='numbers of patients to benchmark')
+    parser.add_argument('--notes-mean', type=int, default=5, help='mean notes per patient')
+    parser.add_argument('--notes-distribution', default='poisson',
+        choices=['fixed', 'uniform', 'poisson', 'pareto'])
+    parser.add_argument('--note-words', type=int, default=40, help='median words per note')
+    parser.add_argument('--repeat', type=int, default=50, help='calls timed per operation')
+    parser.add_argument('--startup-repeat', type=int, default=3, help='controller starts timed')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        clinic = SyntheticClinic(size, args.notes_mean, args.notes_distribution, args.note_words, args.seed)
+        for entry in bench_size(clinic, args.repeat, args.startup_repeat):
+            print('%-8d %-18s p50 %10.3f ms  p95 %10.3f ms' % (entry["size"], entry["operation"],
+                entry["p50_ms"], entry["p95_ms"]), file=sys.stderr)
+            results.append(entry)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+''' Compares the encodings of patients.json: saving and loading the patients, and the file size.
+
+Run from the "Medical Clinic System" directory:
+
+    python -m benchmarks.bench_codec --sizes 10000 100000
+    python -m benchmarks.bench_codec --sizes 1000000 --repeat 1
+
+'legacy' is the indented PatientEncoder and object_hook PatientDecoder the clinic used before.
+'objects' and 'columns' are the two layouts of clinic.dao.patient_codec, written compact by
+orjson when it is installed ('codec' in the results tells which). 'parse_s' is the time to
+decode the file into plain values, 'load_s' also builds the Patient objects, without their
+records as a parallel warm-up does.
+'''
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import sys
+import time
+from benchmarks.synthetic import SyntheticClinic
+from clinic.dao import patient_codec
+from clinic.dao.patient_codec import encode_patients, decode_rows
+from clinic.dao.patient_dao_json import PatientEncoder, PatientDecoder
+from clinic.patient import Patient
+
+MODES = ('legacy', 'objects', 'columns')
+
+
+def save(patients, mode):
+    if mode == 'legacy':
+        return json.dumps({patient.phn: patient for patient in patients}, cls=PatientEncoder, indent=4).encode('utf-8')
+    return encode_patients(patients, mode)
+
+
+def parse(data, mode):
+    if mode == 'legacy':
+        return json.loads(data.decode('utf-8'))
+    return decode_rows(data)
+
+
+def load(data, mode):
+    if mode == 'legacy':
+        return json.loads(data.decode('utf-8'), cls=PatientDecoder, load_records=False)
+    return {row[0]: Patient(*row[:6], True, None, None, False, row[6]) for row in decode_rows(data)}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    value = function(*args)
+    return time.perf_counter() - start, value
+
+
+def bench_size(size, repeat, seed):
+    patients = [patient for patient, notes in SyntheticClinic(size, notes_mean=0, seed=seed).iter_patients()]
+    results = []
+    baseline = None
+    for mode in MODES:
+        saves, parses, loads = [], [], []
+        for _ in range(repeat):
+            elapsed, data = timed(save, patients, mode)
+            saves.append(elapsed)
+            parses.append(timed(parse, data, mode)[0])
+            elapsed, loaded = timed(load, data, mode)
+            loads.append(elapsed)
+            assert len(loaded) == size
+        entry = {"size": size, "mode": mode, "codec": 'json' if mode == 'legacy' else
+                 ('orjson' if patient_codec.orjson else 'json'), "bytes": len(data),
+                 "save_s": statistics.median(saves), "parse_s": statistics.median(parses),
+                 "load_s": statistics.median(loads)}
+        baseline = baseline or entry
+        entry["save_speedup"] = baseline["save_s"] / entry["save_s"]
+        entry["parse_speedup"] = baseline["parse_s"] / entry["parse_s"]
+        entry["load_speedup"] = baseline["load_s"] / entry["load_s"]
+        results.append(entry)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_codec',
+        description='Benchmark the encodings of patients.json.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='numbers of patients')
+    parser.add_argument('--repeat', type=int, default=3, help='saves and loads timed per encoding')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        for entry in bench_size(size, args.repeat, args.seed):
+            print('%-8d %-8s %-7s %11d B  save %7.3f s %6.2fx  parse %7.3f s %6.2fx  load %7.3f s %6.2fx' % (
+                entry["size"], entry["mode"], entry["codec"], entry["bytes"], entry["save_s"], entry["save_speedup"],
+                entry["parse_s"], entry["parse_speedup"], entry["load_s"], entry["load_speedup"]), file=sys.stderr)
+            results.append(entry)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {key: value for key, value in vars(args).items() if key != 'output'}
+            },
+            "results": results
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+''' Measures the write latency added by atomic, crash-safe saves, and the startup recovery check.
+
+Run from the "Medical Clinic System" directory:
+
+    python -m benchmarks.bench_saves --sizes 100 1000 10000 --output saves.json
+
+Every save strategy writes the real patients.json and a record file of a synthetic clinic:
+in place (the old behaviour), atomic without fsync (the rename alone) and atomic (rename and fsync).
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from benchmarks.bench_clinic import summarize, timed
+from benchmarks.synthetic import SyntheticClinic
+from clinic.durable_io import atomic_write, load_recovering
+from clinic.storage_config import StorageConfig
+
+
+def write_in_place(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+STRATEGIES = {
+    'in_place': write_in_place,
+    'atomic_no_fsync': lambda path, data: atomic_write(path, data, durable=False),
+    'atomic': atomic_write
+}
+
+
+def bench_size(clinic, repeat):
+    ''' Time every save strategy on the files of one clinic and return the summaries '''
+    results = []
+    root = tempfile.mkdtemp(prefix='clinic-bench-saves-')
+    try:
+        config = StorageConfig(root)
+        clinic.write(config)
+        files = {'patients.json': config.patients_path(), 'record': config.record_path(clinic.phn(1))}
+        for label, path in files.items():
+            with open(path, 'rb') as file:
+                data = file.read()
+            for strategy, write in STRATEGIES.items():
+                samples = [timed(write, path, data)[0] for _ in range(repeat)]
+                entry = summarize(clinic.patients, f'{label} {strategy}', samples)
+                entry["bytes"] = len(data)
+                results.append(entry)
+        # What every startup pays for the torn file check: a full read and decode
+        path = config.patients_path()
+        samples = [timed(load_recovering, path, json.loads)[0] for _ in range(repeat)]
+        results.append(summarize(clinic.patients, 'patients.json recovery check', samples))
+        assert not os.path.exists(path + '.corrupt')
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_saves',
+        description='Benchmark in place against atomic saves of the clinic files.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+        help='numbers of patients to benchmark')
+    parser.add_argument('--repeat', type=int, default=50, help='saves timed per strategy')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        for entry in bench_size(SyntheticClinic(size, seed=args.seed), args.repeat):
+            print('%-8d %-32s p50 %10.3f ms  p95 %10.3f ms' % (entry["size"], entry["operation"],
+                entry["p50_ms"], entry["p95_ms"]), file=sys.stderr)
+            results.append(entry)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {key: value for key, value in vars(args).items() if key != 'output'}
+            },
+            "results": results
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
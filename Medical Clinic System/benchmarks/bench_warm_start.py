@@ -0,0 +1,93 @@
+''' Compares a start from patients.json and the records with a warm start from the snapshot.
+
+Run from the "Medical Clinic System" directory:
+
+    python -m benchmarks.bench_warm_start --sizes 1000 20000
+    sudo python -m benchmarks.bench_warm_start --cold    # drop the page cache before every start
+
+'json' loads every record at startup as the clinic always did. 'snapshot' reads the snapshot
+written by a clean shutdown and leaves every record to its first use; 'first_notes_s' is the
+time to then list the notes of one patient.
+'''
+import argparse
+import datetime
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from benchmarks.bench_warm_up import drop_page_cache
+from benchmarks.synthetic import SyntheticClinic
+from clinic.dao.patient_dao_json import PatientDAOJSON
+from clinic.dao.record_store import close_record_stores
+from clinic.storage_config import StorageConfig
+
+
+def time_start(config, warm_start, cold):
+    if cold:
+        drop_page_cache()
+    close_record_stores()
+    start = time.perf_counter()
+    dao = PatientDAOJSON(True, config, warm_start=warm_start)
+    elapsed = time.perf_counter() - start
+    patient = next(iter(dao.patients.values()))
+    start = time.perf_counter()
+    patient.list_notes()
+    return elapsed, time.perf_counter() - start
+
+
+def bench_size(size, repeat, cold, seed):
+    results = []
+    root = tempfile.mkdtemp(prefix='clinic-bench-warm-start-')
+    try:
+        config = StorageConfig(root)
+        SyntheticClinic(size, seed=seed).write(config)
+        # A clean shutdown of a warm-start clinic leaves the snapshot
+        PatientDAOJSON(True, config, warm_start=True).close()
+        baseline = None
+        for mode in ('json', 'snapshot'):
+            samples = [time_start(config, mode == 'snapshot', cold) for _ in range(repeat)]
+            median = statistics.median(sample[0] for sample in samples)
+            baseline = baseline or median
+            results.append({"size": size, "mode": mode, "median_s": median, "speedup": baseline / median,
+                            "first_notes_s": statistics.median(sample[1] for sample in samples)})
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_warm_start',
+        description='Benchmark a start from the JSON file against a warm start from the snapshot.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 20000], help='numbers of patients')
+    parser.add_argument('--repeat', type=int, default=3, help='starts timed per configuration')
+    parser.add_argument('--cold', action='store_true', help='drop the page cache before every start (root)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        for entry in bench_size(size, args.repeat, args.cold, args.seed):
+            print('%-8d %-10s %8.3f s  %6.2fx  first notes %7.4f s' % (entry["size"], entry["mode"],
+                entry["median_s"], entry["speedup"], entry["first_notes_s"]), file=sys.stderr)
+            results.append(entry)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {key: value for key, value in vars(args).items() if key != 'output'}
+            },
+            "results": results
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
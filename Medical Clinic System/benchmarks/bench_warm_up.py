@@ -0,0 +1,129 @@
+''' Compares serial and parallel loading of the patient records at startup.
+
+Run from the "Medical Clinic System" directory:
+
+    python -m benchmarks.bench_warm_up --sizes 1000 20000 --workers 4 8 16
+    sudo python -m benchmarks.bench_warm_up --cold    # drop the page cache before every load
+
+Every size is loaded serially (workers 0) and with each number of threads. 'processes' reads the
+records in threads and decodes them in a process pool, the decoded notes are pickled back.
+'''
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import pickle
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import SyntheticClinic
+from clinic.dao.patient_dao_json import PatientDAOJSON, PatientDecoder
+from clinic.dao.record_loader import read_records, CHUNK_SIZE
+from clinic.dao.record_store import close_record_stores
+from clinic.storage_config import StorageConfig
+
+
+def drop_page_cache():
+    ''' Make the next load read the disk; Linux only, needs root '''
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as file:
+        file.write('3')
+
+
+def decode_records(records):
+    return [pickle.loads(data) if data is not None else {} for data in records]
+
+
+def load_with_processes(config, workers, cold):
+    ''' Threads read the records, a process pool decodes them; returns the seconds this took '''
+    close_record_stores()
+    with open(config.patients_path(), 'r') as file:
+        patients = json.load(file, cls=PatientDecoder, config=config, load_records=False)
+    daos = [patient.record.note_dao for patient in patients.values()]
+    if cold:
+        drop_page_cache()
+    start = time.perf_counter()
+    chunks = [daos[index:index + CHUNK_SIZE] for index in range(0, len(daos), CHUNK_SIZE)]
+    with concurrent.futures.ThreadPoolExecutor(workers) as threads, \
+            concurrent.futures.ProcessPoolExecutor(min(workers, os.cpu_count() or 1)) as processes:
+        decoded = processes.map(decode_records, threads.map(read_records, chunks))
+        for chunk, notes in zip(chunks, decoded):
+            for note_dao, record in zip(chunk, notes):
+                note_dao.set_notes(record)
+    return time.perf_counter() - start
+
+
+def time_load(config, workers, cold):
+    if cold:
+        drop_page_cache()
+    # A fresh store per load, nothing read before may be reused
+    close_record_stores()
+    start = time.perf_counter()
+    PatientDAOJSON(True, config, load_workers=workers)
+    return time.perf_counter() - start
+
+
+def bench_size(size, workers_list, repeat, cold, seed):
+    results = []
+    root = tempfile.mkdtemp(prefix='clinic-bench-warm-up-')
+    try:
+        config = StorageConfig(root)
+        SyntheticClinic(size, seed=seed).write(config)
+        serial = None
+        for workers in [0] + workers_list:
+            samples = [time_load(config, workers, cold) for _ in range(repeat)]
+            median = statistics.median(samples)
+            serial = serial or median
+            results.append({"size": size, "mode": 'serial' if not workers else 'threads', "workers": workers,
+                            "median_s": median, "speedup": serial / median})
+        for workers in workers_list:
+            # Only reading and decoding the records is timed, a threaded load also parses patients.json
+            results.append({"size": size, "mode": 'processes', "workers": workers,
+                            "records_s": load_with_processes(config, workers, cold)})
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_warm_up',
+        description='Benchmark serial against parallel loading of the patient records.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 20000], help='numbers of patients')
+    parser.add_argument('--workers', type=int, nargs='+', default=[4, 8, 16], help='loader thread counts')
+    parser.add_argument('--repeat', type=int, default=3, help='loads timed per configuration')
+    parser.add_argument('--cold', action='store_true', help='drop the page cache before every load (root)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        for entry in bench_size(size, args.workers, args.repeat, args.cold, args.seed):
+            if entry["mode"] == 'processes':
+                print('%-8d %-10s %3d workers  records only %8.3f s' % (entry["size"], entry["mode"],
+                    entry["workers"], entry["records_s"]), file=sys.stderr)
+            else:
+                print('%-8d %-10s %3d workers  %8.3f s  %5.2fx' % (entry["size"], entry["mode"],
+                    entry["workers"], entry["median_s"], entry["speedup"]), file=sys.stderr)
+            results.append(entry)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {key: value for key, value in vars(args).items() if key != 'output'}
+            },
+            "results": results
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
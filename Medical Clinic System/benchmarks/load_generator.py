@@ -0,0 +1,280 @@
+''' Simulates concurrent clinicians and reports throughput, latency and errors over time.
+
+Run from the "Medical Clinic System" directory, in process on a synthetic clinic:
+
+    python -m benchmarks.load_generator --users 20 --duration 60 --patients 10000
+
+or against a running server (python -m clinic serve):
+
+    python -m benchmarks.load_generator --users 20 --server http://127.0.0.1:8765 \\
+        --username user --password 123456
+'''
+import argparse
+import datetime
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.synthetic import SyntheticClinic, USERNAME, PASSWORD, WORDS
+from clinic.controller import Controller
+from clinic.metrics import LatencyHistogram
+from clinic.remote_controller import RemoteController
+from clinic.storage_config import StorageConfig
+
+# Relative weights of the user actions
+DEFAULT_MIX = 'search=40,retrieve=20,appointment=35,register=5'
+ACTIONS = ('search', 'retrieve', 'appointment', 'register', 'list')
+
+
+def parse_mix(text):
+    ''' Parse "action=weight,..." into a dict of weights '''
+    mix = {}
+    for item in text.split(','):
+        action, _, weight = item.partition('=')
+        action = action.strip()
+        if action not in ACTIONS:
+            raise ValueError(f'unknown action {action!r}, choose from {", ".join(ACTIONS)}')
+        mix[action] = float(weight) if weight else 1.0
+    if not any(mix.values()):
+        raise ValueError('the mix needs at least one action with a positive weight')
+    return mix
+
+
+class OperationStats():
+    ''' Latency histogram and error count of one operation '''
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+
+    def add(self, seconds, error):
+        self.histogram.observe(seconds)
+        if error:
+            self.errors += 1
+
+    def snapshot(self, seconds):
+        ''' Histogram summary with the throughput over the given number of seconds '''
+        summary = self.histogram.snapshot()
+        summary["errors"] = self.errors
+        summary["error_rate"] = self.errors / summary["count"] if summary["count"] else 0.0
+        summary["throughput"] = summary["count"] / seconds if seconds > 0 else 0.0
+        return summary
+
+
+class LoadRecorder():
+    ''' Per-window and overall statistics of every operation; 'all' aggregates them '''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.windows = {}
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def record(self, operation, seconds, error=False):
+        window = int((time.perf_counter() - self.started) // self.interval)
+        with self.lock:
+            for table in (self.windows.setdefault(window, {}), self.totals):
+                for name in (operation, 'all'):
+                    stats = table.get(name)
+                    if stats is None:
+                        stats = table[name] = OperationStats()
+                    stats.add(seconds, error)
+
+    def window_report(self, window):
+        with self.lock:
+            table = self.windows.get(window, {})
+            return {"start_s": window * self.interval,
+                    "operations": {name: stats.snapshot(self.interval) for name, stats in sorted(table.items())}}
+
+    def totals_report(self, elapsed):
+        with self.lock:
+            return {name: stats.snapshot(elapsed) for name, stats in sorted(self.totals.items())}
+
+
+class SimulatedUser():
+    ''' One clinician: logs in, then runs weighted actions separated by think times '''
+
+    def __init__(self, number, controller, recorder, phns, mix, think_time, credentials, seed):
+        self.number = number
+        self.controller = controller
+        self.recorder = recorder
+        self.phns = phns
+        self.actions = list(mix)
+        self.weights = list(mix.values())
+        self.think_time = think_time
+        self.credentials = credentials
+        self.rng = random.Random(seed * 1000003 + number)
+        self.registered = 0
+
+    def timed(self, operation, function, *args):
+        start = time.perf_counter()
+        try:
+            result = function(*args)
+        except Exception:
+            self.recorder.record(operation, time.perf_counter() - start, error=True)
+            raise
+        self.recorder.record(operation, time.perf_counter() - start)
+        return result
+
+    def run(self, deadline):
+        try:
+            self.timed('login', self.controller.login, *self.credentials)
+        except Exception:
+            return
+        while time.monotonic() < deadline:
+            action = self.rng.choices(self.actions, self.weights)[0]
+            try:
+                getattr(self, action)()
+            except Exception:
+                # Already counted as an error, the clinician carries on
+                pass
+            if self.think_time:
+                time.sleep(min(self.rng.expovariate(1 / self.think_time), max(0, deadline - time.monotonic())))
+        try:
+            self.timed('logout', self.controller.logout)
+        except Exception:
+            pass
+
+    def search(self):
+        self.timed('search_patient', self.controller.search_patient, self.rng.choice(self.phns))
+
+    def retrieve(self):
+        self.timed('retrieve_patients', self.controller.retrieve_patients, self.rng.choice(WORDS[:10]).capitalize())
+
+    def list(self):
+        self.timed('list_patients', self.controller.list_patients)
+
+    def register(self):
+        # Unique PHNs per simulated user, far from the synthetic ones
+        self.registered += 1
+        phn = 8000000000 + self.number * 1000000 + self.registered
+        self.timed('create_patient', self.controller.create_patient, phn, 'Load Patient', '2000-01-01',
+                   '250 000 0000', 'load@example.com', '1 Moss St, Victoria')
+
+    def appointment(self):
+        self.timed('start_appointment', self.controller.set_current_patient, self.rng.choice(self.phns))
+        try:
+            self.timed('create_note', self.controller.create_note,
+                       ' '.join(self.rng.choice(WORDS) for _ in range(20)).capitalize() + '.')
+            self.timed('list_notes', self.controller.list_notes)
+        finally:
+            self.timed('end_appointment', self.controller.unset_current_patient)
+
+
+def print_window(report, file=sys.stderr):
+    total = report["operations"].get('all')
+    if not total:
+        print('%7.1fs  no operations' % report["start_s"], file=file)
+        return
+    print('%7.1fs %9.1f ops/s  p50 %8.3f ms  p95 %8.3f ms  p99 %8.3f ms  errors %5.2f%%' % (
+        report["start_s"], total["throughput"], total["p50_ms"], total["p95_ms"], total["p99_ms"],
+        total["error_rate"] * 100), file=file)
+
+
+def run_load(make_controller, phns, users, duration, mix, think_time=0.5, interval=5.0,
+             credentials=(USERNAME, PASSWORD), seed=0, report_window=None):
+    ''' Run the simulated users for duration seconds; returns (windows, totals) '''
+    recorder = LoadRecorder(interval)
+    deadline = time.monotonic() + duration
+    threads = []
+    for number in range(users):
+        user = SimulatedUser(number, make_controller(), recorder, phns, mix, think_time, credentials, seed)
+        thread = threading.Thread(target=user.run, args=(deadline,), name=f'clinician-{number}', daemon=True)
+        threads.append(thread)
+        thread.start()
+
+    # Report every window once it is over
+    window = 0
+    while any(thread.is_alive() for thread in threads):
+        end = recorder.started + (window + 1) * interval
+        while time.perf_counter() < end and any(thread.is_alive() for thread in threads):
+            time.sleep(min(0.05, max(0, end - time.perf_counter())))
+        if time.perf_counter() >= end:
+            if report_window:
+                report_window(recorder.window_report(window))
+            window += 1
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - recorder.started
+    # The last, partial window
+    if recorder.windows.get(window) and report_window:
+        report_window(recorder.window_report(window))
+    # Calls still running when a window was reported land in it afterwards, so rebuild them all
+    windows = [recorder.window_report(index) for index in sorted(recorder.windows)]
+    return windows, recorder.totals_report(elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load_generator',
+        description='Simulate concurrent clinicians against the clinic Controller or a clinic server.')
+    parser.add_argument('--users', type=int, default=10, help='concurrent simulated clinicians')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+        help=f'weighted actions among {", ".join(ACTIONS)} (default: {DEFAULT_MIX})')
+    parser.add_argument('--think-time', type=float, default=0.5,
+        help='mean seconds between actions, exponentially distributed; 0 for none')
+    parser.add_argument('--interval', type=float, default=5, help='seconds per reported window')
+    parser.add_argument('--patients', type=int, default=1000, help='size of the synthetic clinic (in process)')
+    parser.add_argument('--server', help='URL of a clinic server; its patients are used instead')
+    parser.add_argument('--username', default=USERNAME)
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the windows and totals as JSON to this file')
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+    credentials = (args.username, args.password)
+
+    root = None
+    try:
+        if args.server:
+            def make_controller():
+                return RemoteController(args.server)
+            probe = make_controller()
+            probe.login(*credentials)
+            phns = [patient.phn for patient in probe.list_patients()]
+            probe.logout()
+            probe.close()
+        else:
+            root = tempfile.mkdtemp(prefix='clinic-load-')
+            clinic = SyntheticClinic(args.patients, seed=args.seed)
+            clinic.write(StorageConfig(root))
+            shared = Controller(True, StorageConfig(root))
+            make_controller = shared.open_session
+            phns = [clinic.phn(i) for i in range(1, args.patients + 1)]
+        if not phns:
+            parser.error('the clinic has no patients to load')
+
+        windows, totals = run_load(make_controller, phns, args.users, args.duration, mix, args.think_time,
+                                   args.interval, credentials, args.seed, report_window=print_window)
+    finally:
+        if root:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print('%-18s %8s %10s %10s %10s %10s %8s' % ('operation', 'count', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                                                 'errors'))
+    for name, summary in totals.items():
+        print('%-18s %8d %10.1f %10.3f %10.3f %10.3f %8d' % (name, summary["count"], summary["throughput"],
+            summary["p50_ms"], summary["p95_ms"], summary["p99_ms"], summary["errors"]))
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {key: value for key, value in vars(args).items() if key not in ('output', 'password')}
+            },
+            "windows": windows,
+            "totals": totals
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
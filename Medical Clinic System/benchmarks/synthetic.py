@@ -0,0 +1,103 @@
+import datetime
+import hashlib
+import math
+import os
+import pickle
+import random
+from clinic.dao.patient_codec import encode_patients
+from clinic.dao.record_store import record_store
+from clinic.note import Note
+from clinic.patient import Patient
+
+FIRST_NAMES = ["John", "Mary", "Ali", "Jin", "Joe", "Aiman", "Krishna", "Sofia", "Liam", "Olivia",
+               "Noah", "Emma", "Mohammed", "Fatima", "Wei", "Yuki", "Carlos", "Ana", "Ivan", "Priya"]
+LAST_NAMES = ["Doe", "Mesbah", "Hu", "Hancock", "Singh", "Gupta", "Smith", "Nguyen", "Garcia", "Kim",
+              "Brown", "Martin", "Tremblay", "Roy", "Wilson", "Chen", "Patel", "Lee", "Taylor", "Majumdar"]
+STREETS = ["Moss St", "Fairfield Rd", "Admirals Rd", "Douglas St", "Foul Bay Rd", "Cook St", "Yates St"]
+CITIES = ["Victoria", "Saanich", "Esquimalt", "Oak Bay", "Langford"]
+WORDS = ["patient", "comes", "with", "headache", "and", "high", "blood", "pressure", "complains", "of",
+         "strong", "pain", "on", "the", "back", "neck", "says", "BP", "is", "controlled", "taking",
+         "Losartan", "50mg", "feels", "general", "improvement", "no", "more", "dizziness", "chest",
+         "referred", "to", "cardiology", "follow-up", "in", "two", "weeks", "prescribed", "rest"]
+
+USERNAME = "bench"
+PASSWORD = "bench"
+
+
+class SyntheticClinic():
+    ''' Reproducible generator of clinic data in the layout the DAOs read '''
+
+    def __init__(self, patients, notes_mean=5, notes_distribution='poisson', note_words=40, seed=0):
+        ''' Describe a clinic of the given size; the same seed always yields the same data '''
+        self.patients = patients
+        self.notes_mean = notes_mean
+        self.notes_distribution = notes_distribution
+        self.note_words = note_words
+        self.seed = seed
+
+    def notes_count(self, rng):
+        ''' Number of notes of the next patient, drawn from the configured distribution '''
+        if self.notes_distribution == 'fixed':
+            return self.notes_mean
+        if self.notes_distribution == 'uniform':
+            return rng.randint(0, 2 * self.notes_mean)
+        if self.notes_distribution == 'poisson':
+            # Knuth's method is fine for the small means used here
+            limit, count, product = math.exp(-self.notes_mean), 0, rng.random()
+            while product > limit:
+                count += 1
+                product *= rng.random()
+            return count
+        if self.notes_distribution == 'pareto':
+            # A few patients with very long records, most with short ones
+            return min(int(rng.paretovariate(1.5) * self.notes_mean / 3), 100 * self.notes_mean)
+        raise ValueError(f'unknown notes distribution: {self.notes_distribution}')
+
+    def note_text(self, rng):
+        words = max(1, int(rng.lognormvariate(0, 0.5) * self.note_words))
+        return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+    def iter_patients(self):
+        ''' Yield (patient, notes) pairs; phns are 9000000001, 9000000002, ... '''
+        rng = random.Random(self.seed)
+        start = datetime.datetime(2020, 1, 1)
+        for i in range(1, self.patients + 1):
+            first = rng.choice(FIRST_NAMES)
+            last = rng.choice(LAST_NAMES)
+            birth_date = datetime.date(1930, 1, 1) + datetime.timedelta(days=rng.randrange(90 * 365))
+            patient = Patient(
+                self.phn(i),
+                f'{first} {last}',
+                birth_date.isoformat(),
+                f'250 {rng.randrange(100, 1000)} {rng.randrange(1000, 10000)}',
+                f'{first.lower()}.{last.lower()}{i}@example.com',
+                f'{rng.randrange(1, 9999)} {rng.choice(STREETS)}, {rng.choice(CITIES)}',
+                autosave=False
+            )
+            notes = {}
+            for code in range(1, self.notes_count(rng) + 1):
+                timestamp = start + datetime.timedelta(minutes=rng.randrange(5 * 365 * 24 * 60))
+                notes[code] = Note(code, self.note_text(rng), timestamp)
+            yield patient, notes
+
+    def phn(self, i):
+        return 9000000000 + i
+
+    def write(self, config):
+        ''' Write patients.json, the record files and users.txt where config points '''
+        os.makedirs(config.records_path(), exist_ok=True)
+        store = record_store(config)
+        patients = {}
+        notes_total = 0
+        for patient, notes in self.iter_patients():
+            patients[patient.phn] = patient
+            notes_total += len(notes)
+            if notes:
+                # Generated data, no need to fsync every record
+                store.save(patient.phn, pickle.dumps(notes), durable=False)
+        # Same encoding as PatientDAOJSON.save_patients
+        with open(config.patients_path(), 'wb') as file:
+            file.write(encode_patients(patients.values(), config.patients_layout))
+        with open(config.users_path(), 'w') as file:
+            file.write(f'{USERNAME},{hashlib.sha256(PASSWORD.encode("utf-8")).hexdigest()}\n')
+        return notes_total
@@ -1,21 +1,59 @@
 import os
 import sys
 from clinic.cli.clinic_cli import ClinicCLI
-import clinic.gui.clinic_gui
+from clinic.cli.script_cli import ScriptCLI
+from clinic.profiling import profiler, DEFAULT_PROFILE_DIR
 
 def main():
+	# Opt-in profiling for the whole session: --profile[=DIR] or CLINIC_PROFILE=DIR
+	profile_dir = os.environ.get('CLINIC_PROFILE')
+	for arg in list(sys.argv[1:]):
+		if arg == '--profile' or arg.startswith('--profile='):
+			sys.argv.remove(arg)
+			profile_dir = arg.partition('=')[2] or DEFAULT_PROFILE_DIR
+	if profile_dir:
+		profiler.start(profile_dir)
+
+	# Data directory of the clinic: --data-root=DIR or CLINIC_DATA_ROOT=DIR
+	for arg in list(sys.argv[1:]):
+		if arg.startswith('--data-root='):
+			sys.argv.remove(arg)
+			os.environ['CLINIC_DATA_ROOT'] = arg.partition('=')[2]
+
+	# Remote mode, the GUI and CLI use a clinic server: --server=URL or CLINIC_SERVER=URL
+	for arg in list(sys.argv[1:]):
+		if arg.startswith('--server='):
+			sys.argv.remove(arg)
+			os.environ['CLINIC_SERVER'] = arg.partition('=')[2]
+
+	# One server process owns the clinic data and serves the workstations
+	if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+		from clinic.server import main as serve
+		sys.exit(serve(sys.argv[2:]))
+
 	# You can run either a command-line interface (CLI) 
 	# or a graphical user interface (GUI) to your clinic.
+	# Scripting commands (patients, notes, export, changes, storage) run one operation and exit.
+	if len(sys.argv) > 1 and sys.argv[1] in ScriptCLI.COMMANDS:
+		sys.exit(ScriptCLI().run(sys.argv[1:]))
+
 	if len(sys.argv) != 2:
 		print('ERROR: wrong number of arguments')
 		print('\nCorrect Command usage:')
 		print('python -m clinic option')
 		print('where option is either cli or gui')
+		print('or: python -m clinic {patients,notes,export,changes,storage} [args]')
+		print('or: python -m clinic serve [--host HOST] [--port PORT]')
+		print('add --profile[=DIR] to capture cProfile and tracemalloc data')
+		print('add --data-root=DIR to use clinic data stored in DIR')
+		print('add --server=URL to use the clinic server at URL')
 		sys.exit()
 
 	if sys.argv[1] == 'cli':
 		ClinicCLI()
 	elif sys.argv[1] == 'gui':
+		# PyQt6 is only loaded when the GUI is requested
+		import clinic.gui.clinic_gui
 		clinic.gui.clinic_gui.main()
 	else:
 		print('ERROR: Wrong argument')
@@ -0,0 +1,184 @@
+import csv
+import datetime
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from clinic.patient import Patient
+
+PATIENT_FIELDS = ["phn", "name", "birth_date", "phone", "email", "address"]
+NOTE_FIELDS = ["phn", "text", "timestamp"]
+
+
+def read_rows(file, fmt):
+    ''' Lazily yield (row_number, row) pairs from a CSV or NDJSON stream '''
+    if fmt == 'csv':
+        for row_number, row in enumerate(csv.DictReader(file), 1):
+            yield row_number, row
+    elif fmt == 'ndjson':
+        for row_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield row_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                # Let the validation step reject the row
+                yield row_number, str(e)
+    else:
+        raise ValueError(f'unknown import format: {fmt}')
+
+
+def detect_format(path):
+    ''' Guess the import format from the file name '''
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def validate_patient_row(item):
+    ''' Validate and normalize a patient row; runs in a worker process '''
+    row_number, row = item
+    if not isinstance(row, dict):
+        return row_number, None, f'malformed row: {row}'
+    try:
+        missing = [field for field in PATIENT_FIELDS if row.get(field) in (None, '')]
+        if missing:
+            return row_number, None, 'missing ' + ', '.join(missing)
+        phn = int(str(row['phn']).strip())
+        if phn <= 0:
+            return row_number, None, f'invalid PHN {phn}'
+        birth_date = datetime.date.fromisoformat(str(row['birth_date']).strip()).isoformat()
+        email = str(row['email']).strip()
+        if '@' not in email:
+            return row_number, None, f'invalid email {email}'
+        name = ' '.join(str(row['name']).split())
+        phone = str(row['phone']).strip()
+        address = str(row['address']).strip()
+    except ValueError as e:
+        return row_number, None, str(e)
+    return row_number, (phn, name, birth_date, phone, email, address), None
+
+
+def validate_note_row(item):
+    ''' Validate and normalize a note row; runs in a worker process '''
+    row_number, row = item
+    if not isinstance(row, dict):
+        return row_number, None, f'malformed row: {row}'
+    try:
+        if row.get('phn') in (None, '') or row.get('text') is None:
+            return row_number, None, 'missing phn or text'
+        phn = int(str(row['phn']).strip())
+        timestamp = row.get('timestamp')
+        timestamp = datetime.datetime.fromisoformat(timestamp) if timestamp else None
+    except (ValueError, TypeError) as e:
+        return row_number, None, str(e)
+    return row_number, (phn, str(row['text']), timestamp), None
+
+
+class ImportReport():
+    ''' Running totals of an import '''
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.rejected = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.read / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return '%d rows read, %d imported, %d rejected in %.1fs (%.0f rows/s)' % (
+            self.read, self.imported, self.rejected, self.elapsed, self.rows_per_second)
+
+
+class BulkImporter():
+    ''' Streams patients and notes into the DAOs in validated batches '''
+
+    def __init__(self, patient_dao, batch_size=10000, workers=None, progress=None, on_reject=None):
+        ''' Construct an importer; workers=0 validates in the calling process '''
+        self.patient_dao = patient_dao
+        self.batch_size = batch_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.progress = progress
+        self.on_reject = on_reject
+
+    def import_patients(self, file, fmt='ndjson'):
+        ''' Import patients, rejecting rows whose PHN already exists '''
+        return self.run(read_rows(file, fmt), validate_patient_row, self.write_patients)
+
+    def import_notes(self, file, fmt='ndjson'):
+        ''' Import notes into the records of existing patients '''
+        return self.run(read_rows(file, fmt), validate_note_row, self.write_notes)
+
+    def run(self, rows, validate, write):
+        report = ImportReport()
+        executor = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            while True:
+                batch = list(itertools.islice(rows, self.batch_size))
+                if not batch:
+                    break
+                report.read += len(batch)
+                if executor:
+                    chunksize = max(1, len(batch) // (self.workers * 4))
+                    results = executor.map(validate, batch, chunksize=chunksize)
+                else:
+                    results = map(validate, batch)
+
+                valid = []
+                for row_number, values, error in results:
+                    if error:
+                        self.reject(report, row_number, error)
+                    else:
+                        valid.append((row_number, values))
+
+                report.imported += write(valid, report)
+                report.batches += 1
+                if self.progress:
+                    self.progress(report)
+        finally:
+            if executor:
+                executor.shutdown()
+        return report
+
+    def reject(self, report, row_number, reason):
+        report.rejected += 1
+        if self.on_reject:
+            self.on_reject(row_number, reason)
+
+    def write_patients(self, valid, report):
+        ''' Add a batch of patients with a single save of the patients file '''
+        new_patients = []
+        seen = set()
+        for row_number, (phn, name, birth_date, phone, email, address) in valid:
+            if phn in seen or self.patient_dao.search_patient(phn):
+                self.reject(report, row_number, f'PHN {phn} is already registered')
+                continue
+            seen.add(phn)
+            new_patients.append(Patient(phn, name, birth_date, phone, email, address,
+                self.patient_dao.autosave, self.patient_dao.change_log, self.patient_dao.config))
+        if new_patients:
+            self.patient_dao.create_patients(new_patients)
+        return len(new_patients)
+
+    def write_notes(self, valid, report):
+        ''' Add a batch of notes with a single save per touched record '''
+        by_patient = {}
+        for row_number, (phn, text, timestamp) in valid:
+            patient = self.patient_dao.search_patient(phn)
+            if not patient:
+                self.reject(report, row_number, f'there is no patient registered with PHN {phn}')
+                continue
+            by_patient.setdefault(phn, (patient, []))[1].append((text, timestamp))
+        imported = 0
+        for patient, entries in by_patient.values():
+            imported += len(patient.create_notes(entries))
+        return imported
@@ -1,4 +1,4 @@
-from clinic.controller import Controller
+from clinic.remote_controller import controller_from_environ
 from clinic.exception.invalid_login_exception import InvalidLoginException
 from clinic.exception.duplicate_login_exception import DuplicateLoginException
 from clinic.cli.main_menu_cli import MainMenuCLI
@@ -7,7 +7,8 @@ from getpass import getpass
 class ClinicCLI():
 
 	def __init__(self):
-		self.controller = Controller(autosave=True)
+		# local Controller, or a RemoteController when CLINIC_SERVER is set
+		self.controller = controller_from_environ()
 		self.main_menu_cli = MainMenuCLI(self.controller)
 		self.login_menu()
 
@@ -25,6 +26,7 @@ class ClinicCLI():
 					self.main_menu_cli.main_menu()
 			elif response == 2:
 				print('\nSESSION FINISHED.')
+				self.controller.close()
 				break
 			else:
 				print('\nWRONG CHOICE. Please pick a choice between 1 and 2.')
@@ -46,8 +46,11 @@ class MainMenuCLI():
                     print('\nLOGGED OUT.')
                     input('Type ENTER to continue.')
                     break
+            elif response == 9:
+                self.toggle_profiling()
+                input('Type ENTER to continue.')
             else:
-                print('\nWRONG CHOICE. Please pick a choice between 1 and 8.')
+                print('\nWRONG CHOICE. Please pick a choice between 1 and 9.')
                 input('Type ENTER to continue.')
         return
 
@@ -61,6 +64,10 @@ class MainMenuCLI():
         print('6 - List all patients')
         print('7 - Start appointment with patient')
         print('8 - Log out')
+        if self.controller.is_profiling():
+            print('9 - Stop profiling')
+        else:
+            print('9 - Start profiling')
 
     def create_patient(self):
         print('ADD NEW PATIENT:')
@@ -207,6 +214,19 @@ class MainMenuCLI():
             print('\nERROR STARTING APPOINTMENT.') 
             print('There is no patient registered with PHN %d.' % phn)
 
+    def toggle_profiling(self):
+        try:
+            if self.controller.is_profiling():
+                paths = self.controller.stop_profiling()
+                print('\nPROFILING STOPPED. Files written:')
+                for path in paths:
+                    print(path)
+            else:
+                self.controller.start_profiling()
+                print('\nPROFILING STARTED.')
+        except IllegalAccessException:
+            print('\nMUST LOGIN FIRST.')
+
     def logout(self):
         try:
             self.controller.logout()
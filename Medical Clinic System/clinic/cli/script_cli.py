@@ -0,0 +1,386 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from clinic.remote_controller import controller_from_environ
+from clinic.bulk_import import detect_format
+from clinic.export import ClinicExporter, patient_to_dict, note_to_dict
+from clinic.dao.change_log import ChangeLog
+from clinic.storage_config import StorageConfig
+from clinic.exception.invalid_login_exception import InvalidLoginException
+from clinic.exception.illegal_access_exception import IllegalAccessException
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+from clinic.exception.no_current_patient_exception import NoCurrentPatientException
+
+# Exit codes returned by ScriptCLI.run
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_LOGIN = 3
+EXIT_NOT_FOUND = 4
+EXIT_CONFLICT = 5
+# the clinic server, or the data directory, could not be reached
+EXIT_UNAVAILABLE = 6
+
+PATIENT_FIELDS = ["phn", "name", "birth_date", "phone", "email", "address"]
+NOTE_FIELDS = ["code", "timestamp", "text"]
+
+
+class ScriptCLI():
+    ''' non-interactive command-line interface, one operation per invocation '''
+
+    COMMANDS = ('patients', 'notes', 'export', 'changes', 'storage')
+
+    def __init__(self, controller=None, stdout=None, stderr=None, environ=None):
+        self.controller = controller
+        self.stdout = stdout if stdout is not None else sys.stdout
+        self.stderr = stderr if stderr is not None else sys.stderr
+        self.environ = environ if environ is not None else os.environ
+        self.parser = self.build_parser()
+
+    def build_parser(self):
+        # options shared by every command
+        common = argparse.ArgumentParser(add_help=False)
+        common.add_argument('--credentials-file',
+            help='file holding "username,password"; defaults to the '
+                 'CLINIC_USERNAME and CLINIC_PASSWORD environment variables')
+        common.add_argument('--format', choices=['text', 'ndjson', 'csv'], default='text',
+            help='output format for listed records (default: text)')
+
+        # options shared by the import commands
+        importing = argparse.ArgumentParser(add_help=False)
+        importing.add_argument('file', help='CSV or NDJSON file, or - for standard input')
+        importing.add_argument('--input-format', choices=['csv', 'ndjson'],
+            help='format of the file (default: from the file name)')
+        importing.add_argument('--batch-size', type=int, default=10000,
+            help='rows validated and saved together (default: 10000)')
+        importing.add_argument('--workers', type=int,
+            help='validation processes (default: one per CPU, 0 validates in process)')
+
+        parser = argparse.ArgumentParser(prog='python -m clinic',
+            description='Run a single clinic operation and exit.')
+        groups = parser.add_subparsers(dest='group', required=True)
+
+        # patients subcommands
+        patients = groups.add_parser('patients', help='patient operations')
+        patient_commands = patients.add_subparsers(dest='command', required=True)
+
+        patient_commands.add_parser('list', help='list all patients', parents=[common])
+
+        command = patient_commands.add_parser('search', help='search a patient by PHN', parents=[common])
+        command.add_argument('phn', type=int)
+
+        command = patient_commands.add_parser('retrieve', help='retrieve patients by name', parents=[common])
+        command.add_argument('name')
+
+        command = patient_commands.add_parser('create', help='add a new patient', parents=[common])
+        command.add_argument('--phn', type=int, required=True)
+        for field in PATIENT_FIELDS[1:]:
+            command.add_argument('--' + field.replace('_', '-'), dest=field, required=True)
+
+        command = patient_commands.add_parser('update', help='change patient data', parents=[common])
+        command.add_argument('original_phn', type=int)
+        command.add_argument('--phn', type=int)
+        for field in PATIENT_FIELDS[1:]:
+            command.add_argument('--' + field.replace('_', '-'), dest=field)
+
+        command = patient_commands.add_parser('delete', help='remove a patient', parents=[common])
+        command.add_argument('phn', type=int)
+
+        command = patient_commands.add_parser('import', help='add patients from a CSV or NDJSON file', parents=[common, importing])
+
+        # notes subcommands, always against one patient's record
+        notes = groups.add_parser('notes', help='note operations on a patient record')
+        note_commands = notes.add_subparsers(dest='command', required=True)
+
+        command = note_commands.add_parser('list', help='list the full patient record', parents=[common])
+        command.add_argument('phn', type=int)
+
+        command = note_commands.add_parser('get', help='show a note by number', parents=[common])
+        command.add_argument('phn', type=int)
+        command.add_argument('code', type=int)
+
+        command = note_commands.add_parser('search', help='retrieve notes by text', parents=[common])
+        command.add_argument('phn', type=int)
+        command.add_argument('text')
+
+        command = note_commands.add_parser('create', help='add a note, - reads standard input', parents=[common])
+        command.add_argument('phn', type=int)
+        command.add_argument('text')
+
+        command = note_commands.add_parser('update', help='change a note, - reads standard input', parents=[common])
+        command.add_argument('phn', type=int)
+        command.add_argument('code', type=int)
+        command.add_argument('text')
+
+        command = note_commands.add_parser('delete', help='remove a note', parents=[common])
+        command.add_argument('phn', type=int)
+        command.add_argument('code', type=int)
+
+        note_commands.add_parser('import', help='add notes from a CSV or NDJSON file', parents=[common, importing])
+
+        storage = groups.add_parser('storage', help='record storage maintenance')
+        storage_commands = storage.add_subparsers(dest='command', required=True)
+        command = storage_commands.add_parser('stats', help='show record counts and wasted space as JSON', parents=[common])
+        command.add_argument('--workers', type=int, help='threads scanning the records directory')
+        command = storage_commands.add_parser('gc', help='reclaim records left without a patient', parents=[common])
+        command.add_argument('--dry-run', action='store_true', help='only report what would be reclaimed')
+        command.add_argument('--workers', type=int, help='threads scanning the records directory')
+
+        # export reads the data files directly and needs no session
+        command = groups.add_parser('export', help='stream the whole clinic to NDJSON',
+            description='Stream the whole clinic to NDJSON. Patients are streamed from patients.json '
+                        'in the objects layout; in the columns layout the file is decoded in memory '
+                        'as a whole, so memory grows with the number of patients.')
+        command.add_argument('output', help='NDJSON output file')
+        command.add_argument('--gzip', action='store_true', help='gzip compress the output')
+        command.add_argument('--checkpoint', help='file recording export progress')
+        command.add_argument('--resume', action='store_true',
+            help='continue from the last checkpoint instead of starting over')
+
+        # changes reads the change log directly and needs no session
+        command = groups.add_parser('changes', help='stream the changes after a sequence number as NDJSON')
+        command.add_argument('--since', type=int, default=0,
+            help='last sequence number already synced (default: 0, every change)')
+
+        return parser
+
+    def run(self, argv):
+        ''' runs one command and returns the process exit code '''
+        try:
+            args = self.parser.parse_args(argv)
+        except SystemExit as e:
+            return e.code if e.code is not None else EXIT_OK
+
+        if args.group == 'export':
+            return self.export(args)
+        if args.group == 'changes':
+            return self.changes(args)
+
+        credentials = self.read_credentials(args)
+        if credentials is None:
+            self.error('no credentials: set CLINIC_USERNAME and CLINIC_PASSWORD or use --credentials-file')
+            return EXIT_LOGIN
+
+        try:
+            if self.controller is None:
+                self.controller = controller_from_environ(self.environ)
+            self.controller.login(*credentials)
+        except InvalidLoginException as e:
+            self.error(str(e))
+            return EXIT_LOGIN
+        except OSError as e:
+            # e.g. ConnectionRefusedError when --server names no running server
+            self.error('cannot reach the clinic: %s' % e)
+            return EXIT_UNAVAILABLE
+
+        try:
+            handler = getattr(self, '%s_%s' % (args.group, args.command))
+            return handler(args)
+        except (IllegalAccessException, NoCurrentPatientException) as e:
+            self.error(str(e) or 'operation not allowed')
+            return EXIT_ERROR
+        except IllegalOperationException as e:
+            self.error(str(e) or 'operation conflicts with the data in the clinic')
+            return EXIT_CONFLICT
+        except OSError as e:
+            self.error(str(e))
+            return EXIT_ERROR
+        finally:
+            try:
+                self.controller.unset_current_patient()
+                self.controller.logout()
+            except OSError:
+                # the server went away during the command, the error is already reported
+                pass
+
+    def read_credentials(self, args):
+        ''' returns (username, password) from the credentials file or the environment '''
+        if args.credentials_file:
+            try:
+                with open(args.credentials_file, 'r') as file:
+                    line = file.readline().strip()
+            except OSError:
+                return None
+            if ',' not in line:
+                return None
+            username, password = line.split(',', 1)
+            return username, password
+        username = self.environ.get('CLINIC_USERNAME')
+        password = self.environ.get('CLINIC_PASSWORD')
+        if username is None or password is None:
+            return None
+        return username, password
+
+    def error(self, message):
+        print('error: %s' % message, file=self.stderr)
+
+    # helper method that streams records in the requested format
+    def write_records(self, records, fields, to_dict, fmt):
+        writer = None
+        for record in records:
+            if fmt == 'ndjson':
+                self.stdout.write(json.dumps(to_dict(record)) + '\n')
+            elif fmt == 'csv':
+                if writer is None:
+                    writer = csv.DictWriter(self.stdout, fieldnames=fields, lineterminator='\n')
+                    writer.writeheader()
+                writer.writerow(to_dict(record))
+            else:
+                self.stdout.write(str(record) + '\n')
+
+    def write_patients(self, patients, fmt):
+        self.write_records(patients, PATIENT_FIELDS, patient_to_dict, fmt)
+
+    def write_notes(self, notes, fmt):
+        self.write_records(notes, NOTE_FIELDS, note_to_dict, fmt)
+
+    def read_text(self, text):
+        return sys.stdin.read() if text == '-' else text
+
+    def patients_list(self, args):
+        self.write_patients(self.controller.list_patients(), args.format)
+        return EXIT_OK
+
+    def patients_search(self, args):
+        patient = self.controller.search_patient(args.phn)
+        if not patient:
+            self.error('there is no patient registered with PHN %d' % args.phn)
+            return EXIT_NOT_FOUND
+        self.write_patients([patient], args.format)
+        return EXIT_OK
+
+    def patients_retrieve(self, args):
+        found_patients = self.controller.retrieve_patients(args.name)
+        self.write_patients(found_patients, args.format)
+        return EXIT_OK if found_patients else EXIT_NOT_FOUND
+
+    def patients_create(self, args):
+        patient = self.controller.create_patient(args.phn, args.name, args.birth_date,
+            args.phone, args.email, args.address)
+        self.write_patients([patient], args.format)
+        return EXIT_OK
+
+    def patients_update(self, args):
+        patient = self.controller.search_patient(args.original_phn)
+        if not patient:
+            self.error('there is no patient registered with PHN %d' % args.original_phn)
+            return EXIT_NOT_FOUND
+        # update only fields that were given
+        values = [getattr(args, field) for field in PATIENT_FIELDS]
+        values = [value if value is not None else getattr(patient, field)
+            for field, value in zip(PATIENT_FIELDS, values)]
+        self.controller.update_patient(args.original_phn, *values)
+        return EXIT_OK
+
+    def patients_delete(self, args):
+        if not self.controller.search_patient(args.phn):
+            self.error('there is no patient registered with PHN %d' % args.phn)
+            return EXIT_NOT_FOUND
+        self.controller.delete_patient(args.phn)
+        return EXIT_OK
+
+    def storage_stats(self, args):
+        self.stdout.write(json.dumps(self.controller.storage_stats(args.workers), indent=4) + '\n')
+        return EXIT_OK
+
+    def storage_gc(self, args):
+        report = self.controller.collect_garbage(args.dry_run, args.workers)
+        self.stdout.write(json.dumps(report, indent=4) + '\n')
+        return EXIT_OK
+
+    def export(self, args):
+        try:
+            report = ClinicExporter().export(args.output, compress=args.gzip,
+                checkpoint_path=args.checkpoint, resume=args.resume)
+        except (OSError, ValueError) as e:
+            self.error(str(e))
+            return EXIT_ERROR
+        print(report, file=self.stderr)
+        return EXIT_OK
+
+    def changes(self, args):
+        last = args.since
+        for entry in ChangeLog(StorageConfig.from_environ().changes_path()).changes_since(args.since):
+            self.stdout.write(json.dumps(entry) + '\n')
+            last = entry["seq"]
+        # downstream systems pass this back as --since on the next sync
+        print('last sequence %d' % last, file=self.stderr)
+        return EXIT_OK
+
+    # helper method that streams an import file through the bulk importer
+    def run_import(self, args, import_records):
+        fmt = args.input_format or ('ndjson' if args.file == '-' else detect_format(args.file))
+        file = sys.stdin if args.file == '-' else open(args.file, 'r', newline='')
+        try:
+            report = import_records(file, fmt, batch_size=args.batch_size, workers=args.workers,
+                progress=lambda report: print(report, file=self.stderr),
+                on_reject=lambda row_number, reason: self.error('row %d rejected: %s' % (row_number, reason)))
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        if not report.batches:
+            print(report, file=self.stderr)
+        return EXIT_OK if not report.rejected else EXIT_CONFLICT
+
+    def patients_import(self, args):
+        return self.run_import(args, self.controller.import_patients)
+
+    # helper method that runs a note operation inside an appointment with the patient
+    def start_appointment(self, phn):
+        try:
+            self.controller.set_current_patient(phn)
+        except IllegalOperationException:
+            self.error('there is no patient registered with PHN %d' % phn)
+            return False
+        return True
+
+    def notes_import(self, args):
+        return self.run_import(args, self.controller.import_notes)
+
+    def notes_list(self, args):
+        if not self.start_appointment(args.phn):
+            return EXIT_NOT_FOUND
+        self.write_notes(self.controller.list_notes(), args.format)
+        return EXIT_OK
+
+    def notes_get(self, args):
+        if not self.start_appointment(args.phn):
+            return EXIT_NOT_FOUND
+        note = self.controller.search_note(args.code)
+        if not note:
+            self.error('there is no note registered with number %d' % args.code)
+            return EXIT_NOT_FOUND
+        self.write_notes([note], args.format)
+        return EXIT_OK
+
+    def notes_search(self, args):
+        if not self.start_appointment(args.phn):
+            return EXIT_NOT_FOUND
+        found_notes = self.controller.retrieve_notes(args.text)
+        self.write_notes(found_notes, args.format)
+        return EXIT_OK if found_notes else EXIT_NOT_FOUND
+
+    def notes_create(self, args):
+        if not self.start_appointment(args.phn):
+            return EXIT_NOT_FOUND
+        note = self.controller.create_note(self.read_text(args.text))
+        self.write_notes([note], args.format)
+        return EXIT_OK
+
+    def notes_update(self, args):
+        if not self.start_appointment(args.phn):
+            return EXIT_NOT_FOUND
+        if not self.controller.update_note(args.code, self.read_text(args.text)):
+            self.error('there is no note registered with number %d' % args.code)
+            return EXIT_NOT_FOUND
+        return EXIT_OK
+
+    def notes_delete(self, args):
+        if not self.start_appointment(args.phn):
+            return EXIT_NOT_FOUND
+        if not self.controller.delete_note(args.code):
+            self.error('there is no note registered with number %d' % args.code)
+            return EXIT_NOT_FOUND
+        return EXIT_OK
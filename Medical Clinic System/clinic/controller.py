@@ -9,25 +9,103 @@ from clinic.exception.illegal_operation_exception import IllegalOperationExcepti
 from clinic.exception.no_current_patient_exception import NoCurrentPatientException
 from clinic.dao.note_dao_pickle import NoteDAOPickle
 from clinic.dao.patient_dao_json import PatientDAOJSON
+from clinic.storage_config import StorageConfig
+from clinic.session import Session
+from clinic.query_cache import QueryCache
+from clinic.rwlock import ReadWriteLock
+from clinic.transaction import Transaction, current_transaction
+from clinic.events import EventBus, PatientCreated, PatientUpdated, PatientRekeyed, PatientDeleted, \
+	NoteCreated, NoteUpdated, NoteDeleted, DataImported
+from clinic.bulk_import import BulkImporter
+from clinic.metrics import registry, timed
+from clinic.profiling import profiler, DEFAULT_PROFILE_DIR
+from clinic.storage_maintenance import storage_stats, collect_garbage
+import contextlib
+import functools
 import hashlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def mutation(method):
+	''' runs a change of the patients, waiting while another thread's transaction is open.
+		patients.json is shared whole: the data root lock is held from the catch-up to the save '''
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		# inside its own transaction the thread already holds the gate
+		if current_transaction():
+			return method(self, *args, **kwargs)
+		# versions are compared with, and whole files saved over, what other processes saved last;
+		# none of them saves until this mutation is saved and logged
+		with self.data_lock:
+			self.patient_dao.recover()
+			self.catch_up()
+			with self.write_gate.read_lock():
+				return method(self, *args, **kwargs)
+	return wrapper
+
+
+def note_mutation(method):
+	''' runs a change of the current patient's record, waiting while another thread's
+		transaction is open. No data root lock: the record DAO serializes the changes of its
+		patient and compares note versions, other patients and workstations go on meanwhile '''
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		if current_transaction():
+			return method(self, *args, **kwargs)
+		self.patient_dao.recover()
+		self.catch_up()
+		with self.write_gate.read_lock():
+			return method(self, *args, **kwargs)
+	return wrapper
 
 
 class Controller():
 	''' controller class that receives the system's operations '''
 	
-	def __init__(self, autosave):
-		''' construct a controller class '''
-		self.username = None
-		self.password = None
-		self.logged = False
-		self.autosave = autosave  # Store the autosave parameter
+	def __init__(self, autosave, config=None, shared=None, cache_size=256, load_workers=0, warm_start=False):
+		''' construct a controller class; with shared, reuse that controller's data.
+			load_workers threads read the patient records at startup, 0 reads them one by one.
+			with warm_start, startup reads the snapshot close() left and each record on first use '''
+		# login and current patient belong to this controller only
+		self.session = Session()
+		# set to stop the polling started by watch()
+		self.watcher = None
+
+		if shared:
+			# another session over the same patients, users and locks
+			self.autosave = shared.autosave
+			self.config = shared.config
+			self.patient_dao = shared.patient_dao
+			self.users = shared.users
+			self.cache = shared.cache
+			self.events = shared.events
+			self.write_gate = shared.write_gate
+			self.data_lock = shared.data_lock
+			return
 
-		self.patient_dao = PatientDAOJSON(autosave=self.autosave)
-		self.current_patient = None
+		self.autosave = autosave  # Store the autosave parameter
+		# where the clinic files live, CLINIC_DATA_ROOT or 'clinic' by default
+		self.config = config if config else StorageConfig.from_environ()
+
+		self.patient_dao = PatientDAOJSON(autosave=self.autosave, config=self.config, load_workers=load_workers,
+			warm_start=warm_start)
+		# results of the listing and retrieval queries, shared by every session
+		self.cache = QueryCache(cache_size)
+		# change notifications of every session; the cache is the first subscriber
+		self.events = EventBus()
+		self.events.subscribe(self.cache.apply_event)
+		# mutations share it, a transaction takes it alone until it commits or rolls back
+		self.write_gate = ReadWriteLock()
+		# taken before the gate by every mutation and transaction, shared with the other processes
+		self.data_lock = self.patient_dao.data_lock
 
 		self.users = {}
 		if self.autosave:
-			with open('clinic/users.txt', 'r') as file:
+			with open(self.config.users_path(), 'r') as file:
 				for line in file:
 					line = line.strip()
 					linearr = line.split(',')
@@ -40,6 +118,35 @@ class Controller():
 				"ali" : self.get_password_hash("@G00dPassw0rd")
 				}
 
+		# optionally dump the operation metrics to a file every minute
+		metrics_file = os.environ.get('CLINIC_METRICS_FILE')
+		if metrics_file:
+			registry.start_dump(metrics_file, float(os.environ.get('CLINIC_METRICS_INTERVAL', 60)))
+
+
+	def open_session(self):
+		''' new controller with its own login sharing this controller's data '''
+		return Controller(self.autosave, shared=self)
+
+	@property
+	def username(self):
+		return self.session.username
+
+	@property
+	def password(self):
+		return self.session.password
+
+	@property
+	def logged(self):
+		return self.session.logged
+
+	@property
+	def current_patient(self):
+		return self.session.current_patient
+
+	@current_patient.setter
+	def current_patient(self, patient):
+		self.session.current_patient = patient
 		
 	def get_password_hash(self, password):
 		# Learn a bit about password hashes by reading this code
@@ -49,32 +156,195 @@ class Controller():
 		return hex_dig
 	
 
+	def cache_stats(self):
+		''' hits, misses and size of the query result cache '''
+		return self.cache.stats()
+
+	def subscribe(self, callback, *event_types):
+		''' call callback(event) after every mutation of the given event types, all when none '''
+		return self.events.subscribe(callback, *event_types)
+
+	def unsubscribe(self, callback):
+		''' stop notifying callback '''
+		self.events.unsubscribe(callback)
+
+	def cached(self, key, compute):
+		# a transaction reads its own uncommitted changes, the cache only learns of them at commit
+		if current_transaction():
+			return compute()
+		return self.cache.lookup(key, compute)
+
+	def notify(self, event):
+		# inside a transaction the subscribers only learn about committed changes
+		transaction = current_transaction()
+		if transaction:
+			transaction.events.append(event)
+		else:
+			self.events.publish(event)
+
+	@contextlib.contextmanager
+	def transaction(self):
+		''' groups the mutations of the block into one durable commit;
+			an exception inside the block rolls them all back '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		# a nested block is part of the enclosing transaction
+		if current_transaction():
+			yield current_transaction()
+			return
+
+		# other processes wait for the commit, the versions checked in the block stay current
+		with self.data_lock:
+			# a commit that failed after its journal was written is finished before the next one
+			self.patient_dao.recover()
+			self.catch_up()
+			with self.write_gate.write_lock():
+				transaction = Transaction(self.config.journal_path())
+				transaction.begin()
+				try:
+					yield transaction
+					transaction.commit()
+				except BaseException:
+					if not transaction.durable:
+						transaction.rollback()
+						# results read inside the block may hold rolled back data
+						self.cache.clear()
+					raise
+				finally:
+					transaction.end()
+		for event in transaction.events:
+			self.events.publish(event)
+
+	def storage_stats(self, workers=None):
+		''' patient and record counts, bytes per record and wasted space on disk '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		return storage_stats(self.config, [patient.phn for patient in self.patient_dao.list_patients()], workers)
+
+	def collect_garbage(self, dry_run=False, workers=None):
+		''' user reclaims the records left without a patient; returns what was reclaimed '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		# without autosave the patients in memory are not the ones whose records are on disk
+		if not self.autosave or current_transaction():
+			raise IllegalOperationException
+
+		# no record may be saved while the orphans are found and removed, here or by
+		# another process sharing the data root
+		with self.data_lock:
+			self.catch_up()
+			with self.write_gate.write_lock():
+				# the file decides, a patient another process saved is never taken for an orphan
+				phns = {patient.phn for patient in self.patient_dao.list_patients()}
+				phns.update(self.patient_dao.stored_phns())
+				return collect_garbage(self.config, phns, dry_run, workers)
+
+	def refresh(self):
+		''' picks up the patients and notes other processes saved to the data directory since,
+			e.g. other workstations sharing it, and notifies the subscribers; returns the events '''
+		# a transaction would commit over what is merged here
+		if current_transaction():
+			raise IllegalOperationException
+
+		with self.write_gate.write_lock():
+			events = self.patient_dao.refresh()
+		for event in events:
+			self.events.publish(event)
+		return events
+
+	def catch_up(self):
+		''' refreshes if another process may have saved patients or notes since the last refresh '''
+		if self.patient_dao.changed_on_disk():
+			self.refresh()
+
+	def watch(self, interval=2.0):
+		''' refreshes every interval seconds in a daemon thread until stop_watching() '''
+		self.stop_watching()
+		stop = self.watcher = threading.Event()
+
+		def run():
+			while not stop.wait(interval):
+				try:
+					self.refresh()
+				except Exception:
+					# the next poll tries again, the clinic goes on with what it has
+					logger.exception('refresh of %s failed', self.config.data_root)
+
+		threading.Thread(target=run, name='clinic-watcher', daemon=True).start()
+
+	def stop_watching(self):
+		if self.watcher:
+			self.watcher.set()
+			self.watcher = None
+
+	def close(self):
+		''' shuts the clinic down cleanly, leaving the warm-start snapshot for the next start;
+			call it once, when no session uses the clinic anymore '''
+		self.stop_watching()
+		# a transaction still open would put uncommitted patients in the snapshot
+		with self.write_gate.write_lock():
+			self.patient_dao.close()
+
+	def metrics(self):
+		''' snapshot of the latency of every operation run so far '''
+		return registry.snapshot()
+
+	def dump_metrics_periodically(self, file_path, interval=60):
+		''' write the metrics snapshot to file_path every interval seconds '''
+		registry.start_dump(file_path, interval)
+
+	def start_profiling(self, output_dir=DEFAULT_PROFILE_DIR, cpu=True, memory=True):
+		''' user starts capturing cProfile and tracemalloc data '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		return profiler.start(output_dir, cpu, memory)
+
+	def stop_profiling(self):
+		''' user stops the capture; returns the files written '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		return profiler.stop()
+
+	def is_profiling(self):
+		''' whether a profiling capture is running '''
+		return profiler.active
+
+	@timed('controller.login')
 	def login(self, username, password):
 		''' user logs in the system '''
 		if self.logged:
 			raise DuplicateLoginException("User is already logged in")
 		if username in self.users:
 			if self.get_password_hash(password) == self.users[username]:
-				self.username = username
-				self.password = self.get_password_hash(password)
-				self.logged = True
+				self.session.username = username
+				self.session.password = self.get_password_hash(password)
+				self.session.logged = True
 				return True
 			else:
 				raise InvalidLoginException("Invalid login, enter the correct password")
 		else:
 			raise InvalidLoginException("User is not registered")
 
+	@timed('controller.logout')
 	def logout(self):
 		''' user logs out from the system '''
 		if not self.logged:
 			raise InvalidLogoutException("User is already logged out")
 		else:
-			self.username = None
-			self.password = None
-			self.logged = False
-			self.current_patient = None
+			self.session.clear()
 			return True
 
+	@timed('controller.search_patient')
 	def search_patient(self, phn):
 		''' user searches a patient '''
 		# must be logged in to do operation
@@ -83,6 +353,8 @@ class Controller():
 
 		return self.patient_dao.search_patient(phn)
 
+	@timed('controller.create_patient')
+	@mutation
 	def create_patient(self, phn, name, birth_date, phone, email, address):
 		''' user creates a patient '''
 		# must be logged in to do operation
@@ -90,19 +362,36 @@ class Controller():
 			raise IllegalAccessException("User has to be logged in to perform operation")
 
 		create_patient = Patient(phn, name, birth_date, phone, email, address, self.autosave)
-		return self.patient_dao.create_patient(create_patient)
+		created = self.patient_dao.create_patient(create_patient)
+		self.notify(PatientCreated(created))
+		return created
 
+	@timed('controller.retrieve_patients')
 	def retrieve_patients(self, name):
 		''' user retrieves the patients that satisfy a search criterion '''
 		# must be logged in to do operation
 		if not self.logged:
 			raise IllegalAccessException("User has to be logged in to perform operation")
 
-		return self.patient_dao.retrieve_patients(name)
+		return list(self.cached(('retrieve_patients', name), lambda: self.patient_dao.retrieve_patients(name)))
+
+	@timed('controller.find_patients')
+	def find_patients(self, **criteria):
+		''' user finds the patients matching every criterion, e.g. phone, email, birth_date
+			or a birth_date_from and birth_date_to range; ValueError for an unknown criterion '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		return list(self.cached(('find_patients', tuple(sorted(criteria.items()))),
+			lambda: self.patient_dao.find_patients(**criteria)))
 	
 
-	def update_patient(self, original_phn, phn, name, birth_date, phone, email, address):
-		''' user updates a patient '''
+	@timed('controller.update_patient')
+	@mutation
+	def update_patient(self, original_phn, phn, name, birth_date, phone, email, address, version=None):
+		''' user updates a patient; with the version the user read, ConflictException
+			if the patient was changed since '''
 
 		# must be logged in to do operation
 		if not self.logged:
@@ -120,10 +409,17 @@ class Controller():
 			if curr_patient == self.current_patient:
 				raise IllegalOperationException
 			
-		return self.patient_dao.update_patient(original_phn, phn, name, birth_date, phone, email, address)
-
-	def delete_patient(self, phn):
-		''' user deletes a patient '''
+		original_name = curr_patient.name
+		updated = self.patient_dao.update_patient(original_phn, phn, name, birth_date, phone, email, address, version)
+		event = PatientRekeyed if original_phn != phn else PatientUpdated
+		self.notify(event(curr_patient, original_phn, original_name))
+		return updated
+
+	@timed('controller.delete_patient')
+	@mutation
+	def delete_patient(self, phn, version=None):
+		''' user deletes a patient; with the version the user read, ConflictException
+			if the patient was changed since '''
 		# must be logged in to do operation
 		if not self.logged:
 			raise IllegalAccessException("User has to be logged in to perform operation")
@@ -140,17 +436,61 @@ class Controller():
 			if patient == self.current_patient:
 				raise IllegalOperationException
 
-		return self.patient_dao.delete_patient(phn)
+		deleted = self.patient_dao.delete_patient(phn, version)
+		self.notify(PatientDeleted(patient))
+		return deleted
 
+	@timed('controller.list_patients')
 	def list_patients(self):
 		''' user lists all patients '''
 		# must be logged in to do operation
 		if not self.logged:
 			raise IllegalAccessException("User has to be logged in to perform operation")
 
-		return self.patient_dao.list_patients()
+		return list(self.cached(('list_patients',), self.patient_dao.list_patients))
+
+	@timed('controller.import_patients')
+	@mutation
+	def import_patients(self, file, fmt='ndjson', **options):
+		''' user bulk imports patients from a CSV or NDJSON stream '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		report = None
+		try:
+			report = BulkImporter(self.patient_dao, **options).import_patients(file, fmt)
+			return report
+		finally:
+			# imports write through the DAOs directly, even a failed one may have saved batches
+			self.notify(DataImported('patients', report))
+
+	@timed('controller.import_notes')
+	@note_mutation
+	def import_notes(self, file, fmt='ndjson', **options):
+		''' user bulk imports notes into existing patient records '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		report = None
+		try:
+			report = BulkImporter(self.patient_dao, **options).import_notes(file, fmt)
+			return report
+		finally:
+			self.notify(DataImported('notes', report))
+
+	@timed('controller.changes_since')
+	def changes_since(self, sequence=0):
+		''' user lists the patient and note changes after a sequence number '''
+		# must be logged in to do operation
+		if not self.logged:
+			raise IllegalAccessException("User has to be logged in to perform operation")
+
+		return list(self.patient_dao.change_log.changes_since(sequence))
 	
 #-------------------------------------------------------------------------------------------
+	@timed('controller.set_current_patient')
 	def set_current_patient(self, phn):
 		''' user sets the current patient '''
 
@@ -165,6 +505,7 @@ class Controller():
 			raise IllegalOperationException
 
 
+	@timed('controller.get_current_patient')
 	def get_current_patient(self):
 		''' get the current patient '''
 		# must be logged in to do operation
@@ -174,6 +515,7 @@ class Controller():
 		# return current patient
 		return self.current_patient
 
+	@timed('controller.unset_current_patient')
 	def unset_current_patient(self):
 		''' unset the current patient '''
 
@@ -186,6 +528,7 @@ class Controller():
 #-------------------------------------------------------------------------------------------
 
 
+	@timed('controller.search_note')
 	def search_note(self, code):
 		''' user searches a note from the current patient's record '''
 		# must be logged in to do operation
@@ -199,6 +542,8 @@ class Controller():
 		# search a new note with the given code and return it 
 		return self.current_patient.search_note(code)
 
+	@timed('controller.create_note')
+	@note_mutation
 	def create_note(self, text):
 		''' user creates a note in the current patient's record '''
 		# must be logged in to do operation
@@ -210,8 +555,11 @@ class Controller():
 			raise NoCurrentPatientException
 
 		# create a new note and return it
-		return self.current_patient.create_note(text)
+		note = self.current_patient.create_note(text)
+		self.notify(NoteCreated(self.current_patient.phn, note))
+		return note
 
+	@timed('controller.retrieve_notes')
 	def retrieve_notes(self, search_string):
 		''' user retrieves the notes from the current patient's record
 			that satisfy a search string '''
@@ -224,10 +572,15 @@ class Controller():
 			raise NoCurrentPatientException
 
 		# return the found notes
-		return self.current_patient.retrieve_notes(search_string)
-
-	def update_note(self, code, new_text):
-		''' user updates a note from the current patient's record '''
+		patient = self.current_patient
+		return list(self.cached(('retrieve_notes', patient.phn, search_string),
+			lambda: patient.retrieve_notes(search_string)))
+
+	@timed('controller.update_note')
+	@note_mutation
+	def update_note(self, code, new_text, version=None):
+		''' user updates a note from the current patient's record; with the version
+			the user read, ConflictException if the note was changed since '''
 		# must be logged in to do operation
 		if not self.logged:
 			raise IllegalAccessException("User has to be logged in to perform operation")
@@ -236,11 +589,19 @@ class Controller():
 		if not self.current_patient:
 			raise NoCurrentPatientException
 
-		# update note
-		return self.current_patient.update_note(code, new_text)
-
-	def delete_note(self, code):
-		''' user deletes a note from the current patient's record '''
+		# update note, keeping the old text for the subscribers
+		note = self.current_patient.search_note(code)
+		old_text = note.text if note else None
+		updated = self.current_patient.update_note(code, new_text, version)
+		if updated:
+			self.notify(NoteUpdated(self.current_patient.phn, note, old_text))
+		return updated
+
+	@timed('controller.delete_note')
+	@note_mutation
+	def delete_note(self, code, version=None):
+		''' user deletes a note from the current patient's record; with the version
+			the user read, ConflictException if the note was changed since '''
 		# must be logged in to do operation
 		if not self.logged:
 			raise IllegalAccessException("User has to be logged in to perform operation")
@@ -250,8 +611,13 @@ class Controller():
 			raise NoCurrentPatientException
 
 		# delete note
-		return self.current_patient.delete_note(code)
+		note = self.current_patient.search_note(code)
+		deleted = self.current_patient.delete_note(code, version)
+		if deleted:
+			self.notify(NoteDeleted(self.current_patient.phn, note))
+		return deleted
 
+	@timed('controller.list_notes')
 	def list_notes(self):
 		''' user lists all notes from the current patient's record '''
 		# must be logged in to do operation
@@ -262,4 +628,5 @@ class Controller():
 		if not self.current_patient:
 			raise NoCurrentPatientException
 
-		return self.current_patient.list_notes()
+		patient = self.current_patient
+		return list(self.cached(('list_notes', patient.phn), patient.list_notes))
@@ -0,0 +1,230 @@
+import contextlib
+import datetime
+import json
+import os
+import threading
+from clinic.file_lock import file_lock
+from clinic.transaction import current_transaction
+from clinic.export import patient_to_dict, note_to_dict
+
+
+def read_tail(file):
+    ''' (sequence of the last complete entry, offset after it) of an open log file. A last line
+    without its newline is being appended by another process, or was torn by a crash: skipped. '''
+    size = file.seek(0, os.SEEK_END)
+    start = size
+    block = b''
+    # Read backwards until a complete line is in the block
+    while start > 0 and block.count(b'\n') < 2:
+        start = max(0, start - 4096)
+        file.seek(start)
+        block = file.read(size - start)
+    block = block[:block.rfind(b'\n') + 1]
+    for line in reversed(block.split(b'\n')):
+        try:
+            return json.loads(line)["seq"], start + len(block)
+        except (ValueError, KeyError):
+            # Skip the partial first line of the block
+            continue
+    return 0, start + len(block)
+
+
+def log_lock(file_path):
+    ''' The FileLock every process holds while it numbers and appends entries of the log at
+    file_path. Its own lock file: only writers of the log wait for each other on it. '''
+    return file_lock(file_path + '.lock')
+
+
+def append_to_log(file, data):
+    ''' Append data to a log file open in 'a+b' mode and return the offset after it. A line torn
+    by a crash is cut off first so the data starts on a fresh line; only a process holding the
+    append lock may do so, nobody else can be in the middle of an append then. '''
+    size = file.seek(0, os.SEEK_END)
+    if size:
+        file.seek(size - 1)
+        if file.read(1) != b'\n':
+            file.truncate(read_tail(file)[1])
+    file.write(data)
+    return file.tell()
+
+
+class ChangeLog():
+    ''' Append-only log of patient and note mutations with a monotonic sequence '''
+
+    def __init__(self, file_path=os.path.join('clinic', 'changes.log'), autosave=True):
+        ''' Initialize the change log, continuing the sequence found on disk '''
+        self.file_path = file_path
+        self.autosave = autosave
+        # Entries are only kept in memory when autosave is disabled
+        self.entries = []
+        # Numbering and appending happen together so the file stays in sequence order
+        self.lock = threading.Lock()
+        self.file_lock = log_lock(file_path) if autosave else contextlib.nullcontext()
+        # Bytes of the file written or read here, the entries of other processes come after
+        self.sequence, self.offset = self.read_end() if autosave else (0, 0)
+
+    def load_sequence(self):
+        ''' Read the sequence of the last entry without scanning the whole log '''
+        return self.read_end()[0]
+
+    def read_end(self):
+        ''' (sequence of the last complete entry, offset after it) of the file; nothing is changed '''
+        try:
+            file = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            return 0, 0
+        with file:
+            return read_tail(file)
+
+    def size(self):
+        ''' Bytes in the log file, where the entries appended from now on start '''
+        try:
+            return os.path.getsize(self.file_path)
+        except FileNotFoundError:
+            return 0
+
+    def read_from(self, offset):
+        ''' The complete entries appended to the file from byte offset on, and the offset after
+        them; the entries are None if the file is shorter than offset, as after a replacement '''
+        try:
+            file = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            return (None, 0) if offset else ([], 0)
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            if size < offset:
+                return None, 0
+            file.seek(offset)
+            block = file.read(size - offset)
+        # A line still being written is read again by the next call
+        block = block[:block.rfind(b'\n') + 1]
+        entries = []
+        for line in block.splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        if entries:
+            # Entries of other processes are numbered too, new ones come after them
+            self.sequence = max(self.sequence, max(entry["seq"] for entry in entries))
+        return entries, offset + len(block)
+
+    def tail(self):
+        ''' The entries other processes appended since the last call, None if the file was replaced '''
+        with self.lock:
+            entries, self.offset = self.read_from(self.offset)
+            return entries
+
+    def unread(self):
+        ''' Whether the file holds entries tail() has not returned yet '''
+        return self.size() != self.offset
+
+    @contextlib.contextmanager
+    def numbering(self):
+        ''' Number and append entries one process and thread at a time, continuing from
+        the last entry in the file, whichever process appended it '''
+        with self.file_lock, self.lock:
+            if self.autosave:
+                self.sequence = max(self.sequence, self.load_sequence())
+            yield
+
+    def make_entry(self, entity, operation, phn, code=None, data=None):
+        self.sequence += 1
+        entry = {
+            "seq": self.sequence,
+            "timestamp": datetime.datetime.now().isoformat(),
+            "entity": entity,
+            "op": operation,
+            "phn": phn
+        }
+        if code is not None:
+            entry["code"] = code
+        if data is not None:
+            entry["data"] = data
+        return entry
+
+    def format(self, entries):
+        return ''.join(json.dumps(entry) + '\n' for entry in entries)
+
+    def append(self, entries):
+        ''' Persist new entries with one write, or at commit inside a transaction '''
+        if not entries:
+            return
+        transaction = current_transaction()
+        if transaction:
+            transaction.log(self, entries)
+        elif self.autosave:
+            os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok=True)
+            data = self.format(entries).encode('utf-8')
+            with open(self.file_path, 'a+b') as file:
+                end = append_to_log(file, data)
+            # Written where the last read stopped, nothing of another process is skipped
+            if end - len(data) == self.offset:
+                self.offset = end
+        else:
+            self.entries.extend(entries)
+
+    def renumber(self, entries):
+        ''' Number the entries of a transaction again after the last entry in the file, if other
+        processes appended since they were numbered; call inside numbering() '''
+        # Other threads of this process waited for the transaction, only other processes numbered
+        self.sequence = max(entries[0]["seq"] - 1, self.load_sequence())
+        for entry in entries:
+            self.sequence += 1
+            entry["seq"] = self.sequence
+
+    def committed(self, entries):
+        ''' Note that a transaction commit appended entries to the file, they are not another
+        process's; call inside numbering() '''
+        length = len(self.format(entries).encode('utf-8'))
+        end = self.size()
+        if end - length == self.offset:
+            self.offset = end
+
+    def patient_changed(self, operation, patient, original_phn=None):
+        ''' Record a created, updated or deleted patient '''
+        data = patient_to_dict(patient) if operation != 'delete' else None
+        with self.numbering():
+            entry = self.make_entry('patient', operation, patient.phn, data=data)
+            if original_phn is not None and original_phn != patient.phn:
+                entry["original_phn"] = original_phn
+            self.append([entry])
+
+    def patients_created(self, patients):
+        ''' Record a batch of created patients '''
+        with self.numbering():
+            self.append([self.make_entry('patient', 'create', patient.phn, data=patient_to_dict(patient))
+                         for patient in patients])
+
+    def note_changed(self, operation, phn, note):
+        ''' Record a created, updated or deleted note '''
+        data = note_to_dict(note) if operation != 'delete' else None
+        with self.numbering():
+            self.append([self.make_entry('note', operation, phn, code=note.code, data=data)])
+
+    def notes_created(self, phn, notes):
+        ''' Record a batch of created notes '''
+        with self.numbering():
+            self.append([self.make_entry('note', 'create', phn, code=note.code, data=note_to_dict(note))
+                         for note in notes])
+
+    def changes_since(self, sequence=0):
+        ''' Yield the entries recorded after the given sequence number, oldest first '''
+        if not self.autosave:
+            for entry in list(self.entries):
+                if entry["seq"] > sequence:
+                    yield entry
+            return
+        try:
+            file = open(self.file_path, 'r')
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line is not a committed change
+                    continue
+                if entry["seq"] > sequence:
+                    yield entry
@@ -10,10 +10,10 @@ class NoteDAO(ABC):
     def retrieve_notes(self, search_string):
         pass
     @abstractmethod
-    def update_note(self, key, text):
+    def update_note(self, key, text, version=None):
         pass
     @abstractmethod
-    def delete_note(self, key):
+    def delete_note(self, key, version=None):
         pass
     @abstractmethod
     def list_notes(self):
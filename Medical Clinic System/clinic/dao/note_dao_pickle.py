@@ -1,107 +1,321 @@
-import os
 import pickle
+import threading
 import time
 from clinic.dao.note_dao import NoteDAO
 from clinic.note import Note
+from clinic.metrics import timed
+from clinic.storage_config import StorageConfig
+from clinic.rwlock import ReadWriteLock
+from clinic.dao.record_store import record_store
+from clinic.transaction import current_transaction
+from clinic.events import NoteCreated, NoteUpdated, NoteDeleted
+from clinic.exception.conflict_exception import ConflictException
 import datetime
 
+# Taken by the first reader of a record not loaded at startup, so only one of them reads it
+_load_lock = threading.Lock()
+
 
 class NoteDAOPickle(NoteDAO):
     ''' DAO class for managing notes using pickle serialization '''
 
-    def __init__(self, phn=None, autosave=True):
-        ''' Initialize the NoteDAOPickle '''
+    def __init__(self, phn=None, autosave=True, change_log=None, config=None, load=True):
+        ''' Initialize the NoteDAOPickle; with load=False the notes are loaded on first use,
+        unless a warm-up sets them before '''
         self.phn = phn
         self.autosave = autosave
-        self.file_path = f'clinic/records/{self.phn}.dat'
+        # Optional ChangeLog shared by the whole clinic
+        self.change_log = change_log
+        self.config = config if config else StorageConfig()
+        # One file per record or segment files, looked up on first use
+        self._store = None
+
+        # Readers share the record, mutations of this patient's notes are serialized
+        self.lock = ReadWriteLock()
 
-        # Initialize the notes dictionary and code counter
-        self.notes = {}
-        self.code_counter = 0
+        # Initialize the notes dictionary and code counter, None until the record is loaded
+        self._notes = {}
+        self._code_counter = 0
+        # Stamp of the record as last loaded or saved here, to notice saves of other processes
+        self.record_stamp = None
 
         # Load notes if autosave is enabled
         if self.autosave:
-            self.load_notes()
+            if load:
+                self.load_notes()
+            else:
+                self._notes = None
+
+    @property
+    def store(self):
+        ''' The record store of the configuration '''
+        if self._store is None:
+            self._store = record_store(self.config)
+        return self._store
+
+    @property
+    def file_path(self):
+        return self.config.record_path(self.phn)
+
+    @property
+    def notes(self):
+        ''' The notes by code, loaded from the record on first use '''
+        if self._notes is None:
+            self.ensure_loaded()
+        return self._notes
+
+    @notes.setter
+    def notes(self, notes):
+        self._notes = notes
 
+    @property
+    def code_counter(self):
+        ''' The highest code given to a note of the record '''
+        if self._notes is None:
+            self.ensure_loaded()
+        return self._code_counter
+
+    @code_counter.setter
+    def code_counter(self, code_counter):
+        self._code_counter = code_counter
+
+    def is_loaded(self):
+        return self._notes is not None
+
+    def ensure_loaded(self):
+        ''' Load a record left out at startup '''
+        with _load_lock:
+            if self._notes is None:
+                self.load_notes()
+
+    @timed('dao.load_notes')
     def load_notes(self):
         ''' Load notes from the patient's record file '''
-        if os.path.exists(self.file_path):
-            with open(self.file_path, 'rb') as file:
-                # Load the notes dictionary
-                self.notes = pickle.load(file)
-                # Update the code counter to the highest existing code
-                if self.notes:
-                    self.code_counter = max(self.notes.keys())
-                else:
-                    self.code_counter = 0
+        transaction = current_transaction()
+        if transaction and transaction.discarded(self.config, self.phn):
+            # A patient removed earlier in the transaction left this PHN without a record
+            notes, stamp = None, None
         else:
-            # If file doesn't exist, start with empty notes and counter at 0
-            self.notes = {}
-            self.code_counter = 0
+            # Taken first, a save of another process during the load shows at the next refresh
+            stamp = self.store.stamp(self.phn)
+            # A torn record is restored from its previous generation
+            notes = self.store.load(self.phn, pickle.loads)
+        self.set_notes(notes if notes is not None else {}, stamp)
+
+    def set_notes(self, notes, stamp=None):
+        ''' Use notes as loaded from the record with the given stamp '''
+        self.record_stamp = stamp
+        # Update the code counter to the highest existing code, 0 for an empty record
+        self._code_counter = max(notes.keys()) if notes else 0
+        # Load the notes dictionary, set last: it marks the record loaded
+        self._notes = notes
+
+    def serialize(self):
+        ''' Return the content of the record file for the current notes '''
+        return pickle.dumps(self.notes)
 
+    @timed('dao.save_notes')
     def save_notes(self):
         ''' Save the current notes to the patient's record file '''
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
-        with open(self.file_path, 'wb') as file:
-            # Serialize the notes dictionary into the binary file
-            pickle.dump(self.notes, file)
+        # Replaced atomically, a crash leaves either the old or the new record
+        self.store.save(self.phn, self.serialize())
+        self.committed()
+
+    def persist(self):
+        ''' Save after a mutation, or at commit when a transaction is open '''
+        if not self.autosave:
+            return
+        transaction = current_transaction()
+        if transaction:
+            transaction.defer(self)
+        else:
+            self.save_notes()
+
+    def sync(self):
+        ''' Reload the record if another process saved it since; call with the write lock held.
+        Note versions are then compared with, and the record saved over, the last save of any
+        process. Within a transaction the block already caught up and holds unsaved changes. '''
+        if not self.autosave or not self.is_loaded() or current_transaction():
+            return
+        stamp = self.store.stamp(self.phn)
+        if stamp != self.record_stamp:
+            notes = self.store.load(self.phn, pickle.loads)
+            self.set_notes(notes if notes is not None else {}, stamp)
+
+    def check_writable(self):
+        ''' Raise IllegalOperationException before a mutation the record store could not save,
+        e.g. record segments written by another process; nothing is changed in memory then '''
+        if self.autosave:
+            self.store.check_writable()
+
+    def set_phn(self, phn):
+        self.phn = phn
+
+    def rekey(self, new_phn):
+        ''' Move the record to a new PHN; it stays stored under the old one until discard '''
+        with self.lock.write_lock():
+            # The notes move with the record, a record not loaded yet is read under the old PHN
+            self.ensure_loaded()
+            self.remember()
+            self.set_phn(new_phn)
+            # An empty record needs no file under the new PHN
+            if self.notes:
+                self.persist()
+
+    def discard(self, phn=None):
+        ''' Drop the stored record of phn, by default this record's own '''
+        phn = self.phn if phn is None else phn
+        with self.lock.write_lock():
+            if not self.autosave:
+                return
+            transaction = current_transaction()
+            if transaction:
+                transaction.discard(self, phn)
+            else:
+                self.store.delete(phn)
+
+    def committed(self):
+        ''' Note that the record now holds the current notes '''
+        self.record_stamp = self.store.stamp(self.phn)
+
+    def refresh(self):
+        ''' Load the record again if another process saved it since it was loaded here;
+        returns the events of the notes this changed '''
+        with self.lock.write_lock():
+            # A record not loaded yet is read as it is when first used
+            if not self.autosave or not self.is_loaded():
+                return []
+            stamp = self.store.stamp(self.phn)
+            if stamp == self.record_stamp:
+                return []
+            previous = self._notes
+            notes = self.store.load(self.phn, pickle.loads)
+            self.set_notes(notes if notes is not None else {}, stamp)
+
+            events = [NoteDeleted(self.phn, note) for code, note in previous.items() if code not in self._notes]
+            for code, note in self._notes.items():
+                old = previous.get(code)
+                if old is None:
+                    events.append(NoteCreated(self.phn, note))
+                elif old.text != note.text:
+                    events.append(NoteUpdated(self.phn, note, old.text))
+            return events
+
+    def batch_write(self):
+        ''' The save of this record as a transaction journal entry '''
+        return ('record', self.config, self.phn, self.serialize())
+
+    def remember(self):
+        ''' Let an open transaction keep the notes for a rollback '''
+        transaction = current_transaction()
+        if transaction:
+            transaction.remember_notes(self)
 
     def search_note(self, code):
         ''' Search for a note by code '''
-        return self.notes.get(code)
+        with self.lock.read_lock():
+            return self.notes.get(code)
 
     def create_note(self, text):
         ''' Add a new note '''
-        # Increment the code counter
-        self.code_counter += 1
-        code = self.code_counter
-        timestamp = datetime.datetime.now()
-        note = Note(code=code, text=text, timestamp=timestamp)
-        self.notes[code] = note
-
-        # Save notes if autosave is enabled
-        if self.autosave:
-            self.save_notes()
+        with self.lock.write_lock():
+            self.check_writable()
+            self.sync()
+            self.remember()
+            # Increment the code counter
+            self.code_counter += 1
+            code = self.code_counter
+            timestamp = datetime.datetime.now()
+            note = Note(code=code, text=text, timestamp=timestamp)
+            self.notes[code] = note
 
-        return note
+            # Save notes if autosave is enabled
+            self.persist()
 
-    def retrieve_notes(self, search_string):
-        ''' Retrieve notes that contain the search string '''
-        retrieved_notes = []
-        for note in self.notes.values():
-            if search_string in note.text:
-                retrieved_notes.append(note)
-        return retrieved_notes
+            if self.change_log:
+                self.change_log.note_changed('create', self.phn, note)
 
-    def update_note(self, code, new_text):
-        ''' Update an existing note '''
-        note = self.notes.get(code)
-        if not note:
-            return False
+            return note
 
-        note.text = new_text
+    def create_notes(self, entries):
+        ''' Add several notes given as (text, timestamp) pairs with a single save '''
+        with self.lock.write_lock():
+            self.check_writable()
+            self.sync()
+            self.remember()
+            created = []
+            for text, timestamp in entries:
+                self.code_counter += 1
+                note = Note(code=self.code_counter, text=text,
+                            timestamp=timestamp if timestamp else datetime.datetime.now())
+                self.notes[note.code] = note
+                created.append(note)
 
-        # Save notes if autosave is enabled
-        if self.autosave:
-            self.save_notes()
+            # Save notes once for the whole batch if autosave is enabled
+            if created:
+                self.persist()
 
-        return True
+            if self.change_log:
+                self.change_log.notes_created(self.phn, created)
 
-    def delete_note(self, code):
-        ''' Remove a note by code '''
-        if code in self.notes:
-            del self.notes[code]
+            return created
+
+    def retrieve_notes(self, search_string):
+        ''' Retrieve notes that contain the search string '''
+        with self.lock.read_lock():
+            retrieved_notes = []
+            for note in self.notes.values():
+                if search_string in note.text:
+                    retrieved_notes.append(note)
+            return retrieved_notes
+
+    def update_note(self, code, new_text, version=None):
+        ''' Update an existing note; with version, only if the note is still at that version '''
+        with self.lock.write_lock():
+            self.sync()
+            note = self.notes.get(code)
+            if not note:
+                return False
+            if version is not None and note.version != version:
+                raise ConflictException("note %d of %s is at version %d, not %d" % (code, self.phn, note.version, version))
+
+            self.check_writable()
+            self.remember()
+            note.text = new_text
+            note.version += 1
 
             # Save notes if autosave is enabled
-            if self.autosave:
-                self.save_notes()
+            self.persist()
+
+            if self.change_log:
+                self.change_log.note_changed('update', self.phn, note)
 
             return True
-        else:
-            return False
+
+    def delete_note(self, code, version=None):
+        ''' Remove a note by code; with version, only if the note is still at that version '''
+        with self.lock.write_lock():
+            self.sync()
+            if code in self.notes:
+                if version is not None and self.notes[code].version != version:
+                    raise ConflictException("note %d of %s is at version %d, not %d" % (code, self.phn,
+                                            self.notes[code].version, version))
+                self.check_writable()
+                self.remember()
+                note = self.notes.pop(code)
+
+                # Save notes if autosave is enabled
+                self.persist()
+
+                if self.change_log:
+                    self.change_log.note_changed('delete', self.phn, note)
+
+                return True
+            else:
+                return False
 
     def list_notes(self):
         ''' List all notes in reverse order '''
-        # Return notes sorted by code in descending order
-        return sorted(self.notes.values(), key=lambda note: note.code, reverse=True)
\ No newline at end of file
+        with self.lock.read_lock():
+            # Return notes sorted by code in descending order
+            return sorted(self.notes.values(), key=lambda note: note.code, reverse=True)
\ No newline at end of file
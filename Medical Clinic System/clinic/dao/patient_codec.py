@@ -0,0 +1,61 @@
+import json
+
+try:
+    # Optional, parses and writes JSON several times faster than the json module
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fields of a patient row, in Patient argument order
+FIELDS = ("phn", "name", "birth_date", "phone", "email", "address", "version")
+# 'objects' keeps one object per patient keyed by PHN, as the clinic always did;
+# 'columns' keeps one array per field, the first key of the file names the layout
+LAYOUTS = ('objects', 'columns')
+LAYOUT_KEY = '__layout__'
+
+
+def dumps(value):
+    ''' Compact JSON of value as bytes '''
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    ''' The value of JSON bytes '''
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode('utf-8'))
+
+
+def encode_patients(patients, layout='objects'):
+    ''' The content of patients.json for patients in the given layout '''
+    if layout not in LAYOUTS:
+        raise ValueError(f'unknown patients layout {layout!r}, choose from {", ".join(LAYOUTS)}')
+    patients = list(patients)
+    if layout == 'columns':
+        value = {LAYOUT_KEY: 'columns'}
+        for field in FIELDS:
+            value[field] = [getattr(patient, field) for patient in patients]
+        return dumps(value)
+    return dumps({str(patient.phn): {
+        "__type__": "Patient",
+        "phn": patient.phn,
+        "name": patient.name,
+        "birth_date": patient.birth_date,
+        "phone": patient.phone,
+        "email": patient.email,
+        "address": patient.address,
+        "version": patient.version
+    } for patient in patients})
+
+
+def decode_rows(data):
+    ''' The patient rows (phn, name, birth_date, phone, email, address, version) of the
+    content of patients.json in either layout, indented or not, in file order '''
+    value = loads(data)
+    if value.get(LAYOUT_KEY) == 'columns':
+        return list(zip(*(value[field] for field in FIELDS)))
+    # Files written before versions were kept hold every patient at its first version
+    return [(int(key), row["name"], row["birth_date"], row["phone"], row["email"], row["address"],
+             row.get("version", 1)) for key, row in value.items()]
@@ -10,10 +10,13 @@ class PatientDAO(ABC):
     def retrieve_patients(self, search_string):
         pass
     @abstractmethod
+    def find_patients(self, **criteria):
+        pass
+    @abstractmethod
     def update_patient(self, key, patient):
         pass
     @abstractmethod
-    def delete_patient(self, key):
+    def delete_patient(self, key, version=None):
         pass
     @abstractmethod
     def list_patients(self):
@@ -1,7 +1,21 @@
 from clinic.dao.patient_dao import PatientDAO
 from clinic.patient import Patient
 from clinic.note import Note
+from clinic.metrics import timed
+from clinic.dao.change_log import ChangeLog
+from clinic.storage_config import StorageConfig
+from clinic.rwlock import ReadWriteLock
+from clinic.file_lock import file_lock
+from clinic.durable_io import atomic_write, load_recovering, file_stamp
+from clinic.dao.record_loader import warm_up
+from clinic.dao.patient_snapshot import read_snapshot, write_snapshot
+from clinic.dao.patient_codec import encode_patients, decode_rows
+from clinic.dao.patient_index import PatientIndex, check_criteria, matches
+from clinic.transaction import current_transaction, recover_journal
+from clinic.events import PatientCreated, PatientUpdated, PatientDeleted
+import contextlib
 import json
+import os
 from clinic.patient import Patient
 from clinic.exception.invalid_login_exception import InvalidLoginException
 from clinic.exception.duplicate_login_exception import DuplicateLoginException
@@ -9,6 +23,7 @@ from clinic.exception.invalid_logout_exception import InvalidLogoutException
 from clinic.exception.illegal_access_exception import IllegalAccessException
 from clinic.exception.illegal_operation_exception import IllegalOperationException
 from clinic.exception.no_current_patient_exception import NoCurrentPatientException
+from clinic.exception.conflict_exception import ConflictException
 
 # Patient Encoder 
 class PatientEncoder(json.JSONEncoder):
@@ -23,16 +38,22 @@ class PatientEncoder(json.JSONEncoder):
                 "birth_date": obj.birth_date,
                 "phone": obj.phone,
                 "email": obj.email,
-                "address": obj.address
+                "address": obj.address,
+                "version": obj.version
             }
         # Otherwise, use the default encoding
         return super().default(obj)
 
 # Patient Decoder
 class PatientDecoder(json.JSONDecoder):
-    def __init__(self, autosave=True, *args, **kwargs):
+    def __init__(self, autosave=True, change_log=None, config=None, load_records=True, *args, **kwargs):
         # Save the autosave parameter to self.autosave
         self.autosave = autosave
+        # Without load_records the patients' notes are left for a parallel warm-up
+        self.load_records = load_records
+        # Change log and storage configuration handed to every patient record
+        self.change_log = change_log
+        self.config = config
         # Initialize the base class with the custom object_hook
         super().__init__(object_hook=self.object_hook, *args, **kwargs)
 
@@ -47,156 +68,407 @@ class PatientDecoder(json.JSONDecoder):
                 dct['phone'],
                 dct['email'],
                 dct['address'],
-                self.autosave
+                self.autosave,
+                self.change_log,
+                self.config,
+                self.load_records,
+                # Files written before versions were kept hold every patient at its first version
+                dct.get('version', 1)
             )
         # Otherwise, return the dictionary as is
         return dct
 
 # DAO class implementation
 class PatientDAOJSON(PatientDAO):
-    def __init__(self, autosave):
+    def __init__(self, autosave, config=None, load_workers=0, warm_start=False):
         # Store the autosave flag
         self.autosave = autosave
+        # Threads reading the record files at startup, 0 or 1 loads them one after the other
+        self.load_workers = load_workers
+        # Start from the snapshot written by close() while it matches the JSON file
+        self.warm_start = warm_start
+        # Stamp of the JSON file as last loaded or saved here, None before
+        self.file_stamp = None
+        # Storage locations, the historical relative paths by default
+        self.config = config if config else StorageConfig()
         # Set the file path for storing patient data
-        self.file_path = 'clinic/patients.json'
+        self.file_path = self.config.patients_path()
+        # Searches and listings run in parallel, patient mutations one at a time
+        self.lock = ReadWriteLock()
+        # Held across a whole mutation, from catching up to saving, by every process sharing the files
+        self.data_lock = file_lock(self.config.lock_path()) if autosave else contextlib.nullcontext()
+        # Every patient and note mutation gets a sequence number in the change log
+        self.change_log = ChangeLog(self.config.changes_path(), autosave=autosave)
+        # Secondary indexes for find_patients, built by its first call
+        self.index = None
 
         if autosave:
             """Initialize the patient DAO with in-memory storage and persistence."""
+            self.recover()
             # Load patients from the JSON file if autosave is enabled
             self.patients = self.load_patients()
         else:
             # Initialize an empty dictionary for patients if autosave is disabled
             self.patients = {}
 
+    def serialize(self):
+        """Return the content of the JSON file for the current patients."""
+        # Compact JSON in the configured layout, orjson writes it when installed
+        return encode_patients(self.patients.values(), self.config.patients_layout)
+
+    @timed('dao.save_patients')
     def save_patients(self):
         """Save the current patients to the JSON file."""
-        with open(self.file_path, 'w') as file:
-            # Serialize the patients dictionary into JSON format
-            json.dump(self.patients, file, cls=PatientEncoder, indent=4)
+        # Replaced atomically, a crash leaves either the old or the new file
+        atomic_write(self.file_path, self.serialize())
+        self.committed()
+
+    def committed(self):
+        """Note that the JSON file now holds the current patients."""
+        self.file_stamp = file_stamp(self.file_path)
+
+    def persist(self):
+        """Save after a mutation, or at commit when a transaction is open."""
+        if not self.autosave:
+            return
+        transaction = current_transaction()
+        if transaction:
+            transaction.defer(self)
+        else:
+            self.save_patients()
+
+    def recover(self):
+        """Finish a transaction a crash or a failed write interrupted between its journal and
+        its files; called before anything is saved, its journal would be replayed over it later."""
+        # Most calls find no journal, they take no lock
+        if not self.autosave or not os.path.exists(self.config.journal_path()):
+            return False
+        with self.data_lock:
+            return recover_journal(self.config.journal_path())
+
+    def batch_write(self):
+        """The save of the JSON file as a transaction journal entry."""
+        return ('file', self.file_path, self.serialize())
 
+    def remember(self, *keys):
+        """Let an open transaction keep the patients under keys for a rollback."""
+        transaction = current_transaction()
+        if transaction:
+            transaction.remember_patients(self, keys)
+
+    @timed('dao.load_patients')
     def load_patients(self):
-        """Load patients from the JSON file."""
-        try:
-            with open(self.file_path, 'r') as file:
-                # Load the patients data using the custom PatientDecoder
-                patients = json.load(file, cls=PatientDecoder, autosave=True)
-                # Convert all keys (PHNs) to integers and return the dictionary
-                return {int(k): v for k, v in patients.items()}
-
-        # Returning empty collection if file not found or JSON decode error
-        except FileNotFoundError:
-            return {}
-        except json.JSONDecodeError:
+        """Load patients from the snapshot if it is still valid, otherwise from the JSON file."""
+        if self.warm_start:
+            patients = self.load_snapshot()
+            if patients is not None:
+                return patients
+        parallel = self.load_workers > 1
+
+        def decode(data):
+            # Plain rows first, then every patient in one pass instead of in a hook per JSON object
+            return {row[0]: Patient(*row[:6], True, self.change_log, self.config, not parallel, row[6])
+                    for row in decode_rows(data)}
+
+        # A torn file is restored from its previous generation; empty collection if there is no file
+        patients = load_recovering(self.file_path, decode)
+        if patients is None:
             return {}
+        self.committed()
+        if parallel:
+            # The records were left out above, read them all at once
+            warm_up([patient.record.note_dao for patient in patients.values()], self.load_workers)
+        return patients
+
+    @timed('dao.refresh')
+    def refresh(self):
+        """Merge the patients and notes other processes saved since they were loaded here,
+        e.g. other workstations sharing the data directory; returns the events of the changes."""
+        if not self.autosave:
+            return []
+        events = []
+        # Every process logs its note changes after saving the record: only records with
+        # new entries are looked at, all loaded ones if the log was replaced meanwhile
+        entries = self.change_log.tail()
+        phns = None if entries is None else {entry["phn"] for entry in entries if entry["entity"] == 'note'}
+        with self.lock.write_lock():
+            # Taken first, a save of another process during the load shows at the next refresh
+            stamp = file_stamp(self.file_path)
+            if stamp is not None and stamp != self.file_stamp:
+                rows = load_recovering(self.file_path, decode_rows)
+                if rows is not None:
+                    events.extend(self.merge(rows))
+                    self.file_stamp = stamp
+            if phns is None:
+                patients = list(self.patients.values())
+            else:
+                patients = [self.patients[phn] for phn in phns if phn in self.patients]
+        # Records not loaded so far are skipped by their DAO, they are read fresh on first use
+        for patient in patients:
+            events.extend(patient.record.refresh())
+        return events
+
+    def stored_phns(self):
+        """The PHNs of the patients in the JSON file as it is on disk now."""
+        rows = load_recovering(self.file_path, decode_rows)
+        return {row[0] for row in rows} if rows else set()
+
+    def changed_on_disk(self):
+        """Whether another process may have saved patients or notes since the last refresh,
+        as far as two stats can tell."""
+        return self.autosave and (file_stamp(self.file_path) != self.file_stamp or self.change_log.unread())
+
+    def merge(self, rows):
+        """Make the patients those of rows, as decoded from the JSON file; returns the events.
+        Patients that stay keep their object and record, only their fields change."""
+        events = []
+        keys = {row[0] for row in rows}
+        for key in [key for key in self.patients if key not in keys]:
+            events.append(PatientDeleted(self.patients.pop(key)))
+            self.reindex(key)
+        for row in rows:
+            key, fields = row[0], row[1:]
+            patient = self.patients.get(key)
+            if patient is None:
+                # The record is read when first used
+                patient = Patient(key, *fields[:5], True, self.change_log, self.config, False, fields[5])
+                self.patients[key] = patient
+                self.reindex(key)
+                events.append(PatientCreated(patient))
+            elif (patient.name, patient.birth_date, patient.phone, patient.email, patient.address,
+                  patient.version) != fields:
+                original_name = patient.name
+                patient.name, patient.birth_date, patient.phone, patient.email, patient.address, \
+                    patient.version = fields
+                self.reindex(key)
+                events.append(PatientUpdated(patient, key, original_name))
+        return events
+
+    def load_snapshot(self):
+        """Patients of the snapshot taken of the current JSON file, None without one.
+        Their records are not read here, each is loaded when first used."""
+        stamp = file_stamp(self.file_path)
+        rows = read_snapshot(self.config.snapshot_path(), stamp) if stamp else None
+        if rows is None:
+            return None
+        self.file_stamp = stamp
+        return {row[0]: Patient(*row[:6], True, self.change_log, self.config, False, row[6]) for row in rows}
+
+    def close(self):
+        """Write the warm-start snapshot for the next start; call when the clinic is shut down."""
+        if not (self.autosave and self.warm_start):
+            return
+        with self.lock.read_lock():
+            # Only a JSON file holding the patients in memory may be vouched for,
+            # one replaced by another process since has patients this one never saw
+            if self.file_stamp is None or file_stamp(self.file_path) != self.file_stamp:
+                return
+            rows = [(patient.phn, patient.name, patient.birth_date, patient.phone, patient.email, patient.address,
+                     patient.version) for patient in self.patients.values()]
+            write_snapshot(self.config.snapshot_path(), self.file_stamp, rows)
 
     def search_patient(self, key):
         """Search for a patient by key (PHN)."""
-        # Retrieve the patient from the dictionary using the key
-        searched_patient = self.patients.get(key)
+        with self.lock.read_lock():
+            # Retrieve the patient from the dictionary using the key
+            searched_patient = self.patients.get(key)
 
-        # If the patient is not found, return None
-        if not searched_patient:
-            return None
+            # If the patient is not found, return None
+            if not searched_patient:
+                return None
 
-        # Return the found patient
-        return searched_patient
+            # Return the found patient
+            return searched_patient
 
     def create_patient(self, patient):
         """Add a new patient."""
-        # Use the patient's PHN as the key
-        key = patient.phn
-
-        # Check if a patient with the same PHN already exists
-        if self.patients.get(key):
-            # If so, raise an exception to prevent duplicate entries
-            raise IllegalOperationException
-
-        # Finally, create a new patient with the provided data and autosave flag
-        new_patient = Patient(
-            key,
-            patient.name,
-            patient.birth_date,
-            patient.phone,
-            patient.email,
-            patient.address,
-            self.autosave
-        )
-        # Add the new patient to the patients dictionary
-        self.patients[key] = new_patient
-
-        # Checking for persistence; if autosave is on, then save the collection to file
-        if self.autosave:
-            self.save_patients()
+        with self.lock.write_lock():
+            # Use the patient's PHN as the key
+            key = patient.phn
+
+            # Check if a patient with the same PHN already exists
+            if self.patients.get(key):
+                # If so, raise an exception to prevent duplicate entries
+                raise IllegalOperationException
+
+            self.remember(key)
+
+            # Finally, create a new patient with the provided data and autosave flag
+            new_patient = Patient(
+                key,
+                patient.name,
+                patient.birth_date,
+                patient.phone,
+                patient.email,
+                patient.address,
+                self.autosave,
+                self.change_log,
+                self.config
+            )
+            # Add the new patient to the patients dictionary
+            self.patients[key] = new_patient
+            self.reindex(key)
 
-        # Return the newly created patient
-        return new_patient
+            # Checking for persistence; if autosave is on, then save the collection to file
+            self.persist()
+
+            self.change_log.patient_changed('create', new_patient)
+
+            # Return the newly created patient
+            return new_patient
+
+    def create_patients(self, patients):
+        """Add several new patients with a single save."""
+        with self.lock.write_lock():
+            # Check every key first so a duplicate leaves the collection untouched
+            keys = set()
+            for patient in patients:
+                if patient.phn in keys or self.patients.get(patient.phn):
+                    raise IllegalOperationException
+                keys.add(patient.phn)
+
+            self.remember(*keys)
+
+            # The patients are stored as given, they already carry their records
+            for patient in patients:
+                self.patients[patient.phn] = patient
+            if self.index is not None:
+                self.index.add_all(patients)
+
+            # Checking for persistence; one save for the whole batch
+            self.persist()
+
+            self.change_log.patients_created(patients)
+
+            return patients
 
     def retrieve_patients(self, search_string):
         """Retrieve patients whose names contain the search string."""
-        retrieved_patients = []
-        # Iterate over all patients in the dictionary
-        for patient in self.patients.values():
-            # Check if the search string is in the patient's name
-            if search_string in patient.name:
-                # If so, add the patient to the retrieved list
-                retrieved_patients.append(patient)
-
-        # Return the list of retrieved patients
-        return retrieved_patients
-
-    def update_patient(self, original_phn, phn, name, birth_date, phone, email, address):
-        """Update an existing patient's details."""
-        # Retrieve the patient to be updated using the original PHN
-        up_patient = self.patients.get(original_phn)
-        # Set the new PHN
-        new_phn = phn
-
-        # Patient exists, update fields with new data
-        up_patient.name = name
-        up_patient.birth_date = birth_date
-        up_patient.phone = phone
-        up_patient.email = email
-        up_patient.address = address
-
-        # Treat different keys as a separate case
-        if original_phn != new_phn:
-            # Check if the new PHN already exists
-            if self.patients.get(new_phn):
+        with self.lock.read_lock():
+            retrieved_patients = []
+            # Iterate over all patients in the dictionary
+            for patient in self.patients.values():
+                # Check if the search string is in the patient's name
+                if search_string in patient.name:
+                    # If so, add the patient to the retrieved list
+                    retrieved_patients.append(patient)
+
+            # Return the list of retrieved patients
+            return retrieved_patients
+
+    def find_patients(self, **criteria):
+        """Retrieve the patients matching every criterion, in PHN order; see clinic.dao.patient_index.
+        Only the patients of the most selective index are looked at."""
+        check_criteria(criteria)
+        if self.index is None:
+            with self.lock.write_lock():
+                if self.index is None:
+                    self.index = PatientIndex(self.patients.values())
+        with self.lock.read_lock():
+            if 'phn' in criteria:
+                phns = {criteria['phn']}
+            else:
+                phns = self.index.candidates(criteria)
+            if phns is None:
+                # Nothing indexed to go by, e.g. only the name or the address
+                patients = self.patients.values()
+            else:
+                patients = [self.patients[phn] for phn in phns if phn in self.patients]
+            return sorted((patient for patient in patients if matches(patient, criteria)),
+                          key=lambda patient: patient.phn)
+
+    def reindex(self, *keys):
+        """Bring the indexes up to date with the patients now stored under keys."""
+        if self.index is not None:
+            for key in keys:
+                self.index.update(key, self.patients.get(key))
+
+    def check_version(self, patient, version):
+        """Raise ConflictException unless version is None or the version of patient."""
+        if version is not None and patient is not None and patient.version != version:
+            raise ConflictException("patient %s is at version %d, not %d" % (patient.phn, patient.version, version))
+
+    def update_patient(self, original_phn, phn, name, birth_date, phone, email, address, version=None):
+        """Update an existing patient's details; with version, only if the patient is still at that version."""
+        with self.lock.write_lock():
+            # Retrieve the patient to be updated using the original PHN
+            up_patient = self.patients.get(original_phn)
+            # Compare and set: a change made since the caller read the patient is not overwritten
+            self.check_version(up_patient, version)
+            # Set the new PHN
+            new_phn = phn
+            # Check if the new PHN already exists; a rejected update leaves the patient untouched
+            if original_phn != new_phn and self.patients.get(new_phn):
                 # If so, raise an exception due to duplicate PHN
                 raise IllegalOperationException
-            # Remove the old entry from the dictionary
-            self.patients.pop(original_phn)
-            # Update the patient's PHN
-            up_patient.phn = new_phn
-            # Add the updated patient with the new PHN as the key
-            self.patients[new_phn] = up_patient
-
-        # Checking for persistence; if autosave is on, then save the collection to file
-        if self.autosave:
-            self.save_patients()
+            if original_phn != new_phn:
+                # The record moves along, it must be saved before anything changes
+                up_patient.record.check_writable()
+            self.remember(original_phn, new_phn)
 
-        # Return True to indicate success
-        return True
+            # Patient exists, update fields with new data
+            up_patient.name = name
+            up_patient.birth_date = birth_date
+            up_patient.phone = phone
+            up_patient.email = email
+            up_patient.address = address
+            up_patient.version += 1
 
-    def delete_patient(self, key):
-        """Remove a patient by key (PHN)."""
-        # Patient exists, delete patient from the dictionary
-        self.patients.pop(key)
+            # Treat different keys as a separate case
+            if original_phn != new_phn:
+                # Remove the old entry from the dictionary
+                self.patients.pop(original_phn)
+                # Update the patient's PHN
+                up_patient.phn = new_phn
+                # The record is saved under the new PHN before the patients file names it
+                up_patient.record.rekey(new_phn)
+                # Add the updated patient with the new PHN as the key
+                self.patients[new_phn] = up_patient
+            self.reindex(original_phn, new_phn)
 
-        # Checking for persistence; if autosave is on, then save the collection to file
-        if self.autosave:
-            self.save_patients()
+            # Checking for persistence; if autosave is on, then save the collection to file
+            self.persist()
+
+            if original_phn != new_phn:
+                # Dropped under the old PHN only once the patients file no longer names it
+                up_patient.record.discard(original_phn)
+
+            self.change_log.patient_changed('update', up_patient, original_phn)
+
+            # Return True to indicate success
+            return True
 
-        # Return True to indicate success
-        return True
+    def delete_patient(self, key, version=None):
+        """Remove a patient by key (PHN); with version, only if the patient is still at that version."""
+        with self.lock.write_lock():
+            self.check_version(self.patients.get(key), version)
+            # The record is dropped along, it must be possible before anything changes
+            self.patients[key].record.check_writable()
+            self.remember(key)
+
+            # Patient exists, delete patient from the dictionary
+            patient = self.patients.pop(key)
+            self.reindex(key)
+
+            # Checking for persistence; if autosave is on, then save the collection to file
+            self.persist()
+
+            # The record goes with its patient, a crash in between leaves an orphan for storage maintenance
+            patient.record.discard()
+
+            self.change_log.patient_changed('delete', patient)
+
+            # Return True to indicate success
+            return True
 
     def list_patients(self):
         """List all patients."""
-        patients_list = []
-        # Iterate over all patients in the dictionary
-        for patient in self.patients.values():
-            # Add each patient to the list
-            patients_list.append(patient)
-
-        # Return the list of patients
-        return patients_list
+        with self.lock.read_lock():
+            patients_list = []
+            # Iterate over all patients in the dictionary
+            for patient in self.patients.values():
+                # Add each patient to the list
+                patients_list.append(patient)
+
+            # Return the list of patients
+            return patients_list
@@ -0,0 +1,119 @@
+import bisect
+import math
+
+# Exact-match criteria answered from a hash of value to PHNs
+HASHED = ('phone', 'email')
+# Criteria of find_patients: name matches a substring as in retrieve_patients, the other
+# fields exactly, birth_date_from and birth_date_to bound the ISO birth date inclusively
+CRITERIA = ('phn', 'name', 'birth_date', 'phone', 'email', 'address', 'birth_date_from', 'birth_date_to')
+
+
+def check_criteria(criteria):
+    ''' Raise ValueError for a criterion find_patients does not know '''
+    unknown = sorted(set(criteria) - set(CRITERIA))
+    if unknown:
+        raise ValueError(f'unknown patient criteria {", ".join(unknown)}, choose from {", ".join(CRITERIA)}')
+
+
+def matches(patient, criteria):
+    ''' Whether patient satisfies every criterion '''
+    for field, value in criteria.items():
+        if field == 'name':
+            if value not in patient.name:
+                return False
+        elif field == 'birth_date_from':
+            if patient.birth_date < value:
+                return False
+        elif field == 'birth_date_to':
+            if patient.birth_date > value:
+                return False
+        elif getattr(patient, field) != value:
+            return False
+    return True
+
+
+class PatientIndex():
+    ''' Secondary indexes of the patients: hashes of phone and email and the patients sorted
+    by birth date. Kept by PHN, every change of a patient is applied with update(). '''
+
+    def __init__(self, patients=()):
+        self.hashed = {field: {} for field in HASHED}
+        # Indexed values of every PHN, to find its entries again once the patient changed
+        self.entries = {}
+        self.births = []
+        self.add_all(patients)
+
+    def add_all(self, patients):
+        ''' Index many patients, sorting the birth dates once instead of inserting each '''
+        for patient in patients:
+            self.discard(patient.phn)
+            self.add_hashed(patient)
+            self.births.append((patient.birth_date, patient.phn))
+        self.births.sort()
+
+    def add_hashed(self, patient):
+        values = (patient.phone, patient.email, patient.birth_date)
+        self.entries[patient.phn] = values
+        for field, value in zip(HASHED, values):
+            self.hashed[field].setdefault(value, set()).add(patient.phn)
+
+    def add(self, patient):
+        self.discard(patient.phn)
+        self.add_hashed(patient)
+        bisect.insort(self.births, (patient.birth_date, patient.phn))
+
+    def discard(self, phn):
+        values = self.entries.pop(phn, None)
+        if values is None:
+            return
+        for field, value in zip(HASHED, values):
+            phns = self.hashed[field][value]
+            phns.discard(phn)
+            if not phns:
+                del self.hashed[field][value]
+        index = bisect.bisect_left(self.births, (values[2], phn))
+        del self.births[index]
+
+    def update(self, key, patient):
+        ''' Index patient, now stored under key, in place of what was under key; None if it is gone '''
+        self.discard(key)
+        if patient is not None:
+            self.add(patient)
+
+    def birth_range(self, criteria):
+        ''' Bounds in self.births of the birth date criteria, None without any '''
+        if 'birth_date' in criteria:
+            low = high = criteria['birth_date']
+        elif 'birth_date_from' in criteria or 'birth_date_to' in criteria:
+            low, high = criteria.get('birth_date_from'), criteria.get('birth_date_to')
+        else:
+            return None
+        start = 0 if low is None else bisect.bisect_left(self.births, (low,))
+        # Every PHN born on the high date sorts before infinity
+        end = len(self.births) if high is None else bisect.bisect_right(self.births, (high, math.inf))
+        return start, max(start, end)
+
+    def candidates(self, criteria):
+        ''' PHNs of a superset of the patients matching criteria, None if no index applies.
+        The smallest candidate set is taken first and the others intersected with it. '''
+        sets = []
+        for field in HASHED:
+            if field in criteria:
+                phns = self.hashed[field].get(criteria[field], ())
+                sets.append((len(phns), lambda phns=phns: set(phns)))
+        bounds = self.birth_range(criteria)
+        if bounds is not None:
+            start, end = bounds
+            sets.append((end - start, lambda: {phn for _, phn in self.births[start:end]}))
+        if not sets:
+            return None
+        # Sizes are known before any set is built, a wide birth date range is never materialised
+        # when a phone or email already narrowed the patients down to a few
+        sets.sort(key=lambda entry: entry[0])
+        result = sets[0][1]()
+        for size, phns in sets[1:]:
+            if not result or size > 8 * len(result):
+                # Cheaper to check the few candidates left against the criterion itself
+                break
+            result &= phns()
+        return result
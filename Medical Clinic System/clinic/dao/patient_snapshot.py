@@ -0,0 +1,41 @@
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from clinic.durable_io import atomic_write
+
+MAGIC = b'CLINSNP2'
+# Magic, stamp of the patients file it was taken from (inode, mtime in ns, size),
+# length and crc32 of the pickled patient rows that follow
+HEADER = struct.Struct('<8sQqqQI')
+
+
+def write_snapshot(path, stamp, rows):
+    ''' Save the patient rows (phn, name, birth_date, phone, email, address, version) of the
+    patients file with the given stamp. The snapshot is only a cache, it is not fsynced. '''
+    payload = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+    header = HEADER.pack(MAGIC, *stamp, len(payload), zlib.crc32(payload))
+    atomic_write(path, header + payload, durable=False, keep=False)
+
+
+def read_snapshot(path, stamp):
+    ''' The patient rows of the snapshot at path, mapped and decoded in one pass.
+    None if there is none, or it was taken of another patients file than stamp, or it is damaged. '''
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with file:
+        size = os.fstat(file.fileno()).st_size
+        if size < HEADER.size:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, inode, mtime, file_size, length, crc = HEADER.unpack_from(view)
+            if magic != MAGIC or (inode, mtime, file_size) != tuple(stamp) or HEADER.size + length != size:
+                return None
+            # The payload is decoded straight from the mapping, no copy of the file is made
+            with memoryview(view)[HEADER.size:] as payload:
+                if zlib.crc32(payload) != crc:
+                    return None
+                return pickle.loads(payload)
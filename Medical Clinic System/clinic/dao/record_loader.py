@@ -0,0 +1,40 @@
+import concurrent.futures
+import pickle
+from clinic.metrics import timed
+
+
+# Records read by one task; one future per record costs more than reading a cached file
+CHUNK_SIZE = 256
+
+
+def read_records(note_daos):
+    ''' Raw records of note DAOs; runs in a worker thread, file reads release the GIL '''
+    return [dao.store.read(dao.phn) for dao in note_daos]
+
+
+def read_stamped_records(note_daos):
+    ''' (stamp, raw record) of note DAOs, each stamp taken before its record is read '''
+    return [(dao.store.stamp(dao.phn), dao.store.read(dao.phn)) for dao in note_daos]
+
+
+@timed('dao.warm_up')
+def warm_up(note_daos, workers):
+    ''' Load the notes of every DAO, reading their records with a pool of workers threads.
+
+    The records are decoded in the calling thread as they arrive: unpickling holds the GIL,
+    and decoding in other processes would pickle every record a second time to send it back.
+    A record that does not decode goes through the DAO's own load, which restores a torn file. '''
+    chunks = [note_daos[start:start + CHUNK_SIZE] for start in range(0, len(note_daos), CHUNK_SIZE)]
+    with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='record-loader') as executor:
+        records = (record for chunk in executor.map(read_stamped_records, chunks) for record in chunk)
+        for dao, (stamp, data) in zip(note_daos, records):
+            if data is None:
+                dao.set_notes({}, stamp)
+                continue
+            try:
+                notes = pickle.loads(data)
+            except Exception:
+                dao.load_notes()
+            else:
+                dao.set_notes(notes, stamp)
+    return len(note_daos)
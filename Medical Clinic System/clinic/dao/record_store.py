@@ -0,0 +1,258 @@
+import atexit
+import logging
+import os
+import shutil
+import threading
+from clinic.dao.segment_store import SegmentStore
+from clinic.durable_io import PREVIOUS_SUFFIX, atomic_write, file_stamp, fsync_directory, load_recovering
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+
+logger = logging.getLogger(__name__)
+
+
+def has_files(directory):
+    ''' Whether directory directly holds any file; stops at the first one '''
+    try:
+        with os.scandir(directory) as entries:
+            return any(entry.is_file() for entry in entries)
+    except FileNotFoundError:
+        return False
+
+
+
+class FileRecordStore():
+    ''' One file per patient record, where the storage configuration points.
+
+    With fan-out, record files still directly in the records directory are moved
+    to their hashed subdirectory when first read, and by a background migrator.
+    A read_only store moves nothing, it reads them where they are. '''
+
+    def __init__(self, config, read_only=False):
+        # Record files are replaced atomically, reading them beside a writing process is safe
+        self.config = config
+        self.read_only = read_only
+        self.migrator = None
+        # Whether record files may still sit directly in the records directory
+        self.flat = bool(config.fanout) and has_files(config.records_path())
+        if self.flat and not read_only:
+            self.migrate_in_background()
+
+    def path(self, phn):
+        return self.config.record_path(phn)
+
+    def sources(self, phn):
+        ''' Paths the record of phn is read from, in order, until one exists '''
+        if not self.flat:
+            return (self.path(phn),)
+        if not self.read_only:
+            self.migrate(phn)
+            return (self.path(phn),)
+        # Another process may migrate the file meanwhile: it links the new path before it
+        # removes the flat one, so a record missing from both was at the new path since
+        return (self.path(phn), self.config.flat_record_path(phn), self.path(phn))
+
+    def load(self, phn, decode):
+        ''' decode(record of phn), None if it has none '''
+        for path in self.sources(phn):
+            value = load_recovering(path, decode)
+            if value is not None:
+                return value
+        return None
+
+    def read(self, phn):
+        ''' Raw content of the record of phn, None if it has none; nothing is validated '''
+        for path in self.sources(phn):
+            try:
+                with open(path, 'rb') as file:
+                    return file.read()
+            except FileNotFoundError:
+                pass
+        return None
+
+    def stamp(self, phn):
+        ''' file_stamp of the record of phn; another process saving the record changes it '''
+        stamp = file_stamp(self.path(phn))
+        if stamp is None and self.flat:
+            # A migration links the file, its stamp stays the same at the new path
+            stamp = file_stamp(self.config.flat_record_path(phn))
+        return stamp
+
+    def check_writable(self):
+        ''' Raise IllegalOperationException if this store may not write records '''
+        if self.read_only:
+            raise IllegalOperationException('the record files in %s are opened read only' % self.config.records_path())
+
+    def save(self, phn, data, durable=True):
+        # No previous generation: linked to the replaced file it would keep every record on disk
+        # twice. The rename alone never leaves a torn record, only patients.json keeps one.
+        atomic_write(self.path(phn), data, durable, keep=False)
+
+    def delete(self, phn):
+        ''' Remove the record file of phn and its previous generation; returns the bytes freed '''
+        freed = 0
+        for path in {self.path(phn), self.config.flat_record_path(phn)}:
+            for suffix in ('', PREVIOUS_SUFFIX):
+                try:
+                    size = os.path.getsize(path + suffix)
+                    os.remove(path + suffix)
+                    freed += size
+                except FileNotFoundError:
+                    pass
+        return freed
+
+    def migrate(self, phn):
+        ''' Move the flat record file of phn and its previous generation to the fan-out
+        path; True if there was one '''
+        flat, path = self.config.flat_record_path(phn), self.path(phn)
+        if flat == path or not os.path.exists(flat):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for suffix in (PREVIOUS_SUFFIX, ''):
+            try:
+                # A link, unlike a rename, never replaces a record saved at the new path meanwhile
+                os.link(flat + suffix, path + suffix)
+            except FileNotFoundError:
+                continue
+            except FileExistsError:
+                pass
+            except OSError:
+                if os.path.exists(path + suffix):
+                    pass
+                else:
+                    shutil.copy2(flat + suffix, path + suffix)
+            # The record must be at the new path on disk before it leaves the old one
+            fsync_directory(os.path.dirname(path))
+            try:
+                os.remove(flat + suffix)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def migrate_all(self):
+        ''' Move every flat record file to the fan-out layout; returns how many were moved '''
+        moved = 0
+        with os.scandir(self.config.records_path()) as entries:
+            names = [entry.name for entry in entries if entry.is_file()]
+        for name in names:
+            phn = self.config.record_phn(name)
+            if phn is not None and self.migrate(phn):
+                moved += 1
+        fsync_directory(self.config.records_path())
+        # From now on a read costs no look at the old location
+        self.flat = False
+        return moved
+
+    def migrate_in_background(self):
+        self.migrator = threading.Thread(target=self.run_migration, name='record-migrator', daemon=True)
+        self.migrator.start()
+        return self.migrator
+
+    def run_migration(self):
+        try:
+            moved = self.migrate_all()
+            logger.info('moved %d record files of %s to the fan-out layout', moved, self.config.records_path())
+        except Exception:
+            logger.exception('migration of %s to the fan-out layout failed', self.config.records_path())
+
+    def is_open(self):
+        return True
+
+    def close(self, checkpoint=True):
+        if self.migrator:
+            self.migrator.join()
+
+
+class SegmentRecordStore():
+    ''' Patient records packed in segment files; records still in their own file are
+    read from it until their next save moves them into the segments '''
+
+    def __init__(self, config, read_only=False):
+        self.config = config
+        self.files = FileRecordStore(config, read_only)
+        # Written by the first process to open them only, read_only when another one holds them
+        self.segments = SegmentStore(config.segments_path(), read_only=read_only)
+        # Without any record file left, a missing record costs no open() attempt
+        with os.scandir(config.records_path()) as entries:
+            # Record files, directly or in fan-out subdirectories, beside the segments
+            self.legacy = any(entry.name != config.segments_dir for entry in entries)
+
+    def load(self, phn, decode):
+        data = self.segments.get(phn)
+        if data is None:
+            return self.files.load(phn, decode) if self.legacy else None
+        return decode(data)
+
+    def read(self, phn):
+        data = self.segments.get(phn)
+        if data is None and self.legacy:
+            return self.files.read(phn)
+        return data
+
+    def stamp(self, phn):
+        ''' Always None: the segments are written by one process only, nobody else changes a record;
+        records are only saved where the segments are not read_only '''
+        return None
+
+    def check_writable(self):
+        ''' Raise IllegalOperationException if another process writes the segments '''
+        self.segments.check_writable()
+
+    def save(self, phn, data, durable=True):
+        self.segments.put(phn, data, durable)
+        if self.legacy:
+            self.files.delete(phn)
+
+    def delete(self, phn):
+        ''' Drop the record of phn; returns the bytes freed, in the segments once compacted '''
+        return self.segments.delete(phn) + (self.files.delete(phn) if self.legacy else 0)
+
+    def is_open(self):
+        return self.segments.is_open()
+
+    def close(self, checkpoint=True):
+        self.files.close(checkpoint)
+        self.segments.close(checkpoint)
+
+
+STORES = {
+    'files': FileRecordStore,
+    'segments': SegmentRecordStore
+}
+
+# Every record of a clinic goes through one store, shared by its note DAOs
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def record_store(config, read_only=False):
+    ''' The record store of the clinic config points to, opened on first use. With read_only, for
+    commands only reading the records beside a running clinic, one that never writes: the store
+    this process already has open, or one that leaves the files to the process writing them. '''
+    if config.record_store not in STORES:
+        raise ValueError(f'unknown record store {config.record_store!r}, choose from {", ".join(STORES)}')
+    key = (config.record_store, os.path.abspath(config.records_path()), config.record_file, config.fanout)
+    with _stores_lock:
+        if read_only:
+            store = _stores.get(key)
+            if store is not None and store.is_open():
+                return store
+            key += ('read_only',)
+        store = _stores.get(key)
+        if store is not None and not store.is_open():
+            # The directory was removed since, start over from what is on disk now
+            store.close(checkpoint=False)
+            store = None
+        if store is None:
+            store = _stores[key] = STORES[config.record_store](config, read_only)
+        return store
+
+
+def close_record_stores():
+    ''' Checkpoint and close every open store, for a clean shutdown '''
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+atexit.register(close_record_stores)
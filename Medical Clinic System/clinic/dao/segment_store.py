@@ -0,0 +1,358 @@
+import logging
+import os
+import struct
+import threading
+import zlib
+from clinic.durable_io import atomic_write, fsync_directory
+from clinic.file_lock import try_lock
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+
+logger = logging.getLogger(__name__)
+
+# Entry header: crc32 of the rest of the entry, kind, PHN, payload length
+HEADER = struct.Struct('<IBqI')
+PUT = 0
+DELETE = 1
+
+# Index checkpoint: magic, entry count, then the segment and size it covers
+INDEX_HEADER = struct.Struct('<8sIIQ')
+INDEX_MAGIC = b'CLINIDX1'
+# Index entry: PHN, segment, payload offset, payload length (TOMBSTONE for a deleted PHN)
+INDEX_ENTRY = struct.Struct('<qIQI')
+TOMBSTONE = 0xFFFFFFFF
+
+
+class SegmentStore():
+    ''' Records of many patients packed in append-only segment files.
+
+    Every save appends the whole record to the active segment; a PHN -> (segment,
+    offset, length) index kept in memory finds the latest copy. The index is
+    checkpointed to a compact file, so a start reads it and scans only what was
+    appended after the checkpoint. Segments mostly holding replaced copies are
+    compacted in the background.
+
+    One process writes: the first to open the store holds its owner lock until it closes
+    it. Any other one, and a store opened read_only, only reads what was on disk when it
+    was opened; it never cuts a torn tail, checkpoints or compacts. '''
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, checkpoint_every=1000,
+                 compact_ratio=0.5, read_only=False):
+        ''' Open the store in directory, creating it if needed '''
+        self.directory = directory
+        # A segment is sealed once it grows past segment_size bytes
+        self.segment_size = segment_size
+        self.checkpoint_every = checkpoint_every
+        # A sealed segment whose live bytes fall below this fraction is compacted
+        self.compact_ratio = compact_ratio
+        self.lock = threading.RLock()
+        self.index = {}
+        # PHN -> segment of its delete entry, kept while an older copy may still be on disk
+        self.tombstones = {}
+        # Segment -> bytes of its entries still in the index, and its file size
+        self.live = {}
+        self.sizes = {}
+        self.readers = {}
+        self.active = None
+        self.active_file = None
+        self.unsaved = 0
+        self.compactor = None
+        os.makedirs(directory, exist_ok=True)
+        self.owner = None if read_only else try_lock(os.path.join(directory, 'owner.lock'))
+        self.read_only = self.owner is None
+        self.open()
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, '%08d.seg' % segment)
+
+    def index_path(self):
+        return os.path.join(self.directory, 'index')
+
+    def segments(self):
+        ''' Ids of the segment files on disk, oldest first '''
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith('.seg') and name[:-4].isdigit())
+
+    def open(self):
+        ''' Load the index checkpoint and replay the entries appended after it '''
+        segments = self.segments()
+        for segment in segments:
+            self.sizes[segment] = os.path.getsize(self.segment_path(segment))
+            self.live[segment] = 0
+        covered_segment, covered_size = self.load_index()
+        for segment in segments:
+            if segment > covered_segment:
+                self.scan(segment, 0)
+            elif segment == covered_segment and self.sizes[segment] > covered_size:
+                self.scan(segment, covered_size)
+        self.active = segments[-1] if segments else 1
+        self.sizes.setdefault(self.active, 0)
+        self.live.setdefault(self.active, 0)
+
+    def load_index(self):
+        ''' Fill the index from the checkpoint; returns the (segment, size) it covers '''
+        try:
+            with open(self.index_path(), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return 0, 0
+        body, crc = data[:-4], data[-4:]
+        if len(data) < INDEX_HEADER.size + 4 or struct.pack('<I', zlib.crc32(body)) != crc:
+            logger.warning('%s is torn, rebuilding the index from the segments', self.index_path())
+            return 0, 0
+        magic, count, covered_segment, covered_size = INDEX_HEADER.unpack_from(body)
+        if magic != INDEX_MAGIC or len(body) != INDEX_HEADER.size + count * INDEX_ENTRY.size:
+            logger.warning('%s is not an index, rebuilding it from the segments', self.index_path())
+            return 0, 0
+        if self.sizes.get(covered_segment, 0) < covered_size:
+            # The segments lost data the checkpoint had seen, only a full scan can tell what is left
+            logger.warning('%s is ahead of the segments, rebuilding it', self.index_path())
+            return 0, 0
+        for phn, segment, offset, length in INDEX_ENTRY.iter_unpack(body[INDEX_HEADER.size:]):
+            if segment not in self.sizes:
+                # A checkpoint always names existing segments; never trust one that does not
+                logger.warning('%s names a missing segment, rebuilding it', self.index_path())
+                self.index.clear()
+                self.tombstones.clear()
+                for key in self.live:
+                    self.live[key] = 0
+                return 0, 0
+            if length == TOMBSTONE:
+                self.tombstones[phn] = segment
+            else:
+                self.index[phn] = (segment, offset, length)
+                self.live[segment] += HEADER.size + length
+        return covered_segment, covered_size
+
+    def scan(self, segment, offset):
+        ''' Apply the entries of a segment from offset; a torn tail is cut off '''
+        path = self.segment_path(segment)
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            data = file.read()
+        position = 0
+        while position + HEADER.size <= len(data):
+            crc, kind, phn, length = HEADER.unpack_from(data, position)
+            end = position + HEADER.size + length
+            if end > len(data) or zlib.crc32(data[position + 4:end]) != crc:
+                break
+            self.apply(kind, phn, segment, offset + position + HEADER.size, length)
+            position = end
+        if position < len(data) and not self.read_only:
+            # Without the owner lock the entry may still be being appended by the owner
+            logger.warning('%s has a torn entry at %d, cut off', path, offset + position)
+            with open(path, 'r+b') as file:
+                file.truncate(offset + position)
+                os.fsync(file.fileno())
+            self.sizes[segment] = offset + position
+
+    def apply(self, kind, phn, segment, offset, length):
+        ''' Point the index at a new entry '''
+        previous = self.index.pop(phn, None)
+        if previous:
+            self.live[previous[0]] -= HEADER.size + previous[2]
+        if kind == DELETE:
+            self.tombstones[phn] = segment
+        else:
+            self.tombstones.pop(phn, None)
+            self.index[phn] = (segment, offset, length)
+            self.live[segment] += HEADER.size + length
+
+    def check_writable(self):
+        if self.read_only:
+            raise IllegalOperationException('the record segments in %s are written by another process'
+                                            % self.directory)
+
+    def append(self, kind, phn, data, durable=True):
+        ''' Append an entry to the active segment; call with the lock held '''
+        self.check_writable()
+        if self.sizes[self.active] >= self.segment_size:
+            self.seal()
+        if self.active_file is None:
+            self.active_file = open(self.segment_path(self.active), 'ab')
+            if self.sizes[self.active] == 0:
+                fsync_directory(self.directory)
+        body = HEADER.pack(0, kind, phn, len(data))[4:] + data
+        self.active_file.write(struct.pack('<I', zlib.crc32(body)) + body)
+        self.active_file.flush()
+        if durable:
+            os.fsync(self.active_file.fileno())
+        offset = self.sizes[self.active] + HEADER.size
+        self.sizes[self.active] += HEADER.size + len(data)
+        self.apply(kind, phn, self.active, offset, len(data))
+        self.unsaved += 1
+        if self.unsaved >= self.checkpoint_every:
+            self.checkpoint()
+
+    def seal(self):
+        ''' Start a new active segment '''
+        if self.active_file:
+            # Compaction appends without fsync, a sealed segment must still be on disk
+            os.fsync(self.active_file.fileno())
+            self.active_file.close()
+            self.active_file = None
+        self.active += 1
+        self.sizes[self.active] = 0
+        self.live[self.active] = 0
+
+    def checkpoint(self):
+        ''' Write the index so the next start does not scan the segments '''
+        if self.read_only:
+            return
+        with self.lock:
+            if self.active_file:
+                self.active_file.flush()
+                os.fsync(self.active_file.fileno())
+            entries = [INDEX_ENTRY.pack(phn, *location) for phn, location in self.index.items()]
+            entries.extend(INDEX_ENTRY.pack(phn, segment, 0, TOMBSTONE)
+                           for phn, segment in self.tombstones.items())
+            body = INDEX_HEADER.pack(INDEX_MAGIC, len(entries), self.active, self.sizes[self.active]) + \
+                b''.join(entries)
+            atomic_write(self.index_path(), body + struct.pack('<I', zlib.crc32(body)), keep=False)
+            self.unsaved = 0
+
+    def read(self, segment, offset, length):
+        reader = self.readers.get(segment)
+        if reader is None:
+            reader = self.readers[segment] = os.open(self.segment_path(segment), os.O_RDONLY)
+        return os.pread(reader, length, offset)
+
+    def get(self, phn):
+        ''' Latest record of phn, None if it has none '''
+        with self.lock:
+            location = self.index.get(phn)
+            if location is None:
+                return None
+            return self.read(*location)
+
+    def put(self, phn, data, durable=True):
+        ''' Store data as the record of phn '''
+        with self.lock:
+            self.append(PUT, phn, data, durable)
+        self.compact_in_background()
+
+    def delete(self, phn, durable=True):
+        ''' Drop the record of phn; returns the bytes it took, 0 if it had none '''
+        with self.lock:
+            location = self.index.get(phn)
+            if location is None:
+                return 0
+            self.append(DELETE, phn, b'', durable)
+        self.compact_in_background()
+        return HEADER.size + location[2]
+
+    def __contains__(self, phn):
+        return phn in self.index
+
+    def phns(self):
+        with self.lock:
+            return list(self.index)
+
+    def record_sizes(self):
+        ''' PHN -> bytes of its latest record '''
+        with self.lock:
+            return {phn: length for phn, (_, _, length) in self.index.items()}
+
+    def garbage(self, segment):
+        ''' Fraction of a segment taken by replaced or deleted entries '''
+        size = self.sizes.get(segment, 0)
+        return 1 - self.live.get(segment, 0) / size if size else 0.0
+
+    def victims(self):
+        with self.lock:
+            return [segment for segment in sorted(self.sizes)
+                    if segment != self.active and self.garbage(segment) > 1 - self.compact_ratio]
+
+    def compact(self):
+        ''' Move the live entries out of mostly stale sealed segments and delete them.
+        Writers are only held up for one entry at a time. Returns the segments removed. '''
+        self.check_writable()
+        removed = []
+        for victim in self.victims():
+            with self.lock:
+                phns = [phn for phn, location in self.index.items() if location[0] == victim]
+                # A delete entry must outlive every older copy of its record
+                older = any(segment < victim for segment in self.sizes)
+                deleted = [phn for phn, segment in self.tombstones.items() if segment == victim]
+            for phn in phns:
+                with self.lock:
+                    location = self.index.get(phn)
+                    if location and location[0] == victim:
+                        self.append(PUT, phn, self.read(*location), durable=False)
+            with self.lock:
+                for phn in deleted:
+                    if self.tombstones.get(phn) == victim:
+                        if older:
+                            self.append(DELETE, phn, b'', durable=False)
+                        else:
+                            del self.tombstones[phn]
+                # The index must stop naming the victim before it goes
+                self.checkpoint()
+                reader = self.readers.pop(victim, None)
+                if reader is not None:
+                    os.close(reader)
+                os.remove(self.segment_path(victim))
+                fsync_directory(self.directory)
+                del self.sizes[victim]
+                del self.live[victim]
+                removed.append(victim)
+        return removed
+
+    def compact_in_background(self):
+        ''' Start a compaction thread when a sealed segment is mostly stale '''
+        with self.lock:
+            if self.compactor and self.compactor.is_alive():
+                return self.compactor
+            if self.read_only or not self.victims():
+                return None
+            self.compactor = threading.Thread(target=self.run_compaction, name='segment-compactor',
+                                              daemon=True)
+            self.compactor.start()
+            return self.compactor
+
+    def run_compaction(self):
+        try:
+            self.compact()
+        except Exception:
+            logger.exception('compaction of %s failed', self.directory)
+
+    def stats(self):
+        ''' Segment count, records, live and total bytes '''
+        with self.lock:
+            total = sum(self.sizes.values())
+            live = sum(self.live.values())
+            return {
+                "segments": len(self.sizes),
+                "records": len(self.index),
+                "live_bytes": live,
+                "total_bytes": total,
+                "garbage_ratio": 1 - live / total if total else 0.0
+            }
+
+    def is_open(self):
+        ''' False once the directory was removed or replaced under the store '''
+        if self.active_file is None:
+            return os.path.isdir(self.directory)
+        try:
+            return os.fstat(self.active_file.fileno()).st_ino == \
+                os.stat(self.segment_path(self.active)).st_ino
+        except FileNotFoundError:
+            return False
+
+    def close(self, checkpoint=True):
+        ''' Checkpoint the index and release the files '''
+        if self.compactor:
+            self.compactor.join()
+        with self.lock:
+            if checkpoint and self.is_open():
+                self.checkpoint()
+            if self.active_file:
+                self.active_file.close()
+                self.active_file = None
+            for reader in self.readers.values():
+                os.close(reader)
+            self.readers.clear()
+            if self.owner:
+                # Another process may write the segments from now on
+                self.owner.close()
+                self.owner = None
+                self.read_only = True
@@ -0,0 +1,109 @@
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+# Suffixes of the files kept next to a data file
+TEMP_SUFFIX = '.tmp'
+PREVIOUS_SUFFIX = '.prev'
+CORRUPT_SUFFIX = '.corrupt'
+
+
+def fsync_directory(path):
+    ''' Make a created, renamed or removed directory entry durable '''
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on every platform
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_file(path, data, append=False):
+    ''' Write data to path in place and fsync it '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'ab' if append else 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def file_stamp(path):
+    ''' (inode, mtime in ns, size) of path, which changes with every replacement; None if missing '''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def keep_previous(path):
+    ''' Keep the current content of path as its last good generation '''
+    previous = path + PREVIOUS_SUFFIX
+    try:
+        os.remove(previous)
+    except FileNotFoundError:
+        pass
+    try:
+        # A hard link costs no copy and path itself is never missing
+        os.link(path, previous)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        shutil.copy2(path, previous)
+
+
+def atomic_write(path, data, durable=True, keep=True):
+    ''' Replace path with data so that readers and crashes see the old or the new
+    content, never a mix: temp file, fsync, rename, directory fsync.
+    With keep, the replaced content stays available as path + '.prev'. '''
+    directory = os.path.dirname(path)
+    os.makedirs(directory or '.', exist_ok=True)
+    temp_path = path + TEMP_SUFFIX
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+        if durable:
+            file.flush()
+            os.fsync(file.fileno())
+    if keep:
+        keep_previous(path)
+    os.replace(temp_path, path)
+    if durable:
+        fsync_directory(directory)
+
+
+def load_recovering(path, decode):
+    ''' Return decode(content of path), None when path does not exist.
+
+    A torn or corrupt file is replaced by its last good generation. When there
+    is none, it is moved aside to path + '.corrupt' and None is returned, so the
+    caller starts empty without overwriting what is left of the data. '''
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+    try:
+        return decode(data)
+    except Exception as error:
+        torn = error
+
+    previous = path + PREVIOUS_SUFFIX
+    try:
+        with open(previous, 'rb') as file:
+            previous_data = file.read()
+        value = decode(previous_data)
+    except Exception:
+        os.replace(path, path + CORRUPT_SUFFIX)
+        logger.error('%s is unreadable (%s) and has no good previous generation; moved to %s',
+                     path, torn, path + CORRUPT_SUFFIX)
+        return None
+    atomic_write(path, previous_data, keep=False)
+    logger.warning('%s was torn (%s); restored the previous generation', path, torn)
+    return value
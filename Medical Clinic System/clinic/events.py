@@ -0,0 +1,91 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ClinicEvent():
+    ''' Base class of the change notifications published by the Controller '''
+
+    fields = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name)
+                                                 for name in self.fields)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.fields))
+
+
+class PatientCreated(ClinicEvent):
+    ''' A patient was registered '''
+    fields = ('patient',)
+
+
+class PatientUpdated(ClinicEvent):
+    ''' A patient's data changed; original_name is the name before the change '''
+    fields = ('patient', 'original_phn', 'original_name')
+
+
+class PatientRekeyed(PatientUpdated):
+    ''' A patient's data changed including the PHN; also delivered to PatientUpdated subscribers '''
+
+
+class PatientDeleted(ClinicEvent):
+    ''' A patient was removed '''
+    fields = ('patient',)
+
+
+class NoteCreated(ClinicEvent):
+    ''' A note was added to the record of the patient with the given PHN '''
+    fields = ('phn', 'note')
+
+
+class NoteUpdated(ClinicEvent):
+    ''' A note's text changed; old_text is the text before the change '''
+    fields = ('phn', 'note', 'old_text')
+
+
+class NoteDeleted(ClinicEvent):
+    ''' A note was removed from a record '''
+    fields = ('phn', 'note')
+
+
+class DataImported(ClinicEvent):
+    ''' A bulk import ran; kind is 'patients' or 'notes'. Views should reload '''
+    fields = ('kind', 'report')
+
+
+class EventBus():
+    ''' Synchronous publish/subscribe of ClinicEvents, safe to use from several threads '''
+
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback, *event_types):
+        ''' Call callback(event) for every event of the given types, all events when none.
+        Returns callback so it can be used as a decorator and passed to unsubscribe. '''
+        with self.lock:
+            self.subscribers = self.subscribers + [(callback, event_types or (ClinicEvent,))]
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers = [entry for entry in self.subscribers if entry[0] != callback]
+
+    def publish(self, event):
+        ''' Deliver event to its subscribers in subscription order, in the publishing thread '''
+        # The list is replaced, never changed in place, so no lock is needed to iterate
+        for callback, event_types in self.subscribers:
+            if isinstance(event, event_types):
+                try:
+                    callback(event)
+                except Exception:
+                    # A failing view or index must not undo a saved mutation
+                    logger.exception('subscriber %r failed on %r', callback, event)
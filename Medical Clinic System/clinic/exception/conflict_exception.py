@@ -0,0 +1,4 @@
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+
+class ConflictException(IllegalOperationException):
+	''' Changed Since Read: the version given is no longer the current one '''
\ No newline at end of file
@@ -0,0 +1,236 @@
+import gzip
+import json
+import logging
+import os
+import pickle
+from clinic.dao.patient_codec import FIELDS, LAYOUT_KEY, decode_rows
+from clinic.dao.record_store import record_store
+from clinic.storage_config import StorageConfig
+
+logger = logging.getLogger(__name__)
+
+
+def patient_to_dict(patient):
+    ''' converts a patient to a plain dictionary '''
+    return {
+        "phn": patient.phn,
+        "name": patient.name,
+        "birth_date": patient.birth_date,
+        "phone": patient.phone,
+        "email": patient.email,
+        "address": patient.address
+    }
+
+
+def note_to_dict(note):
+    ''' converts a note to a plain dictionary '''
+    return {
+        "code": note.code,
+        "timestamp": note.timestamp.isoformat() if note.timestamp else None,
+        "text": note.text
+    }
+
+
+def iter_json_object(file, chunk_size=65536):
+    ''' Lazily yield the (key, value) pairs of a top-level JSON object.
+
+    Only one member is decoded at a time, so memory stays bounded by the
+    largest patient instead of the whole file. '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        # Drop what was consumed and read the next chunk
+        nonlocal buffer, pos, eof
+        chunk = file.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    def expect(*chars):
+        nonlocal pos
+        skip_whitespace()
+        if pos >= len(buffer) or buffer[pos] not in chars:
+            raise json.JSONDecodeError('Expecting one of %r' % (chars,), buffer, pos)
+        pos += 1
+        return buffer[pos - 1]
+
+    def decode():
+        nonlocal pos
+        skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A number can be cut by the chunk boundary, make sure it ended
+                if end < len(buffer) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    fill()
+    skip_whitespace()
+    if eof and pos >= len(buffer):
+        # Empty file, same as no patients
+        return
+    expect('{')
+    skip_whitespace()
+    if pos < len(buffer) and buffer[pos] == '}':
+        return
+    while True:
+        key = decode()
+        expect(':')
+        yield key, decode()
+        if expect(',', '}') == '}':
+            return
+
+
+class ExportReport():
+    ''' Totals of an export run '''
+
+    def __init__(self, patients=0, notes=0):
+        self.patients = patients
+        self.notes = notes
+
+    def __str__(self):
+        return '%d patients and %d notes exported' % (self.patients, self.notes)
+
+
+class ClinicExporter():
+    ''' Streams the whole clinic to NDJSON, one patient or note per line '''
+
+    def __init__(self, config=None, checkpoint_every=1000):
+        ''' Construct an exporter over the clinic data files '''
+        self.config = config if config else StorageConfig.from_environ()
+        self.checkpoint_every = checkpoint_every
+
+    def iter_patients(self):
+        ''' Yield every patient of patients.json as a plain dictionary, in file order.
+        Only the 'objects' layout is streamed, a 'columns' file is decoded in memory. '''
+        try:
+            file = open(self.config.patients_path(), 'r')
+        except FileNotFoundError:
+            return
+        with file:
+            for key, value in iter_json_object(file):
+                if key == LAYOUT_KEY:
+                    # A columnar file can not be streamed patient by patient, it is decoded whole
+                    logger.warning('%s is in the columns layout, its patients are exported from memory',
+                                   self.config.patients_path())
+                    with open(self.config.patients_path(), 'rb') as data:
+                        rows = decode_rows(data.read())
+                    for row in rows:
+                        yield dict(zip(FIELDS[:6], row))
+                    return
+                patient = {field: value.get(field) for field in
+                           ("phn", "name", "birth_date", "phone", "email", "address")}
+                if patient["phn"] is None:
+                    patient["phn"] = int(key)
+                yield patient
+
+    def iter_notes(self, phn):
+        ''' Yield the notes of one patient record in code order '''
+        # Read only, the clinic may be running and writing its records meanwhile
+        notes = record_store(self.config, read_only=True).load(phn, pickle.loads)
+        if not notes:
+            return
+        for code in sorted(notes):
+            yield notes[code]
+
+    def iter_lines(self, skip=0):
+        ''' Yield (patient_index, line) pairs, skipping the first patients '''
+        for index, patient in enumerate(self.iter_patients()):
+            if index < skip:
+                continue
+            phn = patient["phn"]
+            yield index, json.dumps(dict(type="patient", **patient)) + '\n'
+            for note in self.iter_notes(phn):
+                yield index, json.dumps(dict(type="note", phn=phn, **note_to_dict(note))) + '\n'
+
+    def export(self, output_path, compress=False, checkpoint_path=None, resume=False):
+        ''' Write the clinic to output_path, optionally gzip compressed.
+
+        With a checkpoint file, progress is recorded every checkpoint_every
+        patients and resume=True continues from the last checkpoint. '''
+        checkpoint = self.read_checkpoint(checkpoint_path) if resume else None
+        if checkpoint:
+            # Cut anything written after the last checkpoint and append from there
+            raw = open(output_path, 'r+b')
+            raw.truncate(checkpoint["offset"])
+            raw.seek(checkpoint["offset"])
+            report = ExportReport(checkpoint["patients"], checkpoint["notes"])
+        else:
+            raw = open(output_path, 'wb')
+            report = ExportReport()
+
+        with raw:
+            out = self.open_member(raw, compress)
+            last_index = report.patients - 1
+            for index, line in self.iter_lines(skip=report.patients):
+                if index != last_index:
+                    # A new patient starts; the previous one is complete
+                    if checkpoint_path and report.patients and report.patients % self.checkpoint_every == 0:
+                        out = self.checkpoint(raw, out, compress, checkpoint_path, report)
+                    report.patients += 1
+                    last_index = index
+                else:
+                    report.notes += 1
+                out.write(line.encode('utf-8'))
+            out.close()
+            if checkpoint_path:
+                self.write_checkpoint(raw, checkpoint_path, report, done=True)
+        return report
+
+    def open_member(self, raw, compress):
+        # Every checkpoint closes a gzip member, concatenated members form a valid gzip file
+        if compress:
+            return gzip.GzipFile(fileobj=raw, mode='wb')
+        return NonClosingWriter(raw)
+
+    def checkpoint(self, raw, out, compress, checkpoint_path, report):
+        out.close()
+        self.write_checkpoint(raw, checkpoint_path, report)
+        return self.open_member(raw, compress)
+
+    def write_checkpoint(self, raw, checkpoint_path, report, done=False):
+        raw.flush()
+        os.fsync(raw.fileno())
+        state = {"patients": report.patients, "notes": report.notes, "offset": raw.tell(), "done": done}
+        temp_path = checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(temp_path, checkpoint_path)
+
+    def read_checkpoint(self, checkpoint_path):
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path, 'r') as file:
+            checkpoint = json.load(file)
+        return None if checkpoint.get("done") else checkpoint
+
+
+class NonClosingWriter():
+    ''' Plain output that leaves the underlying file open on close '''
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, data):
+        self.raw.write(data)
+
+    def close(self):
+        self.raw.flush()
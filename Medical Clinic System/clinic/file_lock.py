@@ -0,0 +1,82 @@
+import os
+import threading
+
+try:
+    # flock is POSIX only; elsewhere the threads of this process are still kept apart
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def try_lock(path):
+    ''' An open file holding an exclusive lock on path, None while another holder has it.
+    Every open file locks on its own, even within one process; close it to release. '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    file = open(path, 'a+b')
+    if fcntl is not None:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return None
+    return file
+
+
+class FileLock():
+    ''' Exclusive lock of the processes sharing a lock file and of the threads of this
+    process; the thread holding it may take it again. Get it from file_lock(). '''
+
+    def __init__(self, path):
+        self.path = path
+        # Threads of this process queue here, only the first one in locks the file
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def acquire(self):
+        self.lock.acquire()
+        try:
+            if not self.depth:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                file = open(self.path, 'a+b')
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+                    except BaseException:
+                        file.close()
+                        raise
+                self.file = file
+            self.depth += 1
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def release(self):
+        self.depth -= 1
+        if not self.depth:
+            # Closing the file drops the flock
+            self.file.close()
+            self.file = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+# One lock per lock file, so every controller and log of a data root in this process shares it
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def file_lock(path):
+    ''' The FileLock of the lock file at path '''
+    key = os.path.abspath(path)
+    with _locks_lock:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = FileLock(path)
+        return lock
@@ -1,19 +1,20 @@
 import sys
 from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QStandardItemModel, QStandardItem
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLineEdit, QLabel,
     QPushButton, QVBoxLayout, QMessageBox, QDialog, QDialogButtonBox, 
-    QFormLayout, QInputDialog, QTableView, QPlainTextEdit
+    QFormLayout, QInputDialog, QTableView, QPlainTextEdit, QStackedWidget
 )
 
 # Import necessary modules and exceptions from the clinic package
-from clinic.controller import Controller
+from clinic.remote_controller import controller_from_environ
+from clinic.gui.patient_table_model import PatientTableModel
 from clinic.exception.invalid_login_exception import InvalidLoginException
 from clinic.exception.invalid_logout_exception import InvalidLogoutException
 from clinic.exception.illegal_access_exception import IllegalAccessException
 from clinic.exception.illegal_operation_exception import IllegalOperationException
 from clinic.exception.no_current_patient_exception import NoCurrentPatientException
+from clinic.exception.conflict_exception import ConflictException
 
 class ClinicGUI(QMainWindow):
     """
@@ -24,8 +25,8 @@ class ClinicGUI(QMainWindow):
     def __init__(self):
         super().__init__()
 
-         # Initialize the controller with autosave enabled
-        self.controller = Controller(autosave=True)
+         # Initialize the controller with autosave enabled, or a remote one when CLINIC_SERVER is set
+        self.controller = controller_from_environ()
 
         # Set the window title and size
         self.setWindowTitle("Medical Clinic System")
@@ -35,17 +36,33 @@ class ClinicGUI(QMainWindow):
 
     def initUI(self):
 
-        # Create a central widget that will hold all other widgets
-        self.central_widget = QWidget()
-        self.setCentralWidget(self.central_widget)
+        # Create a stacked widget that holds every screen; screens are built once
+        # and switching between them only changes the visible page
+        self.stacked_widget = QStackedWidget()
+        self.setCentralWidget(self.stacked_widget)
+
+        # Remember the last search strings so they survive screen switches
+        self.last_patient_search = ""
+        self.last_note_search = ""
+
+        # Build all screens up front
+        self.login_widget = self.build_login_screen()
+        self.main_menu_widget = self.build_main_menu()
+        self.appointment_widget = self.build_appointment_menu()
+
+        self.stacked_widget.addWidget(self.login_widget)
+        self.stacked_widget.addWidget(self.main_menu_widget)
+        self.stacked_widget.addWidget(self.appointment_widget)
 
         # Display the login screen
         self.login_screen()
 
-    def login_screen(self):
+    def build_login_screen(self):
         """
-        Displays the login screen where users can enter their username and password.
+        Builds the login screen where users can enter their username and password.
         """
+        widget = QWidget()
+
         # Create a vertical layout to arrange widgets vertically
         layout = QVBoxLayout()
 
@@ -68,10 +85,17 @@ class ClinicGUI(QMainWindow):
         layout.addWidget(self.password_input)
         layout.addWidget(self.login_button)
 
-        
+        # Set the layout for the login widget
+        widget.setLayout(layout)
+        return widget
 
-        # Set the layout for the central widget
-        self.central_widget.setLayout(layout)
+    def login_screen(self):
+        """
+        Displays the login screen where users can enter their username and password.
+        """
+        # Never keep a password around between sessions
+        self.password_input.clear()
+        self.stacked_widget.setCurrentWidget(self.login_widget)
 
     def login(self):
         """
@@ -92,14 +116,11 @@ class ClinicGUI(QMainWindow):
             # Show an error message if login fails
             QMessageBox.warning(self, "Login Failed", "Invalid username or password.")
 
-    def main_menu(self):
+    def build_main_menu(self):
         """
-        Displays the main menu after the user has successfully logged in.
+        Builds the main menu shown after the user has successfully logged in.
         """
-        # Clear the central widget
-        self.central_widget.deleteLater()
-        self.central_widget = QWidget()
-        self.setCentralWidget(self.central_widget)
+        widget = QWidget()
 
         # Create a vertical layout for the main menu buttons
         layout = QVBoxLayout()
@@ -126,6 +147,9 @@ class ClinicGUI(QMainWindow):
         self.start_appointment_button = QPushButton("Start appointment with patient")
         self.start_appointment_button.clicked.connect(self.start_appointment)
 
+        self.profiling_button = QPushButton("Start profiling")
+        self.profiling_button.clicked.connect(self.toggle_profiling)
+
         self.logout_button = QPushButton("Log out")
         self.logout_button.clicked.connect(self.logout)
 
@@ -137,10 +161,45 @@ class ClinicGUI(QMainWindow):
         layout.addWidget(self.delete_patient_button)
         layout.addWidget(self.list_patients_button)
         layout.addWidget(self.start_appointment_button)
+        layout.addWidget(self.profiling_button)
         layout.addWidget(self.logout_button)
 
-        # Set the layout for the central widget
-        self.central_widget.setLayout(layout)
+        # Set the layout for the main menu widget
+        widget.setLayout(layout)
+        return widget
+
+    def main_menu(self):
+        """
+        Displays the main menu after the user has successfully logged in.
+        """
+        # Profiling may have been started from the command line
+        self.update_profiling_button()
+        self.stacked_widget.setCurrentWidget(self.main_menu_widget)
+
+    def update_profiling_button(self):
+        """
+        Shows whether the profiling button starts or stops a capture.
+        """
+        if self.controller.is_profiling():
+            self.profiling_button.setText("Stop profiling")
+        else:
+            self.profiling_button.setText("Start profiling")
+
+    def toggle_profiling(self):
+        """
+        Starts or stops capturing cProfile and tracemalloc data without a restart.
+        """
+        try:
+            if self.controller.is_profiling():
+                paths = self.controller.stop_profiling()
+                QMessageBox.information(self, "Profiling stopped", "Files written:\n" + "\n".join(paths))
+            else:
+                self.controller.start_profiling()
+                QMessageBox.information(self, "Profiling started", "Profiling data is being captured.")
+            self.update_profiling_button()
+        except IllegalAccessException:
+            # Show an error if the user is not logged in
+            QMessageBox.warning(self, "Error", "Must login first.")
 
     def create_patient(self):
         """
@@ -244,14 +303,17 @@ class ClinicGUI(QMainWindow):
         Retrieves patients whose names match a search string provided by the user.
         """
         # Prompt the user to enter a name to search for
-        search_string, ok = QInputDialog.getText(self, "Retrieve patients by name", "Search for:")
+        search_string, ok = QInputDialog.getText(
+            self, "Retrieve patients by name", "Search for:", text=self.last_patient_search
+        )
         if ok:
+            self.last_patient_search = search_string
             try:
                 # Retrieve patients matching the search string
                 found_patients = self.controller.retrieve_patients(search_string)
                 if found_patients:
                     # If patients are found, display them in a table
-                    self.show_patients_table(found_patients)
+                    self.show_patients_table(found_patients, search_string)
                 else:
                     # If no patients are found, inform the user
                     QMessageBox.information(
@@ -262,25 +324,16 @@ class ClinicGUI(QMainWindow):
                 QMessageBox.warning(self, "Error", "Must login first.")
 
     
-    def show_patients_table(self, patients):
+    def show_patients_table(self, patients, search_string=None):
         """
         Displays a list of patients in a QTableView within a dialog.
+        The rows follow patient changes while the dialog is open.
         """
         # Create a QTableView widget
         table_view = QTableView(self)
 
-        # Create a model for the table
-        model = QStandardItemModel(len(patients), 6)  # Rows and Columns
-        model.setHorizontalHeaderLabels(["PHN", "Name", "Birth date", "Phone", "Email", "Address"])
-
-        # Populate the model with patient data
-        for row, patient in enumerate(patients):
-            model.setItem(row, 0, QStandardItem(str(patient.phn)))
-            model.setItem(row, 1, QStandardItem(patient.name))
-            model.setItem(row, 2, QStandardItem(patient.birth_date))
-            model.setItem(row, 3, QStandardItem(patient.phone))
-            model.setItem(row, 4, QStandardItem(patient.email))
-            model.setItem(row, 5, QStandardItem(patient.address))
+        # Create a model for the table, populated with the patient data
+        model = PatientTableModel(self.controller, patients, search_string, table_view)
 
         # Set the model for the table view
         table_view.setModel(model)
@@ -293,8 +346,9 @@ class ClinicGUI(QMainWindow):
         layout.addWidget(table_view)
         dialog.setLayout(layout)
 
-        # Show the dialog
+        # Show the dialog, then stop following the changes
         dialog.exec()
+        model.close()
 
     
     def update_patient(self):
@@ -308,6 +362,8 @@ class ClinicGUI(QMainWindow):
                 # Search for the patient using the controller
                 patient = self.controller.search_patient(phn)
                 if patient:
+                    # The update is refused if someone else changes the patient meanwhile
+                    version = patient.version
                     # Create a dialog to input new data
                     dialog = QDialog(self)
                     dialog.setWindowTitle("Update Patient Data")
@@ -380,6 +436,7 @@ class ClinicGUI(QMainWindow):
                                 new_phone,
                                 new_email,
                                 new_address,
+                                version,
                             )
                             # Inform the user of success
                             QMessageBox.information(self, "Success", "Patient data changed.")
@@ -391,6 +448,8 @@ class ClinicGUI(QMainWindow):
             except IllegalAccessException:
                 # Show an error if the user is not logged in
                 QMessageBox.warning(self, "Error", "Must login first.")
+            except ConflictException:
+                QMessageBox.warning(self, "Error", "The patient was changed by someone else meanwhile, nothing was changed.")
             except IllegalOperationException:
                 QMessageBox.warning(self, "Error", str(IllegalOperationException))
 
@@ -406,6 +465,7 @@ class ClinicGUI(QMainWindow):
                 # Search for the patient using the controller
                 patient = self.controller.search_patient(phn)
                 if patient:
+                    version = patient.version
                     # Confirm the deletion with the user
                     confirm = QMessageBox.question(
                         self,
@@ -414,7 +474,7 @@ class ClinicGUI(QMainWindow):
                     )
                     if confirm == QMessageBox.StandardButton.Yes:
                         # Delete the patient using the controller
-                        self.controller.delete_patient(phn)
+                        self.controller.delete_patient(phn, version)
                         # Inform the user of success
                         QMessageBox.information(
                             self, "Success", "Patient removed from the system."
@@ -427,6 +487,8 @@ class ClinicGUI(QMainWindow):
             except IllegalAccessException:
                 # Show an error if the user is not logged in
                 QMessageBox.warning(self, "Error", "Must login first.")
+            except ConflictException:
+                QMessageBox.warning(self, "Error", "The patient was changed by someone else meanwhile, it was not removed.")
             except IllegalOperationException:
                 QMessageBox.warning(self, "Error", str(IllegalOperationException))
 
@@ -475,14 +537,11 @@ class ClinicGUI(QMainWindow):
                 )
 
 
-    def appointment_menu(self):
+    def build_appointment_menu(self):
         """
-        Displays the appointment menu where the user can manage patient notes.
+        Builds the appointment menu where the user can manage patient notes.
         """
-        # Clear the central widget
-        self.central_widget.deleteLater()
-        self.central_widget = QWidget()
-        self.setCentralWidget(self.central_widget)
+        widget = QWidget()
 
         # Create a vertical layout for the appointment menu buttons
         layout = QVBoxLayout()
@@ -514,8 +573,15 @@ class ClinicGUI(QMainWindow):
         layout.addWidget(self.list_notes_button)
         layout.addWidget(self.end_appointment_button)
 
-        # Set the layout for the central widget
-        self.central_widget.setLayout(layout)
+        # Set the layout for the appointment menu widget
+        widget.setLayout(layout)
+        return widget
+
+    def appointment_menu(self):
+        """
+        Displays the appointment menu where the user can manage patient notes.
+        """
+        self.stacked_widget.setCurrentWidget(self.appointment_widget)
 
     def create_note(self):
         """
@@ -543,8 +609,11 @@ class ClinicGUI(QMainWindow):
         Retrieve notes containing a specific search string and display them in a QPlainTextEdit widget.
         """
         try:
-            search_string, ok = QInputDialog.getText(self, "Retrieve Notes", "Search for:")
+            search_string, ok = QInputDialog.getText(
+                self, "Retrieve Notes", "Search for:", text=self.last_note_search
+            )
             if ok:
+                self.last_note_search = search_string
                 # Retrieve matching notes
                 found_notes = self.controller.retrieve_notes(search_string)
                 if found_notes:
@@ -606,6 +675,8 @@ class ClinicGUI(QMainWindow):
                 # Search for the note using the controller
                 note = self.controller.search_note(code)
                 if note:
+                    # The update is refused if someone else changes the note meanwhile
+                    version = note.version
                     # Display the note data
                     self.show_note_data(note)
                     # Confirm the update with the user
@@ -621,7 +692,7 @@ class ClinicGUI(QMainWindow):
                         )
                         if ok:
                             # Update the note using the controller
-                            self.controller.update_note(code, new_text)
+                            self.controller.update_note(code, new_text, version)
                             # Inform the user of success
                             QMessageBox.information(self, "Success", "Note updated.")
                 else:
@@ -637,6 +708,8 @@ class ClinicGUI(QMainWindow):
             QMessageBox.warning(
                 self, "Error", "Cannot update note without a valid current patient."
             )
+        except ConflictException:
+            QMessageBox.warning(self, "Error", "The note was changed by someone else meanwhile, nothing was changed.")
 
     def show_note_data(self, note):
         """
@@ -658,6 +731,7 @@ class ClinicGUI(QMainWindow):
                 # Search for the note using the controller
                 note = self.controller.search_note(code)
                 if note:
+                    version = note.version
                     # Display the note data
                     self.show_note_data(note)
                     # Confirm the deletion with the user
@@ -668,7 +742,7 @@ class ClinicGUI(QMainWindow):
                     )
                     if confirm == QMessageBox.StandardButton.Yes:
                         # Delete the note using the controller
-                        self.controller.delete_note(code)
+                        self.controller.delete_note(code, version)
                         # Inform the user of success
                         QMessageBox.information(self, "Success", "Note removed.")
                 else:
@@ -684,6 +758,8 @@ class ClinicGUI(QMainWindow):
             QMessageBox.warning(
                 self, "Error", "Cannot remove note without a valid current patient."
             )
+        except ConflictException:
+            QMessageBox.warning(self, "Error", "The note was changed by someone else meanwhile, it was not removed.")
 
     def list_full_patient_record(self):
         """
@@ -746,9 +822,6 @@ class ClinicGUI(QMainWindow):
             # Inform the user of success
             QMessageBox.information(self, "Logged out", "You have been logged out.")
             # Return to the login screen
-            self.central_widget.deleteLater()
-            self.central_widget = QWidget()
-            self.setCentralWidget(self.central_widget)
             self.login_screen()
         except InvalidLogoutException:
             # Show an error if the user is already logged out
@@ -763,6 +836,8 @@ def main():
     window = ClinicGUI()
     window.show()
     app.exec()
+    # A clean shutdown leaves the warm-start snapshot for the next start
+    window.controller.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,82 @@
+from PyQt6.QtCore import pyqtSignal
+from PyQt6.QtGui import QStandardItemModel, QStandardItem
+
+from clinic.events import PatientCreated, PatientUpdated, PatientDeleted, DataImported
+
+COLUMNS = ["PHN", "Name", "Birth date", "Phone", "Email", "Address"]
+
+
+class PatientTableModel(QStandardItemModel):
+    """
+    Table of patients that stays current while it is open.
+    Patient changes published by the controller are applied row by row instead of reloading.
+    """
+
+    # Changes can be published from any thread, rows are only touched in the GUI thread
+    event_received = pyqtSignal(object)
+
+    def __init__(self, controller, patients, search_string=None, parent=None):
+        super().__init__(0, len(COLUMNS), parent)
+        self.setHorizontalHeaderLabels(COLUMNS)
+        self.controller = controller
+        # None shows every patient, otherwise the patients whose name contains it
+        self.search_string = search_string
+        for patient in patients:
+            self.appendRow(self.make_row(patient))
+
+        self.event_received.connect(self.apply_event)
+        self.callback = self.event_received.emit
+        self.controller.subscribe(self.callback, PatientCreated, PatientUpdated, PatientDeleted, DataImported)
+
+    def close(self):
+        """
+        Stops following the controller's changes; call it when the view closes.
+        """
+        self.controller.unsubscribe(self.callback)
+
+    def make_row(self, patient):
+        return [QStandardItem(str(patient.phn)), QStandardItem(patient.name), QStandardItem(patient.birth_date),
+                QStandardItem(patient.phone), QStandardItem(patient.email), QStandardItem(patient.address)]
+
+    def matches(self, patient):
+        return self.search_string is None or self.search_string in patient.name
+
+    def find_row(self, phn):
+        for row in range(self.rowCount()):
+            if self.item(row, 0).text() == str(phn):
+                return row
+        return None
+
+    def apply_event(self, event):
+        if isinstance(event, DataImported):
+            self.reload()
+        elif isinstance(event, PatientCreated):
+            if self.matches(event.patient):
+                self.appendRow(self.make_row(event.patient))
+        elif isinstance(event, PatientUpdated):
+            # Also covers PatientRekeyed, the row is found by the PHN before the change
+            row = self.find_row(event.original_phn)
+            if row is None:
+                if self.matches(event.patient):
+                    self.appendRow(self.make_row(event.patient))
+            elif self.matches(event.patient):
+                for column, item in enumerate(self.make_row(event.patient)):
+                    self.setItem(row, column, item)
+            else:
+                self.removeRow(row)
+        elif isinstance(event, PatientDeleted):
+            row = self.find_row(event.patient.phn)
+            if row is not None:
+                self.removeRow(row)
+
+    def reload(self):
+        """
+        Rebuilds every row, for changes that do not say which patients moved (bulk imports).
+        """
+        if self.search_string is None:
+            patients = self.controller.list_patients()
+        else:
+            patients = self.controller.retrieve_patients(self.search_string)
+        self.removeRows(0, self.rowCount())
+        for patient in patients:
+            self.appendRow(self.make_row(patient))
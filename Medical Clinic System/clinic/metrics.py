@@ -0,0 +1,155 @@
+import functools
+import json
+import math
+import os
+import threading
+import time
+from clinic.profiling import profiler
+
+# Histogram resolution: buckets per doubling of the latency, about 9% apart
+BUCKETS_PER_OCTAVE = 8
+# Largest bucket is 2**42 ns, a bit over an hour
+MAX_BUCKET = 42 * BUCKETS_PER_OCTAVE
+
+
+class LatencyHistogram():
+    ''' Log-linear latency histogram with constant memory and O(1) recording.
+    Threads of the server observe into the same histogram, each change holds the lock. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * (MAX_BUCKET + 1)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            for i in range(len(self.buckets)):
+                self.buckets[i] = 0
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def observe(self, seconds):
+        ''' Record one latency given in seconds '''
+        nanoseconds = seconds * 1e9
+        index = int(math.log2(nanoseconds) * BUCKETS_PER_OCTAVE) if nanoseconds > 1 else 0
+        with self.lock:
+            self.buckets[min(index, MAX_BUCKET)] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, fraction):
+        ''' Upper bound in seconds of the bucket holding the given fraction of samples '''
+        with self.lock:
+            return self.bound(fraction)
+
+    def bound(self, fraction):
+        ''' percentile() with the lock held '''
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                # Never report more than the largest latency actually seen
+                return min(2 ** ((index + 1) / BUCKETS_PER_OCTAVE) / 1e9, self.max)
+        return self.max
+
+    def snapshot(self):
+        ''' Summary of the histogram, times in milliseconds '''
+        with self.lock:
+            return {
+                "count": self.count,
+                "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "p50_ms": self.bound(0.50) * 1000,
+                "p95_ms": self.bound(0.95) * 1000,
+                "p99_ms": self.bound(0.99) * 1000,
+                "max_ms": self.max * 1000
+            }
+
+
+class MetricsRegistry():
+    ''' Named latency histograms shared by the whole process '''
+
+    def __init__(self):
+        self.enabled = True
+        self.histograms = {}
+        self.dump_timer = None
+
+    def histogram(self, name):
+        ''' Return the histogram for name, creating it on first use '''
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def snapshot(self):
+        ''' Summaries of every operation that ran at least once '''
+        return {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())
+                if histogram.count}
+
+    def reset(self):
+        # Histograms are cleared in place, timed functions keep a reference to them
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def dump(self, file_path):
+        ''' Write the current snapshot as JSON, replacing the file atomically '''
+        temp_path = file_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({"timestamp": time.time(), "pid": os.getpid(), "metrics": self.snapshot()}, file, indent=4)
+        os.replace(temp_path, file_path)
+
+    def start_dump(self, file_path, interval=60):
+        ''' Dump the snapshot to file_path every interval seconds in a daemon thread '''
+        self.stop_dump()
+
+        def run():
+            try:
+                self.dump(file_path)
+            except OSError:
+                # Metrics must never break the clinic
+                pass
+            self.start_dump(file_path, interval)
+
+        self.dump_timer = threading.Timer(interval, run)
+        self.dump_timer.daemon = True
+        self.dump_timer.start()
+
+    def stop_dump(self):
+        if self.dump_timer:
+            self.dump_timer.cancel()
+            self.dump_timer = None
+
+
+# Default registry used by the timed decorator
+registry = MetricsRegistry()
+
+
+def timed(name):
+    ''' Decorator recording the latency of every call, including failed ones.
+
+    It is also where the opt-in profiler captures Controller and DAO calls. '''
+    def decorate(function):
+        histogram = registry.histogram(name)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiling = profiler.active
+            if not registry.enabled and not profiling:
+                return function(*args, **kwargs)
+            if profiling:
+                profiler.enter()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if registry.enabled:
+                    histogram.observe(time.perf_counter() - start)
+                if profiling:
+                    profiler.exit()
+        return wrapper
+    return decorate
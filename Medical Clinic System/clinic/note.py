@@ -3,11 +3,15 @@ import datetime
 class Note():
 	''' class that represents a note '''
 
-	def __init__(self, code, text, timestamp=datetime.datetime.now()):
-		''' constructs a note '''
+	# notes pickled before versions were kept are at their first version
+	version = 1
+
+	def __init__(self, code, text, timestamp=datetime.datetime.now(), version=1):
+		''' constructs a note; version counts the changes of its text '''
 		self.code = code
 		self.text = text
 		self.timestamp = timestamp
+		self.version = version
 
 	def __eq__(self, other):
 		''' checks whether this note is the same as other note '''
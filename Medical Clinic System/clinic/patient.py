@@ -1,20 +1,21 @@
 from clinic.patient_record import PatientRecord
-from clinic.controller import *
 
 class Patient():
 	''' class that represents a patient '''
 
 
-	def __init__(self, phn, name, birth_date, phone, email, address, autosave=True):
-		''' constructs a patient '''
+	def __init__(self, phn, name, birth_date, phone, email, address, autosave=True, change_log=None, config=None, load_record=True, version=1):
+		''' constructs a patient; with load_record=False the notes are loaded later.
+			version counts the changes of the patient's data '''
 		self.phn = phn
 		self.name = name
 		self.birth_date = birth_date
 		self.phone = phone
 		self.email = email
 		self.address = address
+		self.version = version
 
-		self.record = PatientRecord(phn=self.phn, autosave=autosave)
+		self.record = PatientRecord(phn=self.phn, autosave=autosave, change_log=change_log, config=config, load=load_record)
 
 	def get_patient_record(self):
 		''' get the patient's record '''
@@ -43,17 +44,21 @@ class Patient():
 		''' delegates note creation to the patient's record '''
 		return self.record.create_note(text)
 
+	def create_notes(self, entries):
+		''' delegates bulk note creation to the patient's record '''
+		return self.record.create_notes(entries)
+
 	def retrieve_notes(self, search_string):
 		''' delegates note retrieval to the patient's record '''
 		return self.record.retrieve_notes(search_string)
 
-	def update_note(self, code, new_text):
+	def update_note(self, code, new_text, version=None):
 		''' delegates note updating to the patient's record '''
-		return self.record.update_note(code, new_text)
+		return self.record.update_note(code, new_text, version)
 
-	def delete_note(self, code):
+	def delete_note(self, code, version=None):
 		''' delegates note deletion to the patient's record '''
-		return self.record.delete_note(code)
+		return self.record.delete_note(code, version)
 
 	def list_notes(self):
 		''' delegates note listing to the patient's record '''
@@ -3,11 +3,32 @@ from clinic.dao.note_dao_pickle import NoteDAOPickle
 class PatientRecord:
     ''' Class that represents a patient's medical record '''
 
-    def __init__(self, phn=None, autosave=True):
-        ''' Construct a patient record '''
-        self.phn = phn
+    def __init__(self, phn=None, autosave=True, change_log=None, config=None, load=True):
+        ''' Construct a patient record; with load=False its notes are loaded later '''
         self.autosave = autosave
-        self.note_dao = NoteDAOPickle(phn=self.phn, autosave=self.autosave)  # Instantiate NoteDAOPickle
+        self.note_dao = NoteDAOPickle(phn=phn, autosave=self.autosave, change_log=change_log, config=config,
+                                      load=load)  # Instantiate NoteDAOPickle
+
+    @property
+    def phn(self):
+        ''' The PHN the record is stored under '''
+        return self.note_dao.phn
+
+    def rekey(self, new_phn):
+        ''' Store the record under a new PHN '''
+        self.note_dao.rekey(new_phn)
+
+    def check_writable(self):
+        ''' Raise IllegalOperationException if the record could not be saved '''
+        self.note_dao.check_writable()
+
+    def discard(self, phn=None):
+        ''' Drop the stored record, by default under its own PHN '''
+        self.note_dao.discard(phn)
+
+    def refresh(self):
+        ''' Reload the record if another process saved it; returns the note events '''
+        return self.note_dao.refresh()
 
     def search_note(self, code):
         ''' Search for a note in the patient's record '''
@@ -17,17 +38,21 @@ class PatientRecord:
         ''' Create a new note in the patient's record '''
         return self.note_dao.create_note(text)
 
+    def create_notes(self, entries):
+        ''' Create several notes in the patient's record at once '''
+        return self.note_dao.create_notes(entries)
+
     def retrieve_notes(self, search_string):
         ''' Retrieve notes that match a search string '''
         return self.note_dao.retrieve_notes(search_string)
 
-    def update_note(self, code, new_text):
-        ''' Update a note's text '''
-        return self.note_dao.update_note(code, new_text)
+    def update_note(self, code, new_text, version=None):
+        ''' Update a note's text, if given only at that version of the note '''
+        return self.note_dao.update_note(code, new_text, version)
 
-    def delete_note(self, code):
-        ''' Delete a note by its code '''
-        return self.note_dao.delete_note(code)
+    def delete_note(self, code, version=None):
+        ''' Delete a note by its code, if given only at that version of the note '''
+        return self.note_dao.delete_note(code, version)
 
     def list_notes(self):
         ''' List all notes in reverse chronological order '''
@@ -0,0 +1,113 @@
+import atexit
+import cProfile
+import datetime
+import os
+import pstats
+import threading
+import tracemalloc
+
+DEFAULT_PROFILE_DIR = 'profiles'
+
+
+class Profiler():
+    ''' Opt-in cProfile and tracemalloc capture around Controller and DAO calls.
+
+    A cProfile hook only sees the thread that enabled it, so every thread calling in
+    during a session gets its own profile, merged into one file at stop. Calls running
+    in a thread when the session starts or stops are left out. '''
+
+    def __init__(self):
+        self.active = False
+        self.cpu = False
+        # The profile of every thread that called in during the session
+        self.profiles = []
+        self.memory = False
+        self.output_dir = None
+        self.session = None
+        # start and stop of any thread, and the threads adding their profile
+        self.lock = threading.Lock()
+        # depth of the timed calls of each thread, and the profile it enabled
+        self.local = threading.local()
+        atexit.register(self.stop)
+
+    def start(self, output_dir=DEFAULT_PROFILE_DIR, cpu=True, memory=True):
+        ''' Start a capture session writing its files to output_dir '''
+        with self.lock:
+            if self.active:
+                return False
+            os.makedirs(output_dir, exist_ok=True)
+            self.output_dir = output_dir
+            self.session = 'session-%s-%d' % (datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), os.getpid())
+            self.cpu = cpu
+            self.profiles = []
+            # tracemalloc cannot be scoped to single calls, it traces the whole session
+            self.memory = memory and not tracemalloc.is_tracing()
+            if self.memory:
+                tracemalloc.start(25)
+            self.active = True
+            return True
+
+    def stop(self):
+        ''' Stop the session and return the paths of the files written '''
+        with self.lock:
+            if not self.active:
+                return []
+            self.active = False
+            profiles, self.profiles = self.profiles, []
+        # Only the outermost call enables a profile, make sure the one of this thread is off;
+        # the others are switched off by their thread when its call returns
+        self.disable()
+        paths = []
+        base = os.path.join(self.output_dir, self.session)
+        if self.cpu:
+            # pstats refuses a profile without any call, an empty session still gets its file
+            profiles = [profile for profile in profiles if profile.getstats()]
+            (pstats.Stats(*profiles) if profiles else cProfile.Profile()).dump_stats(base + '.prof')
+            paths.append(base + '.prof')
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(base + '.alloc')
+            with open(base + '-alloc.txt', 'w') as file:
+                for stat in snapshot.statistics('lineno')[:50]:
+                    file.write(str(stat) + '\n')
+            paths.extend([base + '.alloc', base + '-alloc.txt'])
+        self.memory = False
+        return paths
+
+    def enter(self):
+        ''' Called by timed functions before running; nested calls share the outer capture '''
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        if depth or not (self.active and self.cpu):
+            return
+        profile = cProfile.Profile()
+        with self.lock:
+            if not self.active:
+                return
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12 and later: one profile at a time, it sees every thread already
+                return
+            self.profiles.append(profile)
+        self.local.profile = profile
+
+    def exit(self):
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0:
+            return
+        self.local.depth = depth - 1
+        if depth == 1:
+            self.disable()
+
+    def disable(self):
+        ''' Switch off the profile this thread enabled, if any '''
+        profile = getattr(self.local, 'profile', None)
+        if profile:
+            profile.disable()
+            self.local.profile = None
+
+
+# Process-wide profiler driven by the timed decorator
+profiler = Profiler()
@@ -0,0 +1,108 @@
+import collections
+import threading
+from clinic.events import PatientCreated, PatientUpdated, PatientRekeyed, PatientDeleted, \
+    NoteCreated, NoteUpdated, NoteDeleted, DataImported
+
+
+class QueryCache():
+    ''' Bounded LRU cache of query results keyed by (operation, arguments...) tuples '''
+
+    def __init__(self, maxsize=256):
+        ''' Construct a cache holding at most maxsize results; 0 disables it '''
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped by every invalidation, a result computed across one is not stored
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        ''' Return (found, value) and count the hit or miss '''
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, generation):
+        ''' Store a result computed when the cache was at the given generation '''
+        if not self.maxsize:
+            return
+        with self.lock:
+            if generation != self.generation:
+                # A mutation ran while the result was computed, it may be stale
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def lookup(self, key, compute):
+        ''' Cached result for key, computing and storing it on a miss '''
+        found, value = self.get(key)
+        if found:
+            return value
+        generation = self.generation
+        value = compute()
+        self.put(key, value, generation)
+        return value
+
+    def invalidate(self, match):
+        ''' Drop every entry whose key satisfies match(key) '''
+        with self.lock:
+            self.generation += 1
+            for key in [key for key in self.entries if match(key)]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        self.invalidate(lambda key: True)
+
+    def invalidate_patients(self, *names):
+        ''' Drop the patient listings and finds and the name retrievals matching any of the names '''
+        self.invalidate(lambda key: key[0] in ('list_patients', 'find_patients')
+                        or (key[0] == 'retrieve_patients' and any(key[1] in name for name in names)))
+
+    def invalidate_notes(self, phn, *texts):
+        ''' Drop the note listings of a patient and its retrievals matching any text, all without texts '''
+        self.invalidate(lambda key: key[1:2] == (phn,) and (key[0] == 'list_notes' or (
+            key[0] == 'retrieve_notes' and (not texts or any(key[2] in text for text in texts)))))
+
+    def apply_event(self, event):
+        ''' EventBus subscriber dropping exactly the results a change can affect '''
+        if isinstance(event, PatientUpdated):
+            self.invalidate_patients(event.original_name, event.patient.name)
+            if isinstance(event, PatientRekeyed):
+                # The record moved with the patient
+                self.invalidate_notes(event.original_phn)
+        elif isinstance(event, PatientCreated):
+            self.invalidate_patients(event.patient.name)
+        elif isinstance(event, PatientDeleted):
+            self.invalidate_patients(event.patient.name)
+            self.invalidate_notes(event.patient.phn)
+        elif isinstance(event, NoteUpdated):
+            self.invalidate_notes(event.phn, event.old_text, event.note.text)
+        elif isinstance(event, (NoteCreated, NoteDeleted)):
+            self.invalidate_notes(event.phn, event.note.text)
+        elif isinstance(event, DataImported):
+            self.clear()
+
+    def stats(self):
+        ''' Hit and miss counters and the current size '''
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self.entries),
+                "maxsize": self.maxsize
+            }
@@ -0,0 +1,244 @@
+import datetime
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+from clinic.bulk_import import ImportReport
+from clinic.controller import Controller
+from clinic.note import Note
+from clinic.patient import Patient
+from clinic.exception.invalid_login_exception import InvalidLoginException
+from clinic.exception.duplicate_login_exception import DuplicateLoginException
+from clinic.exception.invalid_logout_exception import InvalidLogoutException
+from clinic.exception.illegal_access_exception import IllegalAccessException
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+from clinic.exception.no_current_patient_exception import NoCurrentPatientException
+from clinic.exception.conflict_exception import ConflictException
+
+SESSION_HEADER = 'X-Clinic-Session'
+
+# Exceptions the server reports by name
+EXCEPTIONS = {exception.__name__: exception for exception in (
+    InvalidLoginException, DuplicateLoginException, InvalidLogoutException,
+    IllegalAccessException, IllegalOperationException, NoCurrentPatientException, ConflictException)}
+
+
+def patient_from_dict(data):
+    ''' converts a patient sent by the server; its record stays on the server '''
+    if data is None:
+        return None
+    return Patient(data["phn"], data["name"], data["birth_date"], data["phone"], data["email"],
+                   data["address"], autosave=False, version=data.get("version", 1))
+
+
+def note_from_dict(data):
+    ''' converts a note sent by the server '''
+    if data is None:
+        return None
+    timestamp = datetime.datetime.fromisoformat(data["timestamp"]) if data["timestamp"] else None
+    return Note(data["code"], data["text"], timestamp, data.get("version", 1))
+
+
+def controller_from_environ(environ=None):
+    ''' RemoteController for the CLINIC_SERVER URL if set, otherwise a local Controller
+    loading the records with CLINIC_LOAD_WORKERS threads, from its warm-start snapshot
+    if CLINIC_WARM_START is 1, and polling the data directory for the changes of other
+    workstations every CLINIC_WATCH_INTERVAL seconds if set '''
+    environ = os.environ if environ is None else environ
+    url = environ.get('CLINIC_SERVER')
+    if url:
+        return RemoteController(url)
+    controller = Controller(autosave=True, load_workers=int(environ.get('CLINIC_LOAD_WORKERS', 0)),
+                            warm_start=environ.get('CLINIC_WARM_START') == '1')
+    if environ.get('CLINIC_WATCH_INTERVAL'):
+        controller.watch(float(environ['CLINIC_WATCH_INTERVAL']))
+    return controller
+
+
+class RemoteController():
+    ''' Controller stand-in that runs every operation on a clinic server '''
+
+    def __init__(self, url, timeout=60):
+        ''' construct a remote controller for a server URL like http://127.0.0.1:8765 '''
+        parts = urllib.parse.urlsplit(url if '//' in url else '//' + url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.connection = None
+        self.token = None
+        # One request at a time on the kept-alive connection
+        self.lock = threading.Lock()
+
+        self.username = None
+        self.logged = False
+        self.current_patient = None
+
+    def call(self, operation, **arguments):
+        ''' run one operation on the server and return its JSON result '''
+        body = json.dumps(arguments).encode('utf-8')
+        with self.lock:
+            headers = {'Content-Type': 'application/json'}
+            if self.token:
+                headers[SESSION_HEADER] = self.token
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                try:
+                    self.connection.request('POST', '/api/' + operation, body, headers)
+                    response = self.connection.getresponse()
+                    payload = response.read()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # The server closed an idle kept-alive connection; reconnect once
+                    self.close()
+                    if attempt:
+                        raise
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+            self.token = response.getheader(SESSION_HEADER) or self.token
+
+        data = json.loads(payload)
+        if response.status != 200:
+            exception = EXCEPTIONS.get(data.get("error"))
+            if exception:
+                raise exception(data.get("message", ""))
+            raise OSError('clinic server error %d: %s' % (response.status, data.get("message")))
+        return data["result"]
+
+    def close(self):
+        ''' drop the connection; the server keeps the clinic open '''
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def subscribe(self, callback, *event_types):
+        ''' the server does not push changes, remote views are refreshed when reopened '''
+        return callback
+
+    def unsubscribe(self, callback):
+        pass
+
+    def login(self, username, password):
+        ''' user logs in the system '''
+        result = self.call('login', username=username, password=password)
+        self.username = username
+        self.logged = True
+        return result
+
+    def logout(self):
+        ''' user logs out from the system '''
+        result = self.call('logout')
+        self.username = None
+        self.logged = False
+        self.current_patient = None
+        return result
+
+    def search_patient(self, phn):
+        return patient_from_dict(self.call('search_patient', phn=phn))
+
+    def create_patient(self, phn, name, birth_date, phone, email, address):
+        return patient_from_dict(self.call('create_patient', phn=phn, name=name, birth_date=birth_date,
+                                           phone=phone, email=email, address=address))
+
+    def retrieve_patients(self, name):
+        return [patient_from_dict(patient) for patient in self.call('retrieve_patients', name=name)]
+
+    def find_patients(self, **criteria):
+        return [patient_from_dict(patient) for patient in self.call('find_patients', **criteria)]
+
+    def update_patient(self, original_phn, phn, name, birth_date, phone, email, address, version=None):
+        return self.call('update_patient', original_phn=original_phn, phn=phn, name=name,
+                         birth_date=birth_date, phone=phone, email=email, address=address, version=version)
+
+    def delete_patient(self, phn, version=None):
+        return self.call('delete_patient', phn=phn, version=version)
+
+    def list_patients(self):
+        return [patient_from_dict(patient) for patient in self.call('list_patients')]
+
+    def set_current_patient(self, phn):
+        self.call('set_current_patient', phn=phn)
+        self.current_patient = self.get_current_patient()
+
+    def get_current_patient(self):
+        return patient_from_dict(self.call('get_current_patient'))
+
+    def unset_current_patient(self):
+        self.call('unset_current_patient')
+        self.current_patient = None
+
+    def search_note(self, code):
+        return note_from_dict(self.call('search_note', code=code))
+
+    def create_note(self, text):
+        return note_from_dict(self.call('create_note', text=text))
+
+    def retrieve_notes(self, search_string):
+        return [note_from_dict(note) for note in self.call('retrieve_notes', search_string=search_string)]
+
+    def update_note(self, code, new_text, version=None):
+        return self.call('update_note', code=code, new_text=new_text, version=version)
+
+    def delete_note(self, code, version=None):
+        return self.call('delete_note', code=code, version=version)
+
+    def list_notes(self):
+        return [note_from_dict(note) for note in self.call('list_notes')]
+
+    def import_patients(self, file, fmt='ndjson', **options):
+        ''' user bulk imports patients; the file is sent to the server in one request '''
+        return self.run_import('import_patients', file, fmt, **options)
+
+    def import_notes(self, file, fmt='ndjson', **options):
+        ''' user bulk imports notes; the file is sent to the server in one request '''
+        return self.run_import('import_notes', file, fmt, **options)
+
+    def run_import(self, operation, file, fmt, batch_size=10000, workers=None, progress=None, on_reject=None):
+        result = self.call(operation, data=file.read(), fmt=fmt, batch_size=batch_size, workers=workers)
+        report = ImportReport()
+        report.read = result["read"]
+        report.imported = result["imported"]
+        report.rejected = result["rejected"]
+        report.batches = result["batches"]
+        report.started = time.perf_counter() - result["elapsed"]
+        if on_reject:
+            for row_number, reason in result["rejects"]:
+                on_reject(row_number, reason)
+        if progress and report.batches:
+            progress(report)
+        return report
+
+    def changes_since(self, sequence=0):
+        return self.call('changes_since', sequence=sequence)
+
+    def metrics(self):
+        ''' latency snapshot of the server '''
+        return self.call('metrics')
+
+    def cache_stats(self):
+        ''' query cache statistics of the server '''
+        return self.call('cache_stats')
+
+    def storage_stats(self, workers=None):
+        ''' record storage statistics of the server '''
+        return self.call('storage_stats', workers=workers)
+
+    def collect_garbage(self, dry_run=False, workers=None):
+        ''' reclaim orphaned records on the server '''
+        return self.call('collect_garbage', dry_run=dry_run, workers=workers)
+
+    def start_profiling(self, output_dir=None, cpu=True, memory=True):
+        ''' profile the server; the files are written on the server, to the directory it was
+        started with, a server refuses any other output_dir '''
+        arguments = {"cpu": cpu, "memory": memory}
+        if output_dir:
+            arguments["output_dir"] = output_dir
+        return self.call('start_profiling', **arguments)
+
+    def stop_profiling(self):
+        return self.call('stop_profiling')
+
+    def is_profiling(self):
+        return self.call('is_profiling')
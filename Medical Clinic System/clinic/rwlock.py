@@ -0,0 +1,66 @@
+import contextlib
+import threading
+
+
+class ReadWriteLock():
+    ''' Many concurrent readers or a single writer; waiting writers go first '''
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        # Made by the first thread that has to wait, most locks are never contended
+        self.condition = None
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def wait(self):
+        ''' Wait for a release; the mutex is held '''
+        if self.condition is None:
+            self.condition = threading.Condition(self.mutex)
+        self.condition.wait()
+
+    def notify(self):
+        if self.condition is not None:
+            self.condition.notify_all()
+
+    def acquire_read(self):
+        with self.mutex:
+            # New readers queue behind waiting writers so writers do not starve
+            while self.writer or self.waiting_writers:
+                self.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.mutex:
+            self.readers -= 1
+            if not self.readers:
+                self.notify()
+
+    def acquire_write(self):
+        with self.mutex:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self):
+        with self.mutex:
+            self.writer = False
+            self.notify()
+
+    @contextlib.contextmanager
+    def read_lock(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
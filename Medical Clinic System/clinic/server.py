@@ -0,0 +1,284 @@
+''' JSON-over-HTTP server that owns the clinic data and shares it between workstations.
+
+Start it with ``python -m clinic serve`` and point the GUI or the CLI at it with
+``--server=http://HOST:PORT`` or the CLINIC_SERVER environment variable.
+
+Every operation is a ``POST /api/<operation>`` whose JSON body holds the keyword
+arguments of the Controller method. The reply is ``{"result": ...}`` or, with an
+error status, ``{"error": "<ExceptionName>", "message": "..."}``. Sessions are
+identified by the X-Clinic-Session header; a request without a known session
+gets a new one, returned in the same header.
+'''
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import io
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from clinic.controller import Controller
+from clinic.profiling import DEFAULT_PROFILE_DIR
+from clinic.bulk_import import ImportReport
+from clinic.export import patient_to_dict, note_to_dict
+from clinic.note import Note
+from clinic.patient import Patient
+from clinic.storage_config import StorageConfig
+from clinic.exception.invalid_login_exception import InvalidLoginException
+from clinic.exception.duplicate_login_exception import DuplicateLoginException
+from clinic.exception.invalid_logout_exception import InvalidLogoutException
+from clinic.exception.illegal_access_exception import IllegalAccessException
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+from clinic.exception.no_current_patient_exception import NoCurrentPatientException
+from clinic.exception.conflict_exception import ConflictException
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+SESSION_HEADER = 'X-Clinic-Session'
+# Imports send their whole file in one request
+MAX_BODY = 256 * 1024 * 1024
+
+# Controller methods callable over HTTP
+OPERATIONS = (
+    'login', 'logout',
+    'search_patient', 'create_patient', 'retrieve_patients', 'update_patient', 'delete_patient', 'list_patients',
+    'find_patients',
+    'set_current_patient', 'get_current_patient', 'unset_current_patient',
+    'search_note', 'create_note', 'retrieve_notes', 'update_note', 'delete_note', 'list_notes',
+    'import_patients', 'import_notes', 'changes_since',
+    'metrics', 'cache_stats', 'storage_stats', 'collect_garbage', 'start_profiling', 'stop_profiling',
+    'is_profiling'
+)
+
+# HTTP status of every clinic exception
+ERROR_STATUS = {
+    InvalidLoginException: 401,
+    IllegalAccessException: 403,
+    DuplicateLoginException: 409,
+    InvalidLogoutException: 409,
+    IllegalOperationException: 409,
+    ConflictException: 409,
+    NoCurrentPatientException: 409
+}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found',
+           409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def to_json(value):
+    ''' converts a Controller result to plain JSON values '''
+    # The version goes along, a client sends it back to update what it read
+    if isinstance(value, Patient):
+        return dict(patient_to_dict(value), version=value.version)
+    if isinstance(value, Note):
+        return dict(note_to_dict(value), version=value.version)
+    if isinstance(value, ImportReport):
+        return {"read": value.read, "imported": value.imported, "rejected": value.rejected,
+                "batches": value.batches, "elapsed": value.elapsed}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    return value
+
+
+class ClientSession():
+    ''' A Controller session of one client and when it was last used '''
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.last_used = time.monotonic()
+        # Requests of one client run one at a time, like calls on a local Controller
+        self.lock = threading.Lock()
+
+
+class ClinicServer():
+    ''' asyncio HTTP server running Controller operations in a thread pool '''
+
+    def __init__(self, controller=None, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None,
+                 session_timeout=3600, profile_dir=DEFAULT_PROFILE_DIR):
+        # The only Controller loading the clinic files, every session shares its data
+        self.controller = controller if controller else Controller(autosave=True)
+        self.host = host
+        self.port = port
+        self.session_timeout = session_timeout
+        # Profiles are written here only, a client never picks a path on the server
+        self.profile_dir = profile_dir
+        self.sessions = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                              thread_name_prefix='clinic-server')
+        self.loop = None
+        self.server = None
+        # Optional callable told where the server listens
+        self.log = None
+
+    def session_for(self, token):
+        ''' Return (token, session), opening a new session for an unknown token '''
+        now = time.monotonic()
+        session = self.sessions.get(token)
+        if session is None:
+            # Drop the sessions of clients that went away
+            for old_token, old_session in list(self.sessions.items()):
+                if now - old_session.last_used > self.session_timeout:
+                    del self.sessions[old_token]
+            token = secrets.token_urlsafe(24)
+            session = self.sessions[token] = ClientSession(self.controller.open_session())
+        session.last_used = now
+        return token, session
+
+    def call(self, session, operation, arguments):
+        ''' Run one operation for a session; executed in the thread pool '''
+        with session.lock:
+            controller = session.controller
+            if operation in ('import_patients', 'import_notes'):
+                return self.call_import(controller, operation, arguments)
+            if operation == 'start_profiling':
+                if arguments.get('output_dir') is not None:
+                    raise IllegalAccessException('profiles are written to the directory the server was started with')
+                arguments = dict(arguments, output_dir=self.profile_dir)
+            return to_json(getattr(controller, operation)(**arguments))
+
+    def call_import(self, controller, operation, arguments):
+        # The rows come as one string, rejections are sent back with the report
+        rejects = []
+        data = io.StringIO(arguments.pop('data', ''), newline='')
+        report = getattr(controller, operation)(data, arguments.pop('fmt', 'ndjson'),
+            on_reject=lambda row_number, reason: rejects.append([row_number, reason]), **arguments)
+        result = to_json(report)
+        result["rejects"] = rejects
+        return result
+
+    async def dispatch(self, method, path, headers, body):
+        ''' Return (status, session token, payload) for one request '''
+        if path == '/health' and method in ('GET', 'HEAD'):
+            return 200, None, {"status": "ok", "sessions": len(self.sessions)}
+        operation = path[len('/api/'):] if path.startswith('/api/') else None
+        if operation not in OPERATIONS:
+            return 404, None, {"error": "NotFound", "message": "unknown path %s" % path}
+        if method != 'POST':
+            return 400, None, {"error": "BadRequest", "message": "operations are called with POST"}
+        try:
+            arguments = json.loads(body) if body else {}
+            if not isinstance(arguments, dict):
+                raise ValueError('the body must be a JSON object')
+        except ValueError as e:
+            return 400, None, {"error": "BadRequest", "message": str(e)}
+
+        token, session = self.session_for(headers.get(SESSION_HEADER.lower()))
+        try:
+            result = await self.loop.run_in_executor(self.executor,
+                functools.partial(self.call, session, operation, arguments))
+            return 200, token, {"result": result}
+        except tuple(ERROR_STATUS) as e:
+            return ERROR_STATUS[type(e)], token, {"error": type(e).__name__, "message": str(e)}
+        except (TypeError, ValueError, KeyError) as e:
+            return 400, token, {"error": "BadRequest", "message": str(e)}
+        except Exception as e:
+            return 500, token, {"error": type(e).__name__, "message": str(e)}
+
+    async def read_request(self, reader):
+        ''' Read one request; None when the client closed the connection '''
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, version = line.decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+            raise ValueError('request body too large')
+        body = await reader.readexactly(length) if length else b''
+        return method, path, version, headers, body
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except ValueError as e:
+                    await self.respond(writer, 400, None, {"error": "BadRequest", "message": str(e)}, False)
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                status, token, payload = await self.dispatch(method, path, headers, body)
+                await self.respond(writer, status, token, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, token, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        head = ['HTTP/1.1 %d %s' % (status, REASONS.get(status, 'Error')),
+                'Content-Type: application/json',
+                'Content-Length: %d' % len(body),
+                'Connection: %s' % ('keep-alive' if keep_alive else 'close')]
+        if token:
+            head.append('%s: %s' % (SESSION_HEADER, token))
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, ready=None):
+        ''' Serve until stop() is called; ready is set once the port is bound '''
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        # Port 0 picks a free port, report the real one
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.log:
+            self.log('serving the clinic on %s' % self.url)
+        if ready:
+            ready.set()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    def run(self, ready=None):
+        ''' Blocking entry point, runs the event loop in the calling thread '''
+        asyncio.run(self.serve(ready))
+
+    def stop(self):
+        ''' Stop serving; safe to call from any thread '''
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % (self.host, self.port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m clinic serve',
+        description='Serve the clinic data to GUI and CLI clients over HTTP.')
+    parser.add_argument('--host', default=DEFAULT_HOST,
+        help='address to listen on (default: %s, local connections only)' % DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='default: %d' % DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, help='threads running operations (default: Python default)')
+    parser.add_argument('--session-timeout', type=float, default=3600,
+        help='seconds before an idle client session is dropped (default: 3600)')
+    parser.add_argument('--profile-dir', default=DEFAULT_PROFILE_DIR,
+        help='directory profiling captures are written to (default: %s)' % DEFAULT_PROFILE_DIR)
+    args = parser.parse_args(argv)
+
+    controller = Controller(autosave=True, config=StorageConfig.from_environ(),
+                            warm_start=os.environ.get('CLINIC_WARM_START') == '1')
+    server = ClinicServer(controller, args.host, args.port, args.workers, args.session_timeout, args.profile_dir)
+    server.log = lambda message: print(message, file=sys.stderr)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    controller.close()
+    return 0
@@ -0,0 +1,16 @@
+class Session():
+    ''' Login and current patient of one user of the clinic '''
+
+    def __init__(self):
+        ''' Construct a logged out session '''
+        self.username = None
+        self.password = None
+        self.logged = False
+        self.current_patient = None
+
+    def clear(self):
+        ''' Forget the user and the current patient on logout '''
+        self.username = None
+        self.password = None
+        self.logged = False
+        self.current_patient = None
@@ -0,0 +1,96 @@
+import hashlib
+import os
+
+
+class StorageConfig():
+    ''' Where the clinic keeps its files; the defaults are the historical relative paths '''
+
+    def __init__(self, data_root='clinic', patients_file='patients.json', records_dir='records',
+                 record_file='{phn}.dat', users_file='users.txt', changes_file='changes.log',
+                 journal_file='journal.wal', record_store='files', segments_dir='segments', fanout=0,
+                 snapshot_file='snapshot.bin', patients_layout='objects', lock_file='clinic.lock'):
+        ''' Construct a storage configuration; file names are relative to data_root '''
+        self.data_root = data_root
+        self.patients_file = patients_file
+        self.records_dir = records_dir
+        # Format string for a record file name, {phn} is replaced by the patient's PHN
+        self.record_file = record_file
+        self.users_file = users_file
+        self.changes_file = changes_file
+        # Write-ahead journal of the transaction being committed
+        self.journal_file = journal_file
+        # 'files' keeps one file per record, 'segments' packs them in segment files
+        self.record_store = record_store
+        # Directory of the segment files, inside the records directory
+        self.segments_dir = segments_dir
+        # Levels of hashed subdirectories above each record file, 0 keeps them all in records_dir
+        self.fanout = fanout
+        # Warm-start snapshot of the patients, written at a clean shutdown
+        self.snapshot_file = snapshot_file
+        # 'objects' writes one JSON object per patient, 'columns' one array per field; both load
+        self.patients_layout = patients_layout
+        # Held by the process saving, so processes sharing the data root save one at a time
+        self.lock_file = lock_file
+
+    @classmethod
+    def from_environ(cls, environ=None):
+        ''' Default configuration, with the data root taken from CLINIC_DATA_ROOT, the record
+        store from CLINIC_RECORD_STORE, the record fan-out from CLINIC_RECORD_FANOUT and the
+        layout of patients.json from CLINIC_PATIENTS_LAYOUT if set '''
+        environ = os.environ if environ is None else environ
+        return cls(data_root=environ.get('CLINIC_DATA_ROOT', 'clinic'),
+                   record_store=environ.get('CLINIC_RECORD_STORE', 'files'),
+                   fanout=int(environ.get('CLINIC_RECORD_FANOUT', 0)),
+                   patients_layout=environ.get('CLINIC_PATIENTS_LAYOUT', 'objects'))
+
+    def patients_path(self):
+        return os.path.join(self.data_root, self.patients_file)
+
+    def records_path(self):
+        return os.path.join(self.data_root, self.records_dir)
+
+    def record_path(self, phn):
+        ''' Path of a record file: records_dir/ab/cd/<record_file> with two levels of fan-out,
+        ab and cd taken from a hash of the PHN so every directory stays small '''
+        if not self.fanout:
+            return self.flat_record_path(phn)
+        digest = hashlib.sha1(str(phn).encode('utf-8')).hexdigest()
+        levels = [digest[2 * level:2 * level + 2] for level in range(self.fanout)]
+        return os.path.join(self.records_path(), *levels, self.record_file.format(phn=phn))
+
+    def flat_record_path(self, phn):
+        ''' Path of a record file without fan-out, where older clinics keep it '''
+        return os.path.join(self.records_path(), self.record_file.format(phn=phn))
+
+    def record_phn(self, file_name):
+        ''' The PHN a record file name is for, None if it is not a record file name '''
+        prefix, _, suffix = self.record_file.partition('{phn}')
+        if len(file_name) <= len(prefix) + len(suffix) or not file_name.startswith(prefix) \
+                or not file_name.endswith(suffix):
+            return None
+        phn = file_name[len(prefix):len(file_name) - len(suffix)]
+        return int(phn) if phn.isdigit() else None
+
+    def segments_path(self):
+        return os.path.join(self.records_path(), self.segments_dir)
+
+    def users_path(self):
+        return os.path.join(self.data_root, self.users_file)
+
+    def changes_path(self):
+        return os.path.join(self.data_root, self.changes_file)
+
+    def journal_path(self):
+        return os.path.join(self.data_root, self.journal_file)
+
+    def snapshot_path(self):
+        return os.path.join(self.data_root, self.snapshot_file)
+
+    def lock_path(self):
+        return os.path.join(self.data_root, self.lock_file)
+
+    def __repr__(self):
+        return "StorageConfig(%r, %r, %r, %r, %r, %r, %r, %r, %r, %r, %r, %r, %r)" % (self.data_root,
+            self.patients_file, self.records_dir, self.record_file, self.users_file, self.changes_file,
+            self.journal_file, self.record_store, self.segments_dir, self.fanout, self.snapshot_file, self.patients_layout,
+            self.lock_file)
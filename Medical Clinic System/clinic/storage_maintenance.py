@@ -0,0 +1,184 @@
+import concurrent.futures
+import os
+import time
+from clinic.dao.record_store import record_store
+from clinic.durable_io import TEMP_SUFFIX, PREVIOUS_SUFFIX, CORRUPT_SUFFIX
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+
+# Seconds a temporary file is left alone, it may be a write still going on in another process
+TEMP_GRACE = 15 * 60
+
+def scan_tree(directory):
+    ''' (name, path, size) of every file below directory '''
+    found = []
+    pending = [directory]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except FileNotFoundError:
+            # Emptied by a migration or a collection meanwhile
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    try:
+                        found.append((entry.name, entry.path, entry.stat().st_size))
+                    except FileNotFoundError:
+                        pass
+    return found
+
+
+class RecordScan():
+    ''' The record files of a clinic, found by a parallel scan of its records directory '''
+
+    def __init__(self, config, workers=None):
+        self.config = config
+        # PHN -> [(path, size)] of its record files and of their previous generations
+        self.records = {}
+        self.previous = {}
+        # (path, size) of interrupted writes and of files set aside as unreadable
+        self.temporary = []
+        self.corrupt = []
+        self.scan(workers)
+
+    def scan(self, workers):
+        root = self.config.records_path()
+        try:
+            with os.scandir(root) as entries:
+                entries = list(entries)
+        except FileNotFoundError:
+            return
+        self.classify((entry.name, entry.path, entry.stat().st_size) for entry in entries
+                      if entry.is_file(follow_symlinks=False))
+        # Every fan-out subdirectory is walked by its own worker, the segments are not files of records
+        subdirectories = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)
+                          and entry.name != self.config.segments_dir]
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for found in executor.map(scan_tree, subdirectories):
+                self.classify(found)
+
+    def classify(self, files):
+        for name, path, size in files:
+            if name.endswith(TEMP_SUFFIX):
+                self.temporary.append((path, size))
+            elif name.endswith(CORRUPT_SUFFIX):
+                self.corrupt.append((path, size))
+            elif name.endswith(PREVIOUS_SUFFIX):
+                phn = self.config.record_phn(name[:-len(PREVIOUS_SUFFIX)])
+                if phn is not None:
+                    self.previous.setdefault(phn, []).append((path, size))
+            else:
+                phn = self.config.record_phn(name)
+                if phn is not None:
+                    self.records.setdefault(phn, []).append((path, size))
+
+
+def size_of(files):
+    return sum(size for _, size in files)
+
+
+def stale_files(files, grace=None):
+    ''' The (path, size) of files not modified for grace seconds, TEMP_GRACE by default '''
+    limit = time.time() - (TEMP_GRACE if grace is None else grace)
+    stale = []
+    for path, size in files:
+        try:
+            if os.path.getmtime(path) < limit:
+                stale.append((path, size))
+        except FileNotFoundError:
+            pass
+    return stale
+
+
+def record_sizes(config, scan, store):
+    ''' PHN -> bytes of its record, in files and in segments '''
+    sizes = {phn: size_of(files) for phn, files in scan.records.items()}
+    if config.record_store == 'segments':
+        for phn, size in store.segments.record_sizes().items():
+            sizes[phn] = sizes.get(phn, 0) + size
+    return sizes
+
+
+def storage_stats(config, phns, workers=None):
+    ''' Patients, records, bytes per record and wasted space of a clinic whose patients have the
+    given PHNs. Wasted space is held by orphaned records, previous generations of records left
+    by earlier versions, interrupted writes and, in segment stores, replaced copies awaiting
+    compaction. Every byte is counted once: previous_bytes leaves out the previous generations
+    of orphans, they are in orphan_bytes. '''
+    phns = set(phns)
+    # Only counted, never changed: segments written by another process are read as they are
+    store = record_store(config, read_only=True)
+    scan = RecordScan(config, workers)
+    sizes = record_sizes(config, scan, store)
+    orphans = set(sizes).union(scan.previous).difference(phns)
+    orphan_bytes = sum(sizes.get(phn, 0) + size_of(scan.previous.get(phn, ())) for phn in orphans)
+    # Records no longer keep a previous generation, the ones left by earlier versions are waste
+    live_previous_bytes = sum(size_of(files) for phn, files in scan.previous.items() if phn not in orphans)
+    segment_garbage = 0
+    if config.record_store == 'segments':
+        segments = store.segments.stats()
+        segment_garbage = segments["total_bytes"] - segments["live_bytes"]
+    record_bytes = sum(sizes.values())
+    temporary_bytes = size_of(scan.temporary)
+    return {
+        "store": config.record_store,
+        "fanout": config.fanout,
+        "patients": len(phns),
+        "records": len(sizes),
+        "record_bytes": record_bytes,
+        "bytes_per_record": record_bytes / len(sizes) if sizes else 0.0,
+        "previous_bytes": live_previous_bytes,
+        "orphan_records": len(orphans),
+        "orphan_bytes": orphan_bytes,
+        "temporary_bytes": temporary_bytes,
+        "corrupt_bytes": size_of(scan.corrupt),
+        "segment_garbage_bytes": segment_garbage,
+        "wasted_bytes": orphan_bytes + live_previous_bytes + temporary_bytes + segment_garbage
+    }
+
+
+def collect_garbage(config, phns, dry_run=False, workers=None):
+    ''' Reclaim the records of PHNs without a patient among phns, the previous generations
+    of records and the leftovers of interrupted writes older than TEMP_GRACE. Unreadable
+    files set aside at load are kept for inspection. No record may be saved meanwhile: the
+    Controller holds every mutation of every process sharing the data root back. '''
+    phns = set(phns)
+    store = record_store(config)
+    if config.record_store == 'segments' and store.segments.read_only and not dry_run:
+        # Dropping records and compacting both append to the segments
+        raise IllegalOperationException('the record segments are written by another process, '
+                                        'collect the garbage in that process')
+    scan = RecordScan(config, workers)
+    sizes = record_sizes(config, scan, store)
+    orphans = sorted(set(sizes).union(scan.previous).difference(phns))
+    temporary = stale_files(scan.temporary)
+    # Previous generations of the records of patients, left by earlier versions
+    previous = [file for phn, files in scan.previous.items() if phn in phns for file in files]
+    reclaimed = size_of(temporary) + size_of(previous)
+    if dry_run:
+        reclaimed += sum(sizes.get(phn, 0) + size_of(scan.previous.get(phn, ())) for phn in orphans)
+    else:
+        for phn in orphans:
+            reclaimed += store.delete(phn)
+            # Files the store no longer looks at, e.g. left behind by a change of layout
+            for path, size in scan.records.get(phn, []) + scan.previous.get(phn, []):
+                try:
+                    os.remove(path)
+                    reclaimed += size
+                except FileNotFoundError:
+                    pass
+        for path, _ in temporary + previous:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if config.record_store == 'segments':
+            store.segments.compact()
+    return {
+        "orphans": orphans,
+        "temporary_files": len(temporary),
+        "bytes_reclaimed": reclaimed,
+        "dry_run": dry_run
+    }
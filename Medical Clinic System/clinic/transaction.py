@@ -0,0 +1,198 @@
+import contextlib
+import hashlib
+import os
+import pickle
+import threading
+from clinic.durable_io import atomic_write, fsync_directory, write_file
+
+# Length of the SHA-256 digest closing a complete journal
+DIGEST_SIZE = 32
+
+# The transaction open in each thread, if any
+_state = threading.local()
+
+
+def current_transaction():
+    ''' The transaction open in the calling thread, None outside transactions '''
+    return getattr(_state, 'transaction', None)
+
+
+def read_journal(journal_path):
+    ''' Return the batch of a complete journal, None when it is missing or torn '''
+    try:
+        with open(journal_path, 'rb') as file:
+            content = file.read()
+    except FileNotFoundError:
+        return None
+    payload, digest = content[:-DIGEST_SIZE], content[-DIGEST_SIZE:]
+    if len(content) <= DIGEST_SIZE or hashlib.sha256(payload).digest() != digest:
+        return None
+    return pickle.loads(payload)
+
+
+def apply_batch(batch):
+    ''' Write every file of a batch; safe to repeat after a crash. Runs with the data root
+    lock held, by the commit or by the recovery at startup. '''
+    # Imported here, the note DAO itself imports this module
+    from clinic.dao.record_store import record_store
+    for write in batch["writes"]:
+        if write[0] == 'record':
+            config, phn, data = write[1:]
+            record_store(config).save(phn, data)
+        elif write[0] == 'delete':
+            config, phn = write[1:]
+            record_store(config).delete(phn)
+        else:
+            path, data = write[1:]
+            atomic_write(path, data)
+    # Imported here, the change log itself imports this module
+    from clinic.dao.change_log import ChangeLog, append_to_log, log_lock
+    for path, text, last_sequence in batch["appends"]:
+        # Held by the commit already; at recovery no other writer may number meanwhile
+        with log_lock(path):
+            # Appending twice would duplicate entries, skip logs that already have them
+            if ChangeLog(path).load_sequence() < last_sequence:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                with open(path, 'a+b') as file:
+                    append_to_log(file, text.encode('utf-8'))
+                    file.flush()
+                    os.fsync(file.fileno())
+
+
+def recover_journal(journal_path):
+    ''' Finish a transaction interrupted after its journal was written.
+
+    A torn journal means the crash came before any data file was touched,
+    so it is simply dropped. Returns True when a batch was replayed. '''
+    if not os.path.exists(journal_path):
+        return False
+    batch = read_journal(journal_path)
+    if batch is not None:
+        apply_batch(batch)
+    os.remove(journal_path)
+    fsync_directory(os.path.dirname(journal_path))
+    return batch is not None
+
+
+class Transaction():
+    ''' Mutations of one thread buffered until a single durable commit '''
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        # DAOs to save at commit, in first-change order
+        self.deferred = []
+        # Records to drop at commit, before any save
+        self.discards = []
+        # Change log entries to append at commit, per log
+        self.entries = {}
+        # State before the first change, to roll back
+        self.patient_undo = {}
+        self.note_undo = {}
+        self.sequences = {}
+        # Change notifications, published only once the commit is durable
+        self.events = []
+        # Set once the journal is on disk; after that a failure is finished by recovery
+        self.durable = False
+
+    def begin(self):
+        _state.transaction = self
+
+    def end(self):
+        _state.transaction = None
+
+    def defer(self, dao):
+        ''' Save dao at commit instead of now '''
+        if all(dao is not other for other in self.deferred):
+            self.deferred.append(dao)
+
+    def discard(self, dao, phn):
+        ''' Drop the stored record of phn at commit '''
+        self.discards.append(('delete', dao.config, phn))
+        if dao.phn == phn:
+            # The record itself is gone, a save queued earlier must not bring it back
+            self.deferred = [other for other in self.deferred if other is not dao]
+
+    def discarded(self, config, phn):
+        ''' Whether the record of phn is dropped at commit, so it no longer counts as stored '''
+        return any(entry[2] == phn and entry[1].records_path() == config.records_path()
+                   for entry in self.discards)
+
+    def remember_patients(self, dao, keys):
+        ''' Keep the patients stored under keys as they are before a change '''
+        for key in keys:
+            if (id(dao), key) not in self.patient_undo:
+                patient = dao.patients.get(key)
+                fields = (patient.phn, patient.name, patient.birth_date, patient.phone, patient.email,
+                          patient.address, patient.version) if patient else None
+                self.patient_undo[(id(dao), key)] = (dao, key, patient, fields)
+
+    def remember_notes(self, dao):
+        ''' Keep the notes of a record as they are before a change '''
+        if id(dao) not in self.note_undo:
+            self.note_undo[id(dao)] = (dao, dict(dao.notes), dao.code_counter,
+                                       {code: (note.text, note.version) for code, note in dao.notes.items()}, dao.phn)
+
+    def log(self, change_log, entries):
+        ''' Append change log entries at commit '''
+        if id(change_log) not in self.entries:
+            self.sequences[id(change_log)] = entries[0]["seq"] - 1
+            self.entries[id(change_log)] = (change_log, [])
+        self.entries[id(change_log)][1].extend(entries)
+
+    def batch(self):
+        # Drops go first, a record moved to a PHN that was dropped in the same transaction survives
+        writes = self.discards + [dao.batch_write() for dao in self.deferred]
+        appends = []
+        for change_log, entries in self.entries.values():
+            if change_log.autosave:
+                appends.append((change_log.file_path, change_log.format(entries), entries[-1]["seq"]))
+            else:
+                change_log.entries.extend(entries)
+        return {"writes": writes, "appends": appends}
+
+    def commit(self):
+        ''' Write-ahead the whole batch with one fsync, then apply it and drop the journal '''
+        logs = [(change_log, entries) for change_log, entries in self.entries.values() if change_log.autosave]
+        with contextlib.ExitStack() as stack:
+            # Note changes of other processes go on during the block, without the data root
+            # lock: the entries are numbered for good once no other writer of the log can
+            for change_log, entries in logs:
+                stack.enter_context(change_log.numbering())
+                change_log.renumber(entries)
+            batch = self.batch()
+            if not batch["writes"] and not batch["appends"]:
+                return
+            payload = pickle.dumps(batch)
+            write_file(self.journal_path, payload + hashlib.sha256(payload).digest())
+            fsync_directory(os.path.dirname(self.journal_path))
+            self.durable = True
+            # From here on a crash is finished by recover_journal at the next start, a failure by
+            # the next mutation or transaction of this process
+            apply_batch(batch)
+            os.remove(self.journal_path)
+            fsync_directory(os.path.dirname(self.journal_path))
+            for change_log, entries in logs:
+                change_log.committed(entries)
+        for dao in self.deferred:
+            dao.committed()
+
+    def rollback(self):
+        ''' Put every changed patient, record and change log back as it was '''
+        # Every key is restored to its own original state, a rekey touched two keys
+        for dao, key, patient, fields in self.patient_undo.values():
+            if patient is None:
+                dao.patients.pop(key, None)
+            else:
+                dao.patients[key] = patient
+                patient.phn, patient.name, patient.birth_date, patient.phone, patient.email, \
+                    patient.address, patient.version = fields
+            dao.reindex(key)
+        for dao, notes, code_counter, texts, phn in self.note_undo.values():
+            dao.set_phn(phn)
+            dao.notes.clear()
+            dao.notes.update(notes)
+            dao.code_counter = code_counter
+            for code, (text, version) in texts.items():
+                notes[code].text, notes[code].version = text, version
+        for change_log, entries in self.entries.values():
+            change_log.sequence = self.sequences[id(change_log)]
@@ -0,0 +1,60 @@
+import io
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.patient import Patient
+from clinic.exception.illegal_access_exception import IllegalAccessException
+
+PATIENTS_CSV = """phn,name,birth_date,phone,email,address
+9790012000, John  Doe ,2000-10-10,250 203 1010,john.doe@gmail.com,"300 Moss St, Victoria"
+9790014444,Mary Doe,1995-07-01,250 203 2020,mary.doe@gmail.com,"300 Moss St, Victoria"
+9790014444,Mary Smith,1995-07-01,250 203 2020,mary.doe@gmail.com,"300 Moss St, Victoria"
+9792225555,Joe Hancock,1990-15-01,278 456 7890,john.hancock@outlook.com,"5000 Douglas St, Saanich"
+9798884444,Ali Mesbah,1980-03-03,250 301 6060,mesbah.ali@gmail.com,"500 Fairfield Rd, Victoria"
+"""
+
+NOTES_NDJSON = """{"phn": 9790012000, "text": "Patient comes with headache and high blood pressure."}
+{"phn": 9790012000, "text": "Patient complains of a strong headache on the back of neck."}
+{"phn": 9790014444, "text": "Patient says high BP is controlled, 120x80 in general."}
+{"phn": 9792225555, "text": "Patient is not registered."}
+not json
+"""
+
+class BulkImportTest(TestCase):
+	def setUp(self):
+		# autosave is off so the import never touches the clinic files
+		self.controller = Controller(autosave=False)
+
+	def test_import_requires_login(self):
+		with self.assertRaises(IllegalAccessException, msg="cannot import without logging in"):
+			self.controller.import_patients(io.StringIO(PATIENTS_CSV), 'csv')
+
+	def import_all(self, **options):
+		rejects = []
+		self.controller.login("user", "123456")
+		self.controller.create_patient(9798884444, "Ali Mesbah", "1980-03-03", "250 301 6060", "mesbah.ali@gmail.com", "500 Fairfield Rd, Victoria")
+		report = self.controller.import_patients(io.StringIO(PATIENTS_CSV), 'csv',
+			on_reject=lambda row_number, reason: rejects.append(row_number), **options)
+		self.assertEqual(5, report.read)
+		self.assertEqual(2, report.imported)
+		self.assertEqual(3, report.rejected)
+		self.assertEqual([3, 4, 5], sorted(rejects), "duplicate PHN, bad birth date and existing PHN are rejected")
+		self.assertEqual(Patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria"),
+			self.controller.search_patient(9790012000), "fields are normalized")
+		self.assertEqual(3, len(self.controller.list_patients()))
+
+		report = self.controller.import_notes(io.StringIO(NOTES_NDJSON), 'ndjson', **options)
+		self.assertEqual(3, report.imported)
+		self.assertEqual(2, report.rejected)
+		self.controller.set_current_patient(9790012000)
+		self.assertEqual([2, 1], [note.code for note in self.controller.list_notes()])
+		self.assertEqual("Patient comes with headache and high blood pressure.", self.controller.search_note(1).text)
+
+	def test_import_in_process(self):
+		self.import_all(workers=0, batch_size=2)
+
+	def test_import_with_process_pool(self):
+		self.import_all(workers=2)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.dao.change_log import ChangeLog
+from clinic.note import Note
+from clinic.patient import Patient
+from clinic.storage_config import StorageConfig
+
+class ChangeLogTest(TestCase):
+	def test_controller_changes(self):
+		# autosave is off so the changes stay in memory
+		controller = Controller(autosave=False)
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.create_patient(9790014444, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+		controller.set_current_patient(9790012000)
+		controller.create_note("Patient comes with headache and high blood pressure.")
+		controller.update_note(1, "Patient comes with headache.")
+		controller.delete_note(1)
+		controller.unset_current_patient()
+		controller.update_patient(9790014444, 9790015555, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+		controller.delete_patient(9790012000)
+
+		changes = controller.changes_since(0)
+		self.assertEqual(list(range(1, 8)), [entry["seq"] for entry in changes], "sequence is monotonic across patients and notes")
+		self.assertEqual([("patient", "create"), ("patient", "create"), ("note", "create"), ("note", "update"), ("note", "delete"),
+			("patient", "update"), ("patient", "delete")], [(entry["entity"], entry["op"]) for entry in changes])
+		self.assertEqual("Patient comes with headache.", changes[3]["data"]["text"])
+		self.assertEqual(9790014444, changes[5]["original_phn"])
+		self.assertEqual(9790015555, changes[5]["phn"])
+
+		changes = controller.changes_since(5)
+		self.assertEqual([6, 7], [entry["seq"] for entry in changes], "only the changes after the given sequence")
+
+	def test_persistent_sequence(self):
+		file_path = os.path.join(tempfile.mkdtemp(), 'changes.log')
+		change_log = ChangeLog(file_path)
+		patient = Patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria", autosave=False)
+		change_log.patient_changed('create', patient)
+		change_log.notes_created(patient.phn, [Note(1, "first"), Note(2, "second")])
+
+		# a torn last line is ignored and the sequence continues from the last entry
+		with open(file_path, 'a') as file:
+			file.write('{"seq": 4, "enti')
+		size = os.path.getsize(file_path)
+		change_log = ChangeLog(file_path)
+		self.assertEqual(3, change_log.sequence)
+		self.assertEqual(size, os.path.getsize(file_path), "a reader leaves the line to the process appending it")
+		self.assertEqual([1, 2], [entry["code"] for entry in change_log.changes_since(1)])
+		change_log.note_changed('delete', patient.phn, Note(1, "first"))
+		self.assertEqual([4], [entry["seq"] for entry in ChangeLog(file_path).changes_since(3)], "new entries follow the torn line")
+		os.remove(file_path)
+
+	def test_sequence_shared_by_workstations(self):
+		root = tempfile.mkdtemp()
+		config = StorageConfig(root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), config.users_path())
+		desk, other = Controller(autosave=True, config=config), Controller(autosave=True, config=config)
+		desk.login("user", "123456")
+		other.login("user", "123456")
+		desk.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		other.create_patient(9790014444, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+		desk.create_patient(9790015555, "Ann Doe", "1990-01-01", "250 203 3030", "ann.doe@gmail.com", "300 Moss St, Victoria")
+		# numbered where the file ends, whichever workstation appended last
+		self.assertEqual([(1, 9790012000), (2, 9790014444), (3, 9790015555)],
+			[(entry["seq"], entry["phn"]) for entry in ChangeLog(config.changes_path()).changes_since(0)])
+		self.assertEqual([3], [entry["seq"] for entry in other.changes_since(2)])
+		shutil.rmtree(root)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,100 @@
+import threading
+import time
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.rwlock import ReadWriteLock
+from clinic.exception.illegal_access_exception import IllegalAccessException
+
+class ConcurrencyTest(TestCase):
+	def test_readers_share_the_lock(self):
+		lock = ReadWriteLock()
+		inside = []
+		both_inside = threading.Event()
+
+		def read():
+			with lock.read_lock():
+				inside.append(1)
+				if len(inside) == 2:
+					both_inside.set()
+				both_inside.wait(2)
+
+		threads = [threading.Thread(target=read) for _ in range(2)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertTrue(both_inside.is_set(), "two readers hold the lock at the same time")
+
+	def test_writer_excludes_readers(self):
+		lock = ReadWriteLock()
+		events = []
+
+		def read():
+			with lock.read_lock():
+				events.append("read")
+
+		lock.acquire_write()
+		reader = threading.Thread(target=read)
+		reader.start()
+		time.sleep(0.05)
+		events.append("write done")
+		lock.release_write()
+		reader.join()
+		self.assertEqual(["write done", "read"], events, "the reader waits for the writer")
+
+	def test_sessions_are_independent(self):
+		controller = Controller(autosave=False)
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.set_current_patient(9790012000)
+
+		other = controller.open_session()
+		with self.assertRaises(IllegalAccessException):
+			other.list_patients()
+		other.login("ali", "@G00dPassw0rd")
+		self.assertIsNone(other.get_current_patient(), "current patient belongs to one session")
+		self.assertEqual(1, len(other.list_patients()), "sessions share the patients")
+		other.logout()
+		self.assertTrue(controller.logged, "logout of one session leaves the other logged in")
+		self.assertEqual(9790012000, controller.get_current_patient().phn)
+
+	def test_concurrent_sessions(self):
+		controller = Controller(autosave=False)
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		errors = []
+
+		def work(worker):
+			try:
+				session = controller.open_session()
+				session.login("user", "123456")
+				for i in range(50):
+					session.create_patient(9800000000 + worker * 1000 + i, "Worker Patient", "2000-01-01",
+						"250 000 0000", "worker@example.com", "1 Moss St, Victoria")
+					session.set_current_patient(9790012000)
+					session.create_note("Note %d of worker %d" % (i, worker))
+					session.list_notes()
+					session.retrieve_patients("Worker")
+					session.unset_current_patient()
+				session.logout()
+			except Exception as error:
+				errors.append(error)
+
+		threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual([], errors)
+		self.assertEqual(401, len(controller.list_patients()), "no patient creation is lost")
+		controller.set_current_patient(9790012000)
+		notes = controller.list_notes()
+		self.assertEqual(400, len(notes), "no note creation is lost")
+		self.assertEqual(list(range(400, 0, -1)), [note.code for note in notes], "note codes are unique")
+		sequences = [entry["seq"] for entry in controller.changes_since(0)]
+		self.assertEqual(list(range(1, 802)), sequences, "change log stays in sequence order")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from unittest import mock
+from clinic.controller import Controller
+from clinic.durable_io import atomic_write, load_recovering
+from clinic.storage_config import StorageConfig
+
+class DurableIOTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.config = StorageConfig(self.root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), self.config.users_path())
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def test_atomic_write(self):
+		path = os.path.join(self.root, 'data', 'file.bin')
+		atomic_write(path, b'first')
+		self.assertFalse(os.path.exists(path + '.prev'), "nothing to keep on the first write")
+		atomic_write(path, b'second')
+		with open(path, 'rb') as file:
+			self.assertEqual(b'second', file.read())
+		with open(path + '.prev', 'rb') as file:
+			self.assertEqual(b'first', file.read(), "the replaced content is the previous generation")
+		self.assertFalse(os.path.exists(path + '.tmp'))
+
+	def test_crash_before_rename_keeps_old_file(self):
+		path = os.path.join(self.root, 'file.bin')
+		atomic_write(path, b'old')
+		with mock.patch('clinic.durable_io.os.replace', side_effect=OSError("crash")):
+			with self.assertRaises(OSError):
+				atomic_write(path, b'new')
+		with open(path, 'rb') as file:
+			self.assertEqual(b'old', file.read())
+
+	def test_load_recovering(self):
+		path = os.path.join(self.root, 'file.bin')
+		self.assertIsNone(load_recovering(path, bytes.decode), "a missing file is no data")
+		atomic_write(path, b'{"good": 1}')
+		atomic_write(path, b'{"good": 2}')
+		# Torn write of the current generation
+		with open(path, 'wb') as file:
+			file.write(b'{"goo')
+		with self.assertLogs('clinic.durable_io', 'WARNING'):
+			self.assertEqual({"good": 1}, load_recovering(path, json.loads))
+		self.assertEqual({"good": 1}, load_recovering(path, json.loads), "the restored file is written back")
+
+		os.remove(path + '.prev')
+		with open(path, 'wb') as file:
+			file.write(b'')
+		with self.assertLogs('clinic.durable_io', 'ERROR'):
+			self.assertIsNone(load_recovering(path, json.loads))
+		self.assertFalse(os.path.exists(path))
+		self.assertTrue(os.path.exists(path + '.corrupt'), "what is left of the data is moved aside, not lost")
+
+	def test_controller_recovers_torn_files(self):
+		controller = Controller(autosave=True, config=self.config)
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.set_current_patient(9790012000)
+		controller.create_note("Patient comes with headache.")
+		controller.create_patient(9790014444, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+		controller.create_note("Follow up in a week.")
+
+		# Crash in the middle of the last saves
+		for path in (self.config.patients_path(), self.config.record_path(9790012000)):
+			with open(path, 'r+b') as file:
+				file.truncate(os.path.getsize(path) // 2)
+
+		self.assertFalse(os.path.exists(self.config.record_path(9790012000) + '.prev'), "records keep no previous generation")
+
+		with self.assertLogs('clinic.durable_io', 'WARNING'):
+			controller = Controller(autosave=True, config=self.config)
+			controller.login("user", "123456")
+			self.assertIsNotNone(controller.search_patient(9790012000))
+			self.assertIsNone(controller.search_patient(9790014444), "the last good generation is restored")
+			controller.set_current_patient(9790012000)
+			self.assertEqual([], controller.list_notes())
+		self.assertTrue(os.path.exists(self.config.record_path(9790012000) + '.corrupt'), "the torn record is moved aside")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,71 @@
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.events import EventBus, ClinicEvent, PatientCreated, PatientUpdated, PatientRekeyed, PatientDeleted, \
+	NoteCreated, NoteUpdated, NoteDeleted
+
+class EventsTest(TestCase):
+	def setUp(self):
+		# autosave is off so the tests stay in memory
+		self.controller = Controller(autosave=False)
+		self.controller.login("user", "123456")
+		self.events = []
+		self.controller.subscribe(self.events.append)
+
+	def test_patient_events(self):
+		john = self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.update_patient(9790012000, 9790012000, "John Roe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.update_patient(9790012000, 9790013000, "John Roe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.delete_patient(9790013000)
+
+		self.assertEqual([PatientCreated, PatientUpdated, PatientRekeyed, PatientDeleted], [type(event) for event in self.events])
+		self.assertIs(john, self.events[0].patient)
+		self.assertEqual((9790012000, "John Doe"), (self.events[1].original_phn, self.events[1].original_name))
+		self.assertEqual((9790012000, 9790013000), (self.events[2].original_phn, self.events[2].patient.phn))
+		self.assertIsInstance(self.events[2], PatientUpdated, "rekeys reach PatientUpdated subscribers")
+
+	def test_note_events(self):
+		self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.set_current_patient(9790012000)
+		note = self.controller.create_note("Patient comes with headache.")
+		self.controller.update_note(1, "Patient comes with migraine.")
+		self.controller.update_note(5, "No such note.")
+		self.controller.delete_note(1)
+		self.controller.delete_note(1)
+
+		self.assertEqual([NoteCreated(9790012000, note), NoteUpdated(9790012000, note, "Patient comes with headache."),
+			NoteDeleted(9790012000, note)], self.events[1:], "failed mutations publish nothing")
+
+	def test_filtered_subscription(self):
+		deleted = []
+		self.controller.subscribe(deleted.append, PatientDeleted)
+		self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.delete_patient(9790012000)
+		self.assertEqual([PatientDeleted], [type(event) for event in deleted])
+
+		self.controller.unsubscribe(deleted.append)
+		self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.delete_patient(9790012000)
+		self.assertEqual(1, len(deleted))
+
+	def test_sessions_share_the_bus(self):
+		other = self.controller.open_session()
+		other.login("ali", "@G00dPassw0rd")
+		other.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual([PatientCreated], [type(event) for event in self.events])
+
+	def test_failing_subscriber(self):
+		bus = EventBus()
+		received = []
+
+		def fail(event):
+			raise RuntimeError("broken view")
+
+		bus.subscribe(fail)
+		bus.subscribe(received.append)
+		with self.assertLogs('clinic.events', level='ERROR'):
+			bus.publish(ClinicEvent())
+		self.assertEqual(1, len(received), "later subscribers still get the event")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,84 @@
+import datetime
+import gzip
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from clinic.export import ClinicExporter, iter_json_object
+from clinic.note import Note
+from clinic.storage_config import StorageConfig
+
+class ExportTest(TestCase):
+	def setUp(self):
+		# write a small clinic in the same layout as clinic/patients.json and clinic/records
+		self.data_dir = tempfile.mkdtemp()
+		self.patients_file = os.path.join(self.data_dir, 'patients.json')
+		self.records_dir = os.path.join(self.data_dir, 'records')
+		os.makedirs(self.records_dir)
+		patients = {}
+		for i in range(1, 11):
+			patients[str(i)] = {"__type__": "Patient", "phn": i, "name": "Patient %d" % i, "birth_date": "2000-01-01",
+				"phone": "250 000 %04d" % i, "email": "p%d@clinic.ca" % i, "address": "%d Moss St, Victoria" % i}
+			notes = {code: Note(code, "note %d of patient %d" % (code, i), datetime.datetime(2024, 1, 1)) for code in range(1, i % 3 + 1)}
+			with open(os.path.join(self.records_dir, '%d.dat' % i), 'wb') as file:
+				pickle.dump(notes, file)
+		with open(self.patients_file, 'w') as file:
+			json.dump(patients, file, indent=4)
+		self.exporter = ClinicExporter(StorageConfig(self.data_dir), checkpoint_every=3)
+
+	def tearDown(self):
+		shutil.rmtree(self.data_dir)
+
+	def test_iter_json_object(self):
+		text = json.dumps({"1": {"a": [1, 2.5, "x, }"]}, "22": None, "333": 12345}, indent=4)
+		for chunk_size in (1, 2, 7, 65536):
+			self.assertEqual([("1", {"a": [1, 2.5, "x, }"]}), ("22", None), ("333", 12345)],
+				list(iter_json_object(io.StringIO(text), chunk_size)), "chunk size %d" % chunk_size)
+		self.assertEqual([], list(iter_json_object(io.StringIO(""))))
+		self.assertEqual([], list(iter_json_object(io.StringIO(" {} "))))
+
+	def read_lines(self, path, compress=False):
+		opener = gzip.open if compress else open
+		with opener(path, 'rt') as file:
+			return [json.loads(line) for line in file]
+
+	def test_export(self):
+		output = os.path.join(self.data_dir, 'export.ndjson')
+		report = self.exporter.export(output)
+		self.assertEqual(10, report.patients)
+		self.assertEqual(10, report.notes)
+		lines = self.read_lines(output)
+		self.assertEqual({"type": "patient", "phn": 1, "name": "Patient 1", "birth_date": "2000-01-01",
+			"phone": "250 000 0001", "email": "p1@clinic.ca", "address": "1 Moss St, Victoria"}, lines[0])
+		self.assertEqual({"type": "note", "phn": 1, "code": 1, "timestamp": "2024-01-01T00:00:00", "text": "note 1 of patient 1"}, lines[1])
+
+	def test_resume_gzip(self):
+		expected_output = os.path.join(self.data_dir, 'expected.ndjson.gz')
+		self.exporter.export(expected_output, compress=True)
+		expected = self.read_lines(expected_output, compress=True)
+
+		output = os.path.join(self.data_dir, 'export.ndjson.gz')
+		checkpoint = os.path.join(self.data_dir, 'export.checkpoint')
+		# simulate a crash after the second checkpoint
+		lines = self.exporter.iter_lines
+		def crashing_lines(skip=0):
+			for index, line in lines(skip):
+				if index == 7:
+					raise KeyboardInterrupt
+				yield index, line
+		self.exporter.iter_lines = crashing_lines
+		with self.assertRaises(KeyboardInterrupt):
+			self.exporter.export(output, compress=True, checkpoint_path=checkpoint)
+		self.assertEqual(6, json.load(open(checkpoint))["patients"])
+
+		self.exporter.iter_lines = lines
+		report = self.exporter.export(output, compress=True, checkpoint_path=checkpoint, resume=True)
+		self.assertEqual(10, report.patients)
+		self.assertEqual(expected, self.read_lines(output, compress=True))
+
+if __name__ == '__main__':
+	main()
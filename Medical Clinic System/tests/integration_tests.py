@@ -36,6 +36,11 @@ class IntegrationTest(TestCase):
 		# removing the patients file later to avoid concurrency issues
 		if patients_file_exists:
 			os.remove(patients_file)
+		if os.path.exists(patients_file + '.prev'):
+			os.remove(patients_file + '.prev')
+		changes_file = 'clinic/changes.log'
+		if os.path.exists(changes_file):
+			os.remove(changes_file)
 
 	def reset_persistence(self):
 		# reset persistence will be ignored if autosave is False
@@ -0,0 +1,48 @@
+from unittest import TestCase
+from unittest import main
+from benchmarks.load_generator import parse_mix, run_load, DEFAULT_MIX
+from clinic.controller import Controller
+
+class LoadGeneratorTest(TestCase):
+	def test_parse_mix(self):
+		self.assertEqual({"search": 40, "retrieve": 20, "appointment": 35, "register": 5}, parse_mix(DEFAULT_MIX))
+		self.assertEqual({"search": 1.0}, parse_mix("search"))
+		with self.assertRaises(ValueError):
+			parse_mix("dance=3")
+		with self.assertRaises(ValueError):
+			parse_mix("search=0")
+
+	def test_run_load(self):
+		# autosave is off so the simulated clinicians work in memory
+		controller = Controller(autosave=False)
+		controller.login("user", "123456")
+		phns = [9790012000 + i for i in range(10)]
+		for phn in phns:
+			controller.create_patient(phn, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.logout()
+
+		reported = []
+		windows, totals = run_load(controller.open_session, phns, users=4, duration=0.5, mix=parse_mix(DEFAULT_MIX),
+			think_time=0, interval=0.2, credentials=("user", "123456"), report_window=reported.append)
+
+		self.assertGreaterEqual(len(reported), 2, "one report per interval")
+		self.assertEqual(len(reported), len(windows))
+		self.assertEqual(4, totals["login"]["count"])
+		self.assertEqual(4, totals["logout"]["count"])
+		self.assertEqual(0, totals["all"]["errors"])
+		self.assertEqual(totals["start_appointment"]["count"], totals["create_note"]["count"])
+		self.assertEqual(totals["all"]["count"], sum(window["operations"]["all"]["count"] for window in windows))
+		for operation in ("search_patient", "retrieve_patients", "create_note", "list_notes"):
+			self.assertGreater(totals[operation]["count"], 0, operation)
+			self.assertGreater(totals[operation]["throughput"], 0, operation)
+
+	def test_errors_are_counted(self):
+		controller = Controller(autosave=False)
+		_, totals = run_load(controller.open_session, [9790099999], users=2, duration=0.2,
+			mix=parse_mix("appointment"), think_time=0, interval=0.1, credentials=("user", "123456"))
+		self.assertEqual(totals["start_appointment"]["count"], totals["start_appointment"]["errors"],
+			"every appointment with an unknown patient fails")
+		self.assertEqual(1.0, totals["start_appointment"]["error_rate"])
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.metrics import LatencyHistogram, registry
+from clinic.exception.illegal_access_exception import IllegalAccessException
+
+class MetricsTest(TestCase):
+	def setUp(self):
+		registry.reset()
+
+	def test_histogram(self):
+		histogram = LatencyHistogram()
+		self.assertEqual(0.0, histogram.percentile(0.5), "empty histogram")
+		for millisecond in range(1, 101):
+			histogram.observe(millisecond / 1000)
+		snapshot = histogram.snapshot()
+		self.assertEqual(100, snapshot["count"])
+		self.assertAlmostEqual(50.5, snapshot["mean_ms"])
+		self.assertEqual(100, snapshot["max_ms"])
+		# percentiles are bucket bounds, within 10% of the exact value
+		self.assertAlmostEqual(50, snapshot["p50_ms"], delta=5)
+		self.assertAlmostEqual(95, snapshot["p95_ms"], delta=9.5)
+		self.assertAlmostEqual(99, snapshot["p99_ms"], delta=1)
+
+	def test_histogram_threads(self):
+		histogram = LatencyHistogram()
+		def observe():
+			for _ in range(10000):
+				histogram.observe(0.001)
+		threads = [threading.Thread(target=observe) for _ in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(80000, histogram.snapshot()["count"], "no observation is lost")
+		self.assertEqual(80000, sum(histogram.buckets))
+
+	def test_controller_metrics(self):
+		controller = Controller(autosave=False)
+		with self.assertRaises(IllegalAccessException):
+			controller.list_patients()
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		for _ in range(3):
+			controller.search_patient(9790012000)
+
+		metrics = controller.metrics()
+		self.assertEqual(1, metrics["controller.list_patients"]["count"], "failed operations are counted")
+		self.assertEqual(1, metrics["controller.create_patient"]["count"])
+		self.assertEqual(3, metrics["controller.search_patient"]["count"])
+		self.assertNotIn("controller.delete_patient", metrics, "operations that never ran are left out")
+
+	def test_dump(self):
+		controller = Controller(autosave=False)
+		controller.login("user", "123456")
+		file_path = os.path.join(tempfile.mkdtemp(), 'metrics.json')
+		controller.dump_metrics_periodically(file_path, interval=0.05)
+		try:
+			deadline = time.time() + 5
+			while not os.path.exists(file_path) and time.time() < deadline:
+				time.sleep(0.01)
+		finally:
+			registry.stop_dump()
+		with open(file_path) as file:
+			self.assertEqual(1, json.load(file)["metrics"]["controller.login"]["count"])
+		os.remove(file_path)
+
+if __name__ == '__main__':
+	main()
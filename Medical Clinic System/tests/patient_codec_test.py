@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.dao.patient_codec import LAYOUT_KEY, encode_patients, decode_rows
+from clinic.dao.patient_dao_json import PatientEncoder
+from clinic.export import ClinicExporter
+from clinic.patient import Patient
+from clinic.storage_config import StorageConfig
+
+class PatientCodecTest(TestCase):
+	def setUp(self):
+		self.patients = [Patient(9790012000 + i, "Patient %d" % i, "2000-01-01", "250 000 %04d" % i,
+			"p%d@clinic.ca" % i, "%d Moss St, Victoria" % i, autosave=False, version=i + 1) for i in range(5)]
+		self.rows = [(patient.phn, patient.name, patient.birth_date, patient.phone, patient.email, patient.address,
+			patient.version) for patient in self.patients]
+		self.root = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def test_round_trip(self):
+		for layout in ('objects', 'columns'):
+			data = encode_patients(self.patients, layout)
+			self.assertNotIn(b'\n', data, "compact separators")
+			self.assertEqual(self.rows, decode_rows(data), layout)
+		self.assertEqual(LAYOUT_KEY, next(iter(json.loads(encode_patients(self.patients, 'columns')))))
+		with self.assertRaises(ValueError):
+			encode_patients(self.patients, 'rows')
+
+	def test_indented_file(self):
+		# patients.json as the clinic wrote it before, indented and through PatientEncoder
+		data = json.dumps({patient.phn: patient for patient in self.patients}, cls=PatientEncoder, indent=4)
+		self.assertEqual(self.rows, decode_rows(data.encode('utf-8')))
+
+	def test_columns_clinic(self):
+		config = StorageConfig(self.root, patients_layout='columns')
+		shutil.copy(os.path.join('clinic', 'users.txt'), config.users_path())
+		controller = Controller(autosave=True, config=config)
+		controller.login("user", "123456")
+		for patient in self.patients:
+			controller.create_patient(patient.phn, patient.name, patient.birth_date, patient.phone, patient.email, patient.address)
+		controller.set_current_patient(9790012000)
+		controller.create_note("Patient comes with headache.")
+		with open(config.patients_path(), 'rb') as file:
+			self.assertEqual(5, len(json.loads(file.read())["phn"]))
+
+		controller = Controller(autosave=True, config=config)
+		controller.login("user", "123456")
+		self.assertEqual([patient.name for patient in self.patients], [patient.name for patient in controller.list_patients()])
+		controller.set_current_patient(9790012000)
+		self.assertEqual("Patient comes with headache.", controller.list_notes()[0].text)
+
+		with self.assertLogs('clinic.export', 'WARNING'):
+			exported = [patient["name"] for patient in ClinicExporter(config).iter_patients()]
+		self.assertEqual([patient.name for patient in self.patients], exported)
+
+if __name__ == '__main__':
+	main()
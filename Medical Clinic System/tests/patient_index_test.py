@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.storage_config import StorageConfig
+from clinic.dao.patient_index import PatientIndex
+from clinic.patient import Patient
+
+class PatientIndexTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.config = StorageConfig(self.root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), self.config.users_path())
+		self.controller = self.start()
+		self.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com")
+		self.create_patient(9790014444, "Jane Doe", "1990-01-01", "250 203 1010", "jane.doe@gmail.com")
+		self.create_patient(9790015555, "Ann Doe", "2000-10-10", "250 555 5555", "ann.doe@gmail.com")
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def start(self):
+		controller = Controller(autosave=True, config=self.config)
+		controller.login("user", "123456")
+		return controller
+
+	def create_patient(self, phn, name, birth_date, phone, email):
+		self.controller.create_patient(phn, name, birth_date, phone, email, "300 Moss St, Victoria")
+
+	def find(self, **criteria):
+		return [patient.phn for patient in self.controller.find_patients(**criteria)]
+
+	def test_find_patients(self):
+		self.assertEqual([9790012000, 9790014444], self.find(phone="250 203 1010"))
+		self.assertEqual([9790015555], self.find(email="ann.doe@gmail.com"))
+		self.assertEqual([9790012000, 9790015555], self.find(birth_date="2000-10-10"))
+		self.assertEqual([9790012000], self.find(phone="250 203 1010", birth_date_from="1995-01-01"))
+		self.assertEqual([9790014444], self.find(name="an", birth_date_from="1990-01-01", birth_date_to="2000-12-31"))
+		self.assertEqual([9790014444], self.find(address="300 Moss St, Victoria", name="Jane"))
+		self.assertEqual([9790012000], self.find(phn=9790012000, phone="250 203 1010"))
+		self.assertEqual([], self.find(phn=9790012000, phone="250 555 5555"))
+		self.assertEqual([], self.find(email="nobody@gmail.com", birth_date="2000-10-10"))
+		self.assertEqual(3, len(self.find()))
+		with self.assertRaises(ValueError):
+			self.find(postal_code="V8W")
+
+	def test_index_follows_changes(self):
+		self.assertEqual([9790012000, 9790014444], self.find(phone="250 203 1010"))
+		self.controller.update_patient(9790012000, 9790016666, "John Doe", "1980-05-05", "250 777 7777", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual([9790014444], self.find(phone="250 203 1010"))
+		self.assertEqual([9790016666], self.find(phone="250 777 7777", birth_date_to="1985-01-01"))
+		self.controller.delete_patient(9790014444)
+		self.assertEqual([], self.find(phone="250 203 1010"))
+
+		with self.assertRaises(ValueError):
+			with self.controller.transaction():
+				self.create_patient(9790017777, "Bob Doe", "1970-01-01", "250 203 1010", "bob.doe@gmail.com")
+				self.controller.update_patient(9790016666, 9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+				self.assertEqual([9790012000, 9790017777], self.find(phone="250 203 1010"))
+				raise ValueError("abort")
+		self.assertEqual([], self.find(phone="250 203 1010"))
+		self.assertEqual([9790016666], self.find(birth_date_to="1985-01-01"))
+
+	def test_index_follows_other_workstation(self):
+		self.assertEqual(1, len(self.find(email="ann.doe@gmail.com")))
+		other = self.start()
+		other.update_patient(9790015555, 9790015555, "Ann Doe", "2000-10-10", "250 555 5555", "ann.smith@gmail.com", "300 Moss St, Victoria")
+		other.create_patient(9790017777, "Bob Doe", "1970-01-01", "250 203 1010", "bob.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.refresh()
+		self.assertEqual([], self.find(email="ann.doe@gmail.com"))
+		self.assertEqual([9790015555], self.find(email="ann.smith@gmail.com"))
+		self.assertEqual([9790012000, 9790014444, 9790017777], self.find(phone="250 203 1010"))
+
+	def test_candidates(self):
+		patients = [Patient(i, "Patient %d" % i, "19%02d-01-01" % (i % 100), "250 000 %04d" % (i % 7),
+			"p%d@clinic.ca" % i, "Victoria", autosave=False) for i in range(1000)]
+		index = PatientIndex(patients)
+		self.assertIsNone(index.candidates({"name": "Patient"}))
+		self.assertEqual({i for i in range(1000) if i % 100 == 50}, index.candidates({"birth_date": "1950-01-01"}))
+		# the email narrows down to one patient, the wide phone and birth date sets are not built
+		self.assertEqual({7}, index.candidates({"email": "p7@clinic.ca", "phone": "250 000 0000", "birth_date_from": "1900-01-01"}))
+		self.assertEqual({i for i in range(1000) if i % 7 == 3 and 10 <= i % 100 <= 19},
+			index.candidates({"phone": "250 000 0003", "birth_date_from": "1910-01-01", "birth_date_to": "1919-01-01"}))
+		for patient in patients[:500]:
+			index.update(patient.phn, None)
+		self.assertEqual(500, len(index.births))
+		self.assertEqual(set(range(550, 1000, 100)), index.candidates({"birth_date": "1950-01-01"}))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,69 @@
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.exception.illegal_access_exception import IllegalAccessException
+
+class ProfilingTest(TestCase):
+	def setUp(self):
+		self.output_dir = tempfile.mkdtemp()
+		self.controller = Controller(autosave=False)
+
+	def tearDown(self):
+		shutil.rmtree(self.output_dir)
+
+	def test_requires_login(self):
+		with self.assertRaises(IllegalAccessException, msg="cannot profile without logging in"):
+			self.controller.start_profiling(self.output_dir)
+
+	def test_capture(self):
+		self.controller.login("user", "123456")
+		self.assertFalse(self.controller.is_profiling())
+		self.assertTrue(self.controller.start_profiling(self.output_dir))
+		self.assertFalse(self.controller.start_profiling(self.output_dir), "only one capture at a time")
+		self.assertTrue(self.controller.is_profiling())
+		self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.retrieve_patients("Doe")
+
+		paths = self.controller.stop_profiling()
+		self.assertFalse(self.controller.is_profiling())
+		self.assertFalse(tracemalloc.is_tracing())
+		self.assertEqual(3, len(paths))
+		for path in paths:
+			self.assertTrue(os.path.exists(path))
+
+		# the profile holds the wrapped Controller operations
+		stats = pstats.Stats(paths[0])
+		functions = {function for _, _, function in stats.stats}
+		self.assertIn("create_patient", functions)
+		self.assertIn("retrieve_patients", functions)
+		self.assertTrue(len(tracemalloc.Snapshot.load(paths[1]).traces) > 0)
+
+		self.assertEqual([], self.controller.stop_profiling(), "nothing to stop")
+
+	def test_capture_of_other_threads(self):
+		self.controller.login("user", "123456")
+		self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertTrue(self.controller.start_profiling(self.output_dir, memory=False))
+
+		def search():
+			for _ in range(20):
+				self.controller.search_patient(9790012000)
+		threads = [threading.Thread(target=search) for _ in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		paths = self.controller.stop_profiling()
+		self.assertEqual(1, len(paths))
+		functions = {function for _, _, function in pstats.Stats(paths[0]).stats}
+		self.assertIn("search_patient", functions, "calls of worker threads are profiled")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,93 @@
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.query_cache import QueryCache
+
+class QueryCacheTest(TestCase):
+	def setUp(self):
+		# autosave is off so the tests stay in memory
+		self.controller = Controller(autosave=False)
+		self.controller.login("user", "123456")
+		self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.create_patient(9790014444, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.create_patient(9792225555, "Joe Hancock", "1990-01-15", "278 456 7890", "john.hancock@outlook.com", "5000 Douglas St, Saanich")
+
+	def test_lru(self):
+		cache = QueryCache(maxsize=2)
+		cache.put(("a",), 1, cache.generation)
+		cache.put(("b",), 2, cache.generation)
+		self.assertEqual((True, 1), cache.get(("a",)))
+		cache.put(("c",), 3, cache.generation)
+		self.assertEqual((False, None), cache.get(("b",)), "least recently used entry is evicted")
+		self.assertEqual((True, 1), cache.get(("a",)))
+		stats = cache.stats()
+		self.assertEqual((2, 1, 1, 2), (stats["hits"], stats["misses"], stats["evictions"], stats["size"]))
+
+	def test_stale_result_is_not_stored(self):
+		cache = QueryCache()
+		generation = cache.generation
+		cache.invalidate(lambda key: True)
+		cache.put(("a",), 1, generation)
+		self.assertEqual((False, None), cache.get(("a",)), "a result computed across a mutation is dropped")
+
+	def test_disabled(self):
+		controller = Controller(autosave=False, cache_size=0)
+		controller.login("user", "123456")
+		controller.list_patients()
+		controller.list_patients()
+		self.assertEqual(0, controller.cache_stats()["hits"])
+
+	def test_patient_queries(self):
+		self.assertEqual(3, len(self.controller.list_patients()))
+		self.assertEqual(3, len(self.controller.list_patients()))
+		self.assertEqual(2, len(self.controller.retrieve_patients("Doe")))
+		self.assertEqual(2, len(self.controller.retrieve_patients("Doe")))
+		self.assertEqual(1, len(self.controller.retrieve_patients("Hancock")))
+		stats = self.controller.cache_stats()
+		self.assertEqual((2, 3), (stats["hits"], stats["misses"]))
+
+		# a new Doe only invalidates the listing and the matching retrieval
+		self.controller.create_patient(9790013000, "Jane Doe", "2001-01-01", "250 203 3030", "jane.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual(1, self.controller.cache_stats()["size"], "the Hancock retrieval survives")
+		self.assertEqual(4, len(self.controller.list_patients()))
+		self.assertEqual(3, len(self.controller.retrieve_patients("Doe")))
+
+		self.controller.update_patient(9792225555, 9792225555, "Joe Doe", "1990-01-15", "278 456 7890", "john.hancock@outlook.com", "5000 Douglas St, Saanich")
+		self.assertEqual([], self.controller.retrieve_patients("Hancock"), "the old name is invalidated")
+		self.assertEqual(4, len(self.controller.retrieve_patients("Doe")), "the new name is invalidated")
+
+		self.controller.delete_patient(9790013000)
+		self.assertEqual(3, len(self.controller.list_patients()))
+		self.assertEqual(3, len(self.controller.retrieve_patients("Doe")))
+
+	def test_note_queries(self):
+		self.controller.set_current_patient(9790012000)
+		self.controller.create_note("Patient comes with headache and high blood pressure.")
+		self.assertEqual(1, len(self.controller.list_notes()))
+		self.assertEqual(1, len(self.controller.retrieve_notes("headache")))
+		self.assertEqual(0, len(self.controller.retrieve_notes("back pain")))
+
+		self.controller.create_note("Patient complains of back pain.")
+		self.assertEqual(2, len(self.controller.list_notes()))
+		self.assertEqual(1, len(self.controller.retrieve_notes("headache")), "served from the cache")
+		self.assertEqual(1, len(self.controller.retrieve_notes("back pain")))
+
+		self.controller.update_note(1, "Patient comes with migraine.")
+		self.assertEqual(0, len(self.controller.retrieve_notes("headache")))
+		self.controller.delete_note(2)
+		self.assertEqual(0, len(self.controller.retrieve_notes("back pain")))
+		self.assertEqual(1, len(self.controller.list_notes()))
+
+		# another patient's notes are cached separately
+		self.controller.set_current_patient(9790014444)
+		self.assertEqual([], self.controller.list_notes())
+
+	def test_shared_between_sessions(self):
+		other = self.controller.open_session()
+		other.login("ali", "@G00dPassw0rd")
+		self.assertEqual(3, len(other.list_patients()))
+		self.controller.delete_patient(9790014444)
+		self.assertEqual(2, len(other.list_patients()), "a mutation in one session invalidates the others")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,96 @@
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.dao.record_store import FileRecordStore
+from clinic.storage_config import StorageConfig
+
+class RecordStoreTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.config = StorageConfig(self.root, fanout=2)
+		shutil.copy(os.path.join('clinic', 'users.txt'), self.config.users_path())
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def write_flat(self, phn, notes):
+		os.makedirs(self.config.records_path(), exist_ok=True)
+		with open(self.config.flat_record_path(phn), 'wb') as file:
+			pickle.dump(notes, file)
+
+	def test_fanout_paths(self):
+		path = self.config.record_path(9790012000)
+		relative = os.path.relpath(path, self.config.records_path())
+		first, second, name = relative.split(os.sep)
+		self.assertEqual((2, 2, '9790012000.dat'), (len(first), len(second), name))
+		self.assertEqual(path, self.config.record_path(9790012000), "the layout is stable")
+		self.assertEqual(os.path.join(self.root, 'records', '9790012000.dat'), StorageConfig(self.root).record_path(9790012000))
+		self.assertEqual(9790012000, self.config.record_phn('9790012000.dat'))
+		self.assertIsNone(self.config.record_phn('9790012000.dat.prev'))
+		self.assertIsNone(self.config.record_phn('.dat'))
+
+	def test_lazy_migration(self):
+		self.write_flat(9790012000, {})
+		store = FileRecordStore.__new__(FileRecordStore)
+		store.config, store.read_only, store.migrator, store.flat = self.config, False, None, True
+		self.assertEqual({}, store.load(9790012000, pickle.loads))
+		self.assertFalse(os.path.exists(self.config.flat_record_path(9790012000)))
+		self.assertTrue(os.path.exists(self.config.record_path(9790012000)))
+
+	def test_background_migration(self):
+		for phn in range(9790012000, 9790012020):
+			self.write_flat(phn, {})
+		store = FileRecordStore(self.config)
+		store.close()
+		self.assertFalse(store.flat)
+		self.assertEqual([], [name for name in os.listdir(self.config.records_path())
+			if os.path.isfile(os.path.join(self.config.records_path(), name))])
+		for phn in range(9790012000, 9790012020):
+			self.assertTrue(os.path.exists(self.config.record_path(phn)))
+
+	def test_read_only_moves_nothing(self):
+		for phn in range(9790012000, 9790012005):
+			self.write_flat(phn, {"phn": phn})
+		store = FileRecordStore(self.config, read_only=True)
+		self.assertIsNone(store.migrator, "no background migration")
+		self.assertEqual({"phn": 9790012000}, store.load(9790012000, pickle.loads))
+		self.assertIsNotNone(store.read(9790012001))
+		self.assertIsNone(store.load(9790019999, pickle.loads))
+		for phn in range(9790012000, 9790012005):
+			self.assertTrue(os.path.exists(self.config.flat_record_path(phn)), "the files stay where they are")
+			self.assertFalse(os.path.exists(self.config.record_path(phn)))
+
+		# the process writing the clinic moved one meanwhile
+		FileRecordStore(self.config).close()
+		self.assertEqual({"phn": 9790012002}, store.load(9790012002, pickle.loads))
+
+	def test_migration_keeps_newer_record(self):
+		self.write_flat(9790012000, {"old": True})
+		store = FileRecordStore.__new__(FileRecordStore)
+		store.config, store.read_only, store.migrator, store.flat = self.config, False, None, True
+		store.save(9790012000, pickle.dumps({"new": True}))
+		self.assertEqual({"new": True}, store.load(9790012000, pickle.loads))
+		self.assertFalse(os.path.exists(self.config.flat_record_path(9790012000)))
+
+	def test_controller_with_fanout(self):
+		self.write_flat(9790012000, {})
+		controller = Controller(autosave=True, config=StorageConfig(self.root))
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.set_current_patient(9790012000)
+		controller.create_note("Patient comes with headache.")
+
+		controller = Controller(autosave=True, config=self.config)
+		controller.login("user", "123456")
+		controller.set_current_patient(9790012000)
+		self.assertEqual(["Patient comes with headache."], [note.text for note in controller.list_notes()])
+		controller.create_note("Follow up in a week.")
+		self.assertTrue(os.path.exists(self.config.record_path(9790012000)))
+		self.assertFalse(os.path.exists(self.config.flat_record_path(9790012000)))
+
+if __name__ == '__main__':
+	main()
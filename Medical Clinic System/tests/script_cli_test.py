@@ -0,0 +1,90 @@
+import io
+import json
+import socket
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.cli.script_cli import ScriptCLI, EXIT_OK, EXIT_LOGIN, EXIT_NOT_FOUND, EXIT_CONFLICT, EXIT_UNAVAILABLE
+
+class ScriptCLITest(TestCase):
+	def setUp(self):
+		# autosave is off so the commands never touch the clinic files
+		self.controller = Controller(autosave=False)
+		self.environ = {"CLINIC_USERNAME": "user", "CLINIC_PASSWORD": "123456"}
+
+	def run_cli(self, *argv, environ=None):
+		stdout = io.StringIO()
+		stderr = io.StringIO()
+		cli = ScriptCLI(self.controller, stdout=stdout, stderr=stderr,
+			environ=self.environ if environ is None else environ)
+		return cli.run(list(argv)), stdout.getvalue(), stderr.getvalue()
+
+	def test_login(self):
+		code, _, _ = self.run_cli("patients", "list", environ={})
+		self.assertEqual(EXIT_LOGIN, code, "no credentials")
+		code, _, _ = self.run_cli("patients", "list", environ={"CLINIC_USERNAME": "user", "CLINIC_PASSWORD": "bad"})
+		self.assertEqual(EXIT_LOGIN, code, "wrong password")
+		code, _, _ = self.run_cli("patients", "list")
+		self.assertEqual(EXIT_OK, code, "correct credentials")
+		self.assertFalse(self.controller.logged, "the command logs out when it finishes")
+
+	def test_unreachable_server(self):
+		# a port nobody listens on
+		with socket.socket() as sock:
+			sock.bind(("127.0.0.1", 0))
+			port = sock.getsockname()[1]
+		stderr = io.StringIO()
+		cli = ScriptCLI(stdout=io.StringIO(), stderr=stderr,
+			environ=dict(self.environ, CLINIC_SERVER="http://127.0.0.1:%d" % port))
+		self.assertEqual(EXIT_UNAVAILABLE, cli.run(["patients", "list"]))
+		self.assertEqual(1, len(stderr.getvalue().splitlines()), "one line, no traceback")
+		self.assertIn("cannot reach the clinic", stderr.getvalue())
+
+	def test_patients(self):
+		code, out, _ = self.run_cli("patients", "create", "--phn", "9790012000", "--name", "John Doe",
+			"--birth-date", "2000-10-10", "--phone", "250 203 1010", "--email", "john.doe@gmail.com",
+			"--address", "300 Moss St, Victoria", "--format", "ndjson")
+		self.assertEqual(EXIT_OK, code)
+		self.assertEqual("John Doe", json.loads(out)["name"])
+
+		code, _, _ = self.run_cli("patients", "create", "--phn", "9790012000", "--name", "Mary Doe",
+			"--birth-date", "1995-07-01", "--phone", "250 203 2020", "--email", "mary.doe@gmail.com",
+			"--address", "300 Moss St, Victoria")
+		self.assertEqual(EXIT_CONFLICT, code, "duplicate PHN")
+
+		code, _, _ = self.run_cli("patients", "update", "9790012000", "--phone", "278 999 4041")
+		self.assertEqual(EXIT_OK, code)
+		code, out, _ = self.run_cli("patients", "list", "--format", "csv")
+		self.assertEqual(EXIT_OK, code)
+		self.assertEqual("phn,name,birth_date,phone,email,address", out.splitlines()[0])
+		self.assertIn("278 999 4041", out.splitlines()[1])
+
+		code, _, _ = self.run_cli("patients", "search", "9790014444")
+		self.assertEqual(EXIT_NOT_FOUND, code)
+		code, _, _ = self.run_cli("patients", "delete", "9790012000")
+		self.assertEqual(EXIT_OK, code)
+		code, out, _ = self.run_cli("patients", "list")
+		self.assertEqual("", out)
+
+	def test_notes(self):
+		self.controller.login("user", "123456")
+		self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.logout()
+
+		code, _, _ = self.run_cli("notes", "create", "9790014444", "headache")
+		self.assertEqual(EXIT_NOT_FOUND, code, "no such patient")
+		self.assertIsNone(self.controller.current_patient)
+
+		self.assertEqual(EXIT_OK, self.run_cli("notes", "create", "9790012000", "Patient comes with headache.")[0])
+		self.assertEqual(EXIT_OK, self.run_cli("notes", "create", "9790012000", "Patient has dizziness.")[0])
+		code, out, _ = self.run_cli("notes", "search", "9790012000", "headache", "--format", "ndjson")
+		self.assertEqual(EXIT_OK, code)
+		self.assertEqual(1, json.loads(out)["code"])
+
+		self.assertEqual(EXIT_OK, self.run_cli("notes", "delete", "9790012000", "1")[0])
+		self.assertEqual(EXIT_NOT_FOUND, self.run_cli("notes", "get", "9790012000", "1")[0])
+		code, out, _ = self.run_cli("notes", "list", "9790012000", "--format", "ndjson")
+		self.assertEqual([2], [json.loads(line)["code"] for line in out.splitlines()])
+
+if __name__ == '__main__':
+	main()
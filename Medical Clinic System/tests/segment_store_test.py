@@ -0,0 +1,146 @@
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.dao.segment_store import SegmentStore
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+from clinic.storage_config import StorageConfig
+
+class SegmentStoreTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.directory = os.path.join(self.root, 'segments')
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def test_put_get_reopen(self):
+		store = SegmentStore(self.directory, checkpoint_every=3)
+		for phn in range(1, 6):
+			store.put(phn, b'record %d' % phn)
+		store.put(2, b'record 2 updated')
+		self.assertTrue(store.delete(4))
+		self.assertFalse(store.delete(4))
+		self.assertEqual(b'record 2 updated', store.get(2))
+		self.assertIsNone(store.get(4))
+
+		# Without a close, the tail after the last checkpoint is replayed from the segment
+		reopened = SegmentStore(self.directory)
+		self.assertEqual([1, 2, 3, 5], sorted(reopened.phns()))
+		self.assertEqual(b'record 2 updated', reopened.get(2))
+		self.assertEqual(b'record 5', reopened.get(5))
+
+		# Without any index, everything is rebuilt from the segments
+		os.remove(os.path.join(self.directory, 'index'))
+		self.assertEqual([1, 2, 3, 5], sorted(SegmentStore(self.directory).phns()))
+
+	def test_torn_tail(self):
+		store = SegmentStore(self.directory)
+		store.put(1, b'first')
+		store.put(2, b'second')
+		store.close()
+		segment = store.segment_path(store.active)
+		with open(segment, 'r+b') as file:
+			file.truncate(os.path.getsize(segment) - 3)
+
+		with self.assertLogs('clinic.dao.segment_store', 'WARNING'):
+			reopened = SegmentStore(self.directory)
+		self.assertEqual(b'first', reopened.get(1))
+		self.assertIsNone(reopened.get(2), "the torn entry is dropped")
+		reopened.put(3, b'third')
+		self.assertEqual(b'third', SegmentStore(self.directory).get(3), "appends continue after the cut")
+
+	def test_second_opener_reads_only(self):
+		store = SegmentStore(self.directory, segment_size=100)
+		for round in range(3):
+			store.put(1, b'record 1-%d' % round * 10)
+		segment = store.segment_path(store.active)
+		# The owner is still appending its last entry
+		with open(segment, 'ab') as file:
+			file.write(b'torn')
+		size = os.path.getsize(segment)
+
+		reader = SegmentStore(self.directory)
+		self.assertTrue(reader.read_only)
+		self.assertEqual(b'record 1-2' * 10, reader.get(1))
+		self.assertEqual(size, os.path.getsize(segment), "the reader leaves the tail alone")
+		with self.assertRaises(IllegalOperationException):
+			reader.put(2, b'second')
+		with self.assertRaises(IllegalOperationException):
+			reader.compact()
+		self.assertIsNone(reader.compact_in_background())
+		self.assertTrue(SegmentStore(self.directory, read_only=True).read_only)
+
+		store.close()
+		self.assertFalse(SegmentStore(self.directory).read_only, "writable once the owner closed it")
+
+	def test_compaction(self):
+		store = SegmentStore(self.directory, segment_size=200)
+		for round in range(5):
+			for phn in range(1, 4):
+				store.put(phn, b'%d-%d' % (phn, round) * 10)
+		store.put(9, b'deleted record')
+		store.delete(9)
+		if store.compactor:
+			store.compactor.join()
+		store.compact()
+		stats = store.stats()
+		self.assertEqual(stats["segments"], len(store.segments()))
+		self.assertLess(stats["garbage_ratio"], 0.5)
+		for phn in range(1, 4):
+			self.assertEqual(b'%d-4' % phn * 10, store.get(phn))
+		store.close()
+
+		os.remove(os.path.join(self.directory, 'index'))
+		reopened = SegmentStore(self.directory)
+		self.assertEqual([1, 2, 3], sorted(reopened.phns()), "a deleted record stays deleted after compaction")
+
+	def test_controller_beside_segment_owner(self):
+		config = StorageConfig(self.root, record_store='segments')
+		shutil.copy(os.path.join('clinic', 'users.txt'), config.users_path())
+		# the process writing the segments, here an owner on its own open file
+		owner = SegmentStore(config.segments_path())
+		self.addCleanup(owner.close)
+
+		controller = Controller(autosave=True, config=config)
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.set_current_patient(9790012000)
+		changes = controller.changes_since(0)
+		with self.assertRaises(IllegalOperationException):
+			controller.create_note("Patient comes with headache.")
+		self.assertEqual([], controller.list_notes(), "a note that could not be saved is not kept")
+		self.assertEqual(changes, controller.changes_since(0))
+		controller.unset_current_patient()
+		with self.assertRaises(IllegalOperationException):
+			controller.delete_patient(9790012000)
+		self.assertIsNotNone(controller.search_patient(9790012000))
+
+	def test_controller_with_segments(self):
+		config = StorageConfig(self.root, record_store='segments')
+		shutil.copy(os.path.join('clinic', 'users.txt'), config.users_path())
+		# A record written by the one file per record layout
+		os.makedirs(config.records_path())
+		with open(config.record_path(9790012000), 'wb') as file:
+			pickle.dump({}, file)
+
+		controller = Controller(autosave=True, config=config)
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.set_current_patient(9790012000)
+		controller.create_note("Patient comes with headache.")
+		with controller.transaction():
+			controller.create_note("Follow up in a week.")
+		self.assertFalse(os.path.exists(config.record_path(9790012000)), "the record moved into the segments")
+
+		controller = Controller(autosave=True, config=config)
+		controller.login("user", "123456")
+		controller.set_current_patient(9790012000)
+		self.assertEqual(["Follow up in a week.", "Patient comes with headache."],
+			[note.text for note in controller.list_notes()])
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,151 @@
+import http.client
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.remote_controller import RemoteController, controller_from_environ
+from clinic.server import ClinicServer
+from clinic.patient import Patient
+from clinic.note import Note
+from clinic.exception.invalid_login_exception import InvalidLoginException
+from clinic.exception.illegal_access_exception import IllegalAccessException
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+from clinic.exception.no_current_patient_exception import NoCurrentPatientException
+from clinic.exception.conflict_exception import ConflictException
+
+class ServerTest(TestCase):
+	def setUp(self):
+		# autosave is off so the server works in memory only, port 0 picks a free port
+		self.server = ClinicServer(Controller(autosave=False), port=0)
+		ready = threading.Event()
+		self.thread = threading.Thread(target=self.server.run, args=(ready,))
+		self.thread.start()
+		ready.wait(5)
+		self.clients = []
+
+	def tearDown(self):
+		for client in self.clients:
+			client.close()
+		self.server.stop()
+		self.thread.join(5)
+
+	def client(self):
+		client = RemoteController(self.server.url)
+		self.clients.append(client)
+		return client
+
+	def test_remote_operations(self):
+		client = self.client()
+		with self.assertRaises(IllegalAccessException):
+			client.list_patients()
+		with self.assertRaises(InvalidLoginException):
+			client.login("user", "wrong")
+		self.assertTrue(client.login("user", "123456"))
+
+		created = client.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual(Patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria", autosave=False), created)
+		with self.assertRaises(IllegalOperationException):
+			client.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual([created], client.retrieve_patients("John"))
+		self.assertIsNone(client.search_patient(9790099999))
+
+		with self.assertRaises(NoCurrentPatientException):
+			client.list_notes()
+		client.set_current_patient(9790012000)
+		self.assertEqual(created, client.current_patient)
+		note = client.create_note("Patient comes with headache.")
+		self.assertEqual(Note(1, "Patient comes with headache."), note)
+		self.assertIsNotNone(note.timestamp)
+		self.assertTrue(client.update_note(1, "Patient comes with migraine."))
+		self.assertEqual([Note(1, "Patient comes with migraine.")], client.list_notes())
+		self.assertEqual("Patient comes with migraine.", client.search_note(1).text)
+		self.assertTrue(client.delete_note(1))
+		self.assertEqual([], client.retrieve_notes("migraine"))
+		with self.assertRaises(IllegalOperationException):
+			client.delete_patient(9790012000)
+		client.unset_current_patient()
+		self.assertTrue(client.delete_patient(9790012000))
+		self.assertEqual(5, len(client.changes_since(0)))
+		self.assertTrue(client.logout())
+
+	def test_remote_versions(self):
+		first = self.client()
+		second = self.client()
+		first.login("user", "123456")
+		second.login("ali", "@G00dPassw0rd")
+		first.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		version = second.search_patient(9790012000).version
+		first.update_patient(9790012000, 9790012000, "John Smith", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria", version)
+		with self.assertRaises(ConflictException):
+			second.delete_patient(9790012000, version)
+		self.assertEqual(version + 1, second.search_patient(9790012000).version)
+
+	def test_remote_find_patients(self):
+		client = self.client()
+		client.login("user", "123456")
+		client.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		client.create_patient(9790014444, "Jane Doe", "1990-01-01", "250 203 1010", "jane.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual([9790014444], [patient.phn for patient in client.find_patients(phone="250 203 1010", birth_date_to="1999-12-31")])
+		with self.assertRaises(OSError):
+			client.find_patients(postal_code="V8W")
+
+	def test_sessions_per_client(self):
+		first = self.client()
+		second = self.client()
+		first.login("user", "123456")
+		second.login("ali", "@G00dPassw0rd")
+		first.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		first.set_current_patient(9790012000)
+		self.assertIsNone(second.get_current_patient(), "current patient belongs to one client")
+		self.assertEqual(1, len(second.list_patients()), "clients share the server data")
+		first.logout()
+		self.assertEqual(1, len(second.list_patients()), "logout of one client leaves the other logged in")
+
+	def test_import(self):
+		client = self.client()
+		client.login("user", "123456")
+		rows = [json.dumps({"phn": 9790012000 + i, "name": "Patient %d" % i, "birth_date": "2000-01-01",
+			"phone": "250 000 0000", "email": "p@example.com", "address": "1 Moss St, Victoria"}) for i in range(3)]
+		rejects = []
+		report = client.import_patients(io.StringIO("\n".join(rows + ['{"phn": "bad"}']) + "\n"), workers=0,
+			on_reject=lambda row_number, reason: rejects.append(row_number))
+		self.assertEqual((4, 3, 1), (report.read, report.imported, report.rejected))
+		self.assertEqual([4], rejects)
+		self.assertEqual(3, len(client.list_patients()))
+
+	def test_bad_requests(self):
+		connection = http.client.HTTPConnection(self.server.host, self.server.port)
+		connection.request('POST', '/api/no_such_operation', b'{}')
+		response = connection.getresponse()
+		response.read()
+		self.assertEqual(404, response.status)
+		connection.request('POST', '/api/login', b'[1, 2]')
+		response = connection.getresponse()
+		self.assertEqual(400, response.status)
+		self.assertEqual("BadRequest", json.loads(response.read())["error"])
+		connection.request('GET', '/health')
+		self.assertEqual("ok", json.loads(connection.getresponse().read())["status"])
+		connection.close()
+
+	def test_profiling_directory(self):
+		self.server.profile_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.server.profile_dir)
+		client = self.client()
+		client.login("user", "123456")
+		with self.assertRaises(IllegalAccessException, msg="a client never picks where the server writes"):
+			client.start_profiling(os.path.join(self.server.profile_dir, "elsewhere"))
+		self.assertTrue(client.start_profiling(memory=False))
+		paths = client.stop_profiling()
+		self.assertEqual(1, len(paths))
+		self.assertEqual(self.server.profile_dir, os.path.dirname(paths[0]))
+
+	def test_controller_from_environ(self):
+		self.assertIsInstance(controller_from_environ({"CLINIC_SERVER": "http://127.0.0.1:8765"}), RemoteController)
+
+if __name__ == '__main__':
+	main()
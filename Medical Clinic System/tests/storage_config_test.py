@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.storage_config import StorageConfig
+
+class StorageConfigTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def test_default_paths(self):
+		config = StorageConfig()
+		self.assertEqual(os.path.join('clinic', 'patients.json'), config.patients_path())
+		self.assertEqual(os.path.join('clinic', 'records', '1234567.dat'), config.record_path(1234567))
+		self.assertEqual(os.path.join('clinic', 'users.txt'), config.users_path())
+		self.assertEqual('/srv/clinic', StorageConfig.from_environ({"CLINIC_DATA_ROOT": "/srv/clinic"}).data_root)
+
+	def test_controller_uses_config(self):
+		config = StorageConfig(self.root, patients_file='people.json', records_dir='notes', record_file='patient-{phn}.pkl')
+		shutil.copy(os.path.join('clinic', 'users.txt'), config.users_path())
+		controller = Controller(autosave=True, config=config)
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.set_current_patient(9790012000)
+		controller.create_note("Patient comes with headache and high blood pressure.")
+
+		self.assertTrue(os.path.exists(os.path.join(self.root, 'people.json')))
+		self.assertTrue(os.path.exists(os.path.join(self.root, 'notes', 'patient-9790012000.pkl')))
+		self.assertTrue(os.path.exists(os.path.join(self.root, 'changes.log')))
+
+		# a second clinic in another root does not see the first one
+		other_root = tempfile.mkdtemp()
+		shutil.copy(config.users_path(), os.path.join(other_root, 'users.txt'))
+		other = Controller(autosave=True, config=StorageConfig(other_root))
+		other.login("user", "123456")
+		self.assertEqual([], other.list_patients())
+		shutil.rmtree(other_root)
+
+		controller = Controller(autosave=True, config=config)
+		controller.login("user", "123456")
+		controller.set_current_patient(9790012000)
+		self.assertEqual(1, len(controller.list_notes()), "notes are loaded from the configured record file")
+
+if __name__ == '__main__':
+	main()
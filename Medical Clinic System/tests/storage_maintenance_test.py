@@ -0,0 +1,147 @@
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.storage_config import StorageConfig
+from clinic.storage_maintenance import TEMP_GRACE
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+
+class StorageMaintenanceTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.config = StorageConfig(self.root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), self.config.users_path())
+		self.controller = self.start()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def start(self, config=None):
+		controller = Controller(autosave=True, config=config if config else self.config)
+		controller.login("user", "123456")
+		return controller
+
+	def create_patient(self, phn, note):
+		self.controller.create_patient(phn, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.set_current_patient(phn)
+		self.controller.create_note(note)
+		self.controller.unset_current_patient()
+
+	def notes(self, controller, phn):
+		controller.set_current_patient(phn)
+		notes = [note.text for note in controller.list_notes()]
+		controller.unset_current_patient()
+		return notes
+
+	def write_orphan(self, phn, suffix=''):
+		with open(self.config.record_path(phn) + suffix, 'wb') as file:
+			pickle.dump({}, file)
+
+	def test_rekey_moves_record(self):
+		self.create_patient(9790012000, "Patient comes with headache.")
+		self.controller.update_patient(9790012000, 9790012999, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual(["Patient comes with headache."], self.notes(self.controller, 9790012999))
+		self.assertFalse(os.path.exists(self.config.record_path(9790012000)))
+
+		self.controller.set_current_patient(9790012999)
+		self.controller.create_note("Follow up in a week.")
+		self.controller.unset_current_patient()
+		self.assertEqual(["Follow up in a week.", "Patient comes with headache."], self.notes(self.start(), 9790012999))
+
+	def test_rekey_in_transaction(self):
+		self.create_patient(9790012000, "Patient comes with headache.")
+		with self.assertRaises(ValueError):
+			with self.controller.transaction():
+				self.controller.update_patient(9790012000, 9790012999, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+				raise ValueError("abort")
+		self.assertEqual(["Patient comes with headache."], self.notes(self.controller, 9790012000))
+		self.assertEqual(9790012000, self.controller.search_patient(9790012000).record.phn)
+
+		with self.controller.transaction():
+			self.controller.update_patient(9790012000, 9790012999, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+			# a new patient takes the old PHN in the same transaction
+			self.create_patient(9790012000, "New patient.")
+		controller = self.start()
+		self.assertEqual(["Patient comes with headache."], self.notes(controller, 9790012999))
+		self.assertEqual(["New patient."], self.notes(controller, 9790012000))
+
+	def test_delete_drops_record(self):
+		self.create_patient(9790012000, "Patient comes with headache.")
+		self.controller.delete_patient(9790012000)
+		self.assertFalse(os.path.exists(self.config.record_path(9790012000)))
+		self.create_patient(9790012000, "New patient.")
+		self.assertEqual(["New patient."], self.notes(self.start(), 9790012000), "a new patient never inherits old notes")
+
+	def test_stats_and_garbage_collection(self):
+		self.create_patient(9790012000, "Patient comes with headache.")
+		self.write_orphan(9790014444)
+		self.write_orphan(9790014444, '.prev')
+		self.write_orphan(9790015555, '.tmp')
+		# left by a version that kept a previous generation of every record
+		self.write_orphan(9790012000, '.prev')
+		old = time.time() - TEMP_GRACE - 60
+		os.utime(self.config.record_path(9790015555) + '.tmp', (old, old))
+
+		stats = self.controller.storage_stats()
+		self.assertEqual(1, stats["patients"])
+		self.assertEqual(2, stats["records"])
+		self.assertEqual(1, stats["orphan_records"])
+		self.assertGreater(stats["wasted_bytes"], 0)
+		self.assertEqual(stats["wasted_bytes"], stats["orphan_bytes"] + stats["previous_bytes"] + stats["temporary_bytes"]
+			+ stats["segment_garbage_bytes"], "every byte is counted once")
+		self.assertGreater(stats["bytes_per_record"], 0)
+
+		report = self.controller.collect_garbage(dry_run=True)
+		self.assertEqual([9790014444], report["orphans"])
+		self.assertTrue(os.path.exists(self.config.record_path(9790014444)))
+
+		report = self.controller.collect_garbage()
+		self.assertEqual(report["bytes_reclaimed"], stats["wasted_bytes"])
+		self.assertEqual(['9790012000.dat'], sorted(os.listdir(self.config.records_path())))
+		self.assertEqual(0, self.controller.storage_stats()["wasted_bytes"])
+		self.assertEqual(["Patient comes with headache."], self.notes(self.controller, 9790012000))
+
+	def test_garbage_collection_keeps_recent_writes(self):
+		self.create_patient(9790012000, "Patient comes with headache.")
+		# another workstation adds a patient this controller has not seen yet
+		other = self.start()
+		other.create_patient(9790013333, "Jane Doe", "2001-01-01", "250 203 1011", "jane.doe@gmail.com", "301 Moss St, Victoria")
+		other.set_current_patient(9790013333)
+		other.create_note("Patient comes with fever.")
+		# a write still going on elsewhere
+		self.write_orphan(9790015555, '.tmp')
+
+		report = self.controller.collect_garbage()
+		self.assertEqual([], report["orphans"])
+		self.assertEqual(0, report["temporary_files"])
+		self.assertTrue(os.path.exists(self.config.record_path(9790015555) + '.tmp'))
+		self.assertEqual(["Patient comes with fever."], self.notes(self.start(), 9790013333))
+
+	def test_garbage_collection_with_fanout_and_segments(self):
+		for config in (StorageConfig(os.path.join(self.root, 'fanout'), fanout=2),
+				StorageConfig(os.path.join(self.root, 'segments'), record_store='segments')):
+			os.makedirs(config.data_root)
+			shutil.copy(self.config.users_path(), config.users_path())
+			self.controller = self.start(config)
+			self.create_patient(9790012000, "Patient comes with headache.")
+			self.create_patient(9790014444, "Soon an orphan.")
+			# the patient disappears without its record, as after a crash
+			del self.controller.patient_dao.patients[9790014444]
+			self.controller.patient_dao.save_patients()
+			self.assertEqual(1, self.controller.storage_stats()["orphan_records"])
+			self.assertEqual([9790014444], self.controller.collect_garbage(workers=4)["orphans"])
+			self.assertEqual(0, self.controller.storage_stats()["orphan_records"])
+			self.assertEqual(["Patient comes with headache."], self.notes(self.controller, 9790012000))
+
+	def test_garbage_collection_needs_autosave(self):
+		controller = Controller(autosave=False, config=self.config)
+		controller.login("user", "123456")
+		with self.assertRaises(IllegalOperationException):
+			controller.collect_garbage()
+
+if __name__ == '__main__':
+	main()
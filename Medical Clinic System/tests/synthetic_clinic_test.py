@@ -0,0 +1,34 @@
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from benchmarks.synthetic import SyntheticClinic, USERNAME, PASSWORD
+from clinic.controller import Controller
+from clinic.storage_config import StorageConfig
+
+class SyntheticClinicTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def test_reproducible(self):
+		first = [(repr(patient), notes) for patient, notes in SyntheticClinic(20, seed=7).iter_patients()]
+		second = [(repr(patient), notes) for patient, notes in SyntheticClinic(20, seed=7).iter_patients()]
+		other = [(repr(patient), notes) for patient, notes in SyntheticClinic(20, seed=8).iter_patients()]
+		self.assertEqual(first, second, "same seed, same clinic")
+		self.assertNotEqual(first, other, "different seed, different clinic")
+
+	def test_controller_loads_clinic(self):
+		clinic = SyntheticClinic(30, notes_mean=3, notes_distribution='fixed')
+		config = StorageConfig(self.root)
+		self.assertEqual(90, clinic.write(config))
+		controller = Controller(autosave=True, config=config)
+		controller.login(USERNAME, PASSWORD)
+		self.assertEqual(30, len(controller.list_patients()))
+		controller.set_current_patient(clinic.phn(30))
+		self.assertEqual([3, 2, 1], [note.code for note in controller.list_notes()])
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest import main
+from unittest import mock
+from clinic.controller import Controller
+from clinic.events import PatientCreated
+from clinic.storage_config import StorageConfig
+
+class TransactionTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.config = StorageConfig(self.root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), self.config.users_path())
+		self.controller = Controller(autosave=True, config=self.config)
+		self.controller.login("user", "123456")
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def saved_patients(self):
+		with open(self.config.patients_path()) as file:
+			return json.load(file)
+
+	def test_commit(self):
+		events = []
+		self.controller.subscribe(events.append)
+		with self.controller.transaction():
+			self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+			self.controller.set_current_patient(9790012000)
+			self.controller.create_note("Intake: patient comes with headache.")
+			self.assertFalse(os.path.exists(self.config.patients_path()), "nothing is written before the commit")
+			self.assertEqual([], events, "subscribers only hear about committed changes")
+		self.controller.unset_current_patient()
+
+		self.assertIn("9790012000", self.saved_patients())
+		self.assertTrue(os.path.exists(self.config.record_path(9790012000)))
+		self.assertFalse(os.path.exists(self.config.journal_path()))
+		self.assertEqual(2, len(events))
+		self.assertIsInstance(events[0], PatientCreated, "the events of the transaction are published in order")
+		self.assertEqual([1, 2], [entry["seq"] for entry in self.controller.changes_since(0)])
+
+		reloaded = Controller(autosave=True, config=self.config)
+		reloaded.login("user", "123456")
+		reloaded.set_current_patient(9790012000)
+		self.assertEqual("Intake: patient comes with headache.", reloaded.list_notes()[0].text)
+
+	def test_rollback(self):
+		self.controller.create_patient(9790014444, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+		self.controller.set_current_patient(9790014444)
+		self.controller.create_note("Patient comes with back pain.")
+		self.controller.unset_current_patient()
+		# cached before the transaction
+		self.assertEqual(1, len(self.controller.list_patients()))
+		events = []
+		self.controller.subscribe(events.append)
+
+		with self.assertRaises(RuntimeError):
+			with self.controller.transaction():
+				self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+				self.controller.update_patient(9790014444, 9790015555, "Mary Roe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+				self.controller.set_current_patient(9790015555)
+				self.controller.update_note(1, "Patient comes with neck pain.")
+				self.controller.create_note("Second note.")
+				self.assertEqual(2, len(self.controller.list_patients()))
+				raise RuntimeError("intake interrupted")
+		self.controller.unset_current_patient()
+
+		self.assertEqual([], events)
+		patients = self.controller.list_patients()
+		self.assertEqual([(9790014444, "Mary Doe")], [(patient.phn, patient.name) for patient in patients])
+		self.controller.set_current_patient(9790014444)
+		self.assertEqual(["Patient comes with back pain."], [note.text for note in self.controller.list_notes()])
+		self.assertEqual(2, self.controller.create_note("After the rollback.").code, "note codes continue from the committed ones")
+		self.assertEqual([1, 2, 3], [entry["seq"] for entry in self.controller.changes_since(0)], "sequence numbers are reused")
+		self.assertEqual(["9790014444"], list(self.saved_patients()))
+
+	def test_recovery_after_crash(self):
+		# the crash comes after the journal is durable but before the files are written
+		with mock.patch('clinic.transaction.apply_batch', side_effect=OSError("power loss")):
+			with self.assertRaises(OSError):
+				with self.controller.transaction():
+					self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertTrue(os.path.exists(self.config.journal_path()))
+		self.assertFalse(os.path.exists(self.config.patients_path()))
+
+		restarted = Controller(autosave=True, config=self.config)
+		restarted.login("user", "123456")
+		self.assertEqual(9790012000, restarted.search_patient(9790012000).phn)
+		self.assertFalse(os.path.exists(self.config.journal_path()))
+		self.assertEqual([1], [entry["seq"] for entry in restarted.changes_since(0)])
+
+	def test_commit_after_failed_apply(self):
+		# the files of the first commit fail once, its journal is left behind in a running process
+		with mock.patch('clinic.transaction.apply_batch', side_effect=OSError("disk full")):
+			with self.assertRaises(OSError):
+				with self.controller.transaction():
+					self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertTrue(os.path.exists(self.config.journal_path()))
+
+		with self.controller.transaction():
+			self.controller.create_patient(9790014444, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertFalse(os.path.exists(self.config.journal_path()))
+		self.assertEqual({"9790012000", "9790014444"}, set(self.saved_patients()), "the first commit is not lost")
+		self.assertEqual([1, 2], [entry["seq"] for entry in self.controller.changes_since(0)])
+
+		restarted = Controller(autosave=True, config=self.config)
+		restarted.login("user", "123456")
+		self.assertEqual(2, len(restarted.list_patients()))
+
+	def test_sequence_after_other_writers(self):
+		self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		desk = Controller(autosave=True, config=self.config)
+		desk.login("user", "123456")
+		desk.set_current_patient(9790012000)
+		with self.controller.transaction():
+			self.controller.create_patient(9790014444, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+			# another workstation adds a note meanwhile, it does not wait for the data root lock
+			other = threading.Thread(target=desk.create_note, args=("Patient comes with headache.",))
+			other.start()
+			other.join(5)
+			self.assertFalse(other.is_alive())
+		entries = list(self.controller.changes_since(0))
+		self.assertEqual([1, 2, 3], [entry["seq"] for entry in entries], "the commit is numbered after the note")
+		self.assertEqual(['patient', 'note', 'patient'], [entry["entity"] for entry in entries])
+
+	def test_torn_journal_is_dropped(self):
+		with open(self.config.journal_path(), 'wb') as file:
+			file.write(b'\x80\x04partial')
+		restarted = Controller(autosave=True, config=self.config)
+		restarted.login("user", "123456")
+		self.assertEqual([], restarted.list_patients())
+		self.assertFalse(os.path.exists(self.config.journal_path()))
+
+	def test_other_sessions_wait(self):
+		other = self.controller.open_session()
+		other.login("ali", "@G00dPassw0rd")
+		order = []
+
+		def create():
+			other.create_patient(9790014444, "Mary Doe", "1995-07-01", "250 203 2020", "mary.doe@gmail.com", "300 Moss St, Victoria")
+			order.append("other session")
+
+		with self.controller.transaction():
+			self.controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+			thread = threading.Thread(target=create)
+			thread.start()
+			time.sleep(0.05)
+			order.append("commit")
+		thread.join()
+		self.assertEqual(["commit", "other session"], order)
+		self.assertEqual(2, len(self.saved_patients()))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,186 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.storage_config import StorageConfig
+from clinic.exception.conflict_exception import ConflictException
+from clinic.exception.illegal_operation_exception import IllegalOperationException
+
+class VersioningTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.config = StorageConfig(self.root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), self.config.users_path())
+		self.controller = self.start()
+		self.create_patient(self.controller, 9790012000, "John Doe")
+		self.controller.set_current_patient(9790012000)
+		self.controller.create_note("Patient comes with headache.")
+		self.controller.unset_current_patient()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def start(self):
+		controller = Controller(autosave=True, config=self.config)
+		controller.login("user", "123456")
+		return controller
+
+	def create_patient(self, controller, phn, name):
+		controller.create_patient(phn, name, "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+
+	def update_patient(self, controller, name, version=None):
+		return controller.update_patient(9790012000, 9790012000, name, "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria", version)
+
+	def test_update_patient_compare_and_set(self):
+		patient = self.controller.search_patient(9790012000)
+		self.assertEqual(1, patient.version)
+		self.assertTrue(self.update_patient(self.controller, "John Smith", version=1))
+		self.assertEqual(2, patient.version)
+		with self.assertRaises(ConflictException):
+			self.update_patient(self.controller, "John Brown", version=1)
+		self.assertEqual("John Smith", patient.name)
+		# without a version the update is unconditional, as before
+		self.assertTrue(self.update_patient(self.controller, "John Brown"))
+		self.assertEqual(3, self.start().search_patient(9790012000).version)
+
+	def test_rejected_update_changes_nothing(self):
+		self.create_patient(self.controller, 9790014444, "Jane Doe")
+		patient = self.controller.search_patient(9790012000)
+		with self.assertRaises(IllegalOperationException):
+			self.controller.update_patient(9790012000, 9790014444, "John Smith", "1999-01-01", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria", 1)
+		self.assertEqual(("John Doe", "2000-10-10", 1), (patient.name, patient.birth_date, patient.version))
+		self.assertEqual([], self.controller.find_patients(birth_date="1999-01-01"))
+		self.assertTrue(self.update_patient(self.controller, "John Smith", version=1))
+
+	def test_delete_patient_compare_and_set(self):
+		self.update_patient(self.controller, "John Smith")
+		with self.assertRaises(IllegalOperationException):
+			self.controller.delete_patient(9790012000, version=1)
+		self.assertIsNotNone(self.controller.search_patient(9790012000))
+		self.assertTrue(self.controller.delete_patient(9790012000, version=2))
+
+	def test_note_compare_and_set(self):
+		self.controller.set_current_patient(9790012000)
+		self.assertEqual(1, self.controller.search_note(1).version)
+		self.assertTrue(self.controller.update_note(1, "Patient comes with migraine.", version=1))
+		with self.assertRaises(ConflictException):
+			self.controller.update_note(1, "Patient comes with fever.", version=1)
+		with self.assertRaises(ConflictException):
+			self.controller.delete_note(1, version=1)
+		self.assertEqual("Patient comes with migraine.", self.controller.search_note(1).text)
+
+		controller = self.start()
+		controller.set_current_patient(9790012000)
+		self.assertEqual(2, controller.search_note(1).version)
+		self.assertTrue(controller.delete_note(1, version=2))
+
+	def test_rollback_restores_versions(self):
+		self.controller.set_current_patient(9790012000)
+		with self.assertRaises(ValueError):
+			with self.controller.transaction():
+				self.controller.update_note(1, "Patient comes with migraine.", version=1)
+				raise ValueError("abort")
+		self.assertEqual(1, self.controller.search_note(1).version)
+		self.controller.unset_current_patient()
+		with self.assertRaises(ValueError):
+			with self.controller.transaction():
+				self.update_patient(self.controller, "John Smith", version=1)
+				raise ValueError("abort")
+		self.assertEqual(1, self.controller.search_patient(9790012000).version)
+
+	def test_conflict_with_other_workstation(self):
+		desk = self.start()
+		other = self.start()
+		version = desk.search_patient(9790012000).version
+		self.update_patient(other, "John Smith", version=version)
+		with self.assertRaises(ConflictException):
+			self.update_patient(desk, "John Brown", version=version)
+		self.assertEqual("John Smith", desk.search_patient(9790012000).name)
+
+		# a save of the whole file keeps what the other workstation saved before
+		self.create_patient(other, 9790014444, "Jane Doe")
+		self.update_patient(desk, "John Brown", version=version + 1)
+		self.assertEqual(["John Brown", "Jane Doe"], [patient.name for patient in self.start().list_patients()])
+
+		desk.set_current_patient(9790012000)
+		other.set_current_patient(9790012000)
+		other.update_note(1, "Patient comes with migraine.", version=1)
+		with self.assertRaises(ConflictException):
+			desk.delete_note(1, version=1)
+
+	def test_compare_and_set_across_processes(self):
+		# another workstation takes the lock, then saves a change of the patient
+		script = (
+			"import sys, time\n"
+			"from clinic.controller import Controller\n"
+			"from clinic.storage_config import StorageConfig\n"
+			"controller = Controller(autosave=True, config=StorageConfig(sys.argv[1]))\n"
+			"controller.login('user', '123456')\n"
+			"with controller.data_lock:\n"
+			"    print('locked', flush=True)\n"
+			"    time.sleep(0.3)\n"
+			"    controller.update_patient(9790012000, 9790012000, 'John Smith', '2000-10-10', '250 203 1010', "
+			"'john.doe@gmail.com', '300 Moss St, Victoria', 1)\n")
+		other = subprocess.Popen([sys.executable, '-c', script, self.root], stdout=subprocess.PIPE, text=True,
+			env=dict(os.environ, PYTHONPATH=os.getcwd()))
+		try:
+			self.assertEqual('locked', other.stdout.readline().strip())
+			# this update waits for the other one and then sees its version
+			with self.assertRaises(ConflictException):
+				self.update_patient(self.controller, "John Brown", version=1)
+		finally:
+			other.stdout.close()
+			self.assertEqual(0, other.wait())
+		self.assertEqual("John Smith", self.start().search_patient(9790012000).name)
+
+	def test_notes_without_data_root_lock(self):
+		locked, release = threading.Event(), threading.Event()
+		def hold():
+			with self.controller.data_lock:
+				locked.set()
+				release.wait(5)
+		holder = threading.Thread(target=hold)
+		holder.start()
+		locked.wait(5)
+		try:
+			desk = self.start()
+			desk.set_current_patient(9790012000)
+			worker = threading.Thread(target=desk.create_note, args=("Follow up in a week.",))
+			worker.start()
+			worker.join(5)
+			self.assertFalse(worker.is_alive(), "a note is saved while another writer holds the data root lock")
+		finally:
+			release.set()
+			holder.join()
+
+	def test_notes_of_other_workstations(self):
+		desk = self.start()
+		desk.set_current_patient(9790012000)
+		self.controller.set_current_patient(9790012000)
+		self.assertEqual(2, desk.create_note("Follow up in a week.").code)
+		# the record saved by the other desk is read again before this one saves over it
+		self.assertEqual(3, self.controller.create_note("Blood test results.").code)
+		with self.assertRaises(ConflictException):
+			desk.update_note(2, "Follow up in two weeks.", version=0)
+		self.assertEqual(3, len(self.start().list_patients()[0].record.note_dao.notes))
+
+	def test_file_without_versions(self):
+		path = self.config.patients_path()
+		with open(path) as file:
+			patients = json.load(file)
+		for patient in patients.values():
+			del patient["version"]
+		with open(path, 'w') as file:
+			json.dump(patients, file)
+		controller = self.start()
+		self.assertEqual(1, controller.search_patient(9790012000).version)
+		self.assertTrue(self.update_patient(controller, "John Smith", version=1))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.storage_config import StorageConfig
+
+class WarmStartTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.config = StorageConfig(self.root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), self.config.users_path())
+		self.controller = self.start()
+		for phn, note in ((9790012000, "Patient comes with headache."), (9790014444, "Follow up in a week.")):
+			self.controller.create_patient(phn, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+			self.controller.set_current_patient(phn)
+			self.controller.create_note(note)
+			self.controller.unset_current_patient()
+		self.controller.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def start(self, warm_start=True):
+		controller = Controller(autosave=True, config=self.config, warm_start=warm_start)
+		controller.login("user", "123456")
+		return controller
+
+	def notes(self, controller, phn):
+		controller.set_current_patient(phn)
+		notes = [note.text for note in controller.list_notes()]
+		controller.unset_current_patient()
+		return notes
+
+	def test_start_from_snapshot(self):
+		self.assertTrue(os.path.exists(self.config.snapshot_path()))
+		controller = self.start()
+		self.assertEqual([9790012000, 9790014444], [patient.phn for patient in controller.list_patients()])
+		record = controller.search_patient(9790012000).record.note_dao
+		self.assertFalse(record.is_loaded(), "records are read on first use")
+		self.assertEqual(["Patient comes with headache."], self.notes(controller, 9790012000))
+		controller.set_current_patient(9790012000)
+		self.assertEqual(2, controller.create_note("Second visit.").code)
+		self.assertEqual(2, len(self.notes(self.start(), 9790012000)))
+
+	def test_rekey_record_not_loaded(self):
+		controller = self.start()
+		controller.update_patient(9790014444, 9790015555, "Jane Doe", "2000-10-10", "250 203 1010", "jane.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual(["Follow up in a week."], self.notes(self.start(), 9790015555))
+
+	def test_stale_snapshot_is_ignored(self):
+		controller = self.start(warm_start=False)
+		controller.update_patient(9790014444, 9790014444, "Jane Doe", "2000-10-10", "250 203 1010", "jane.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertEqual("Jane Doe", self.start().search_patient(9790014444).name)
+
+	def test_snapshot_of_changed_file_not_written(self):
+		controller = self.start()
+		with open(self.config.snapshot_path(), 'rb') as file:
+			snapshot = file.read()
+		# another process saves the patients after this one loaded them
+		self.start(warm_start=False).delete_patient(9790014444)
+		controller.close()
+		with open(self.config.snapshot_path(), 'rb') as file:
+			self.assertEqual(snapshot, file.read())
+		self.assertIsNone(self.start().search_patient(9790014444))
+
+	def test_damaged_snapshot_is_ignored(self):
+		with open(self.config.snapshot_path(), 'r+b') as file:
+			file.seek(-3, os.SEEK_END)
+			file.write(b'xyz')
+		self.assertEqual(["Follow up in a week."], self.notes(self.start(), 9790014444))
+
+	def test_snapshot_after_transaction(self):
+		controller = self.start()
+		with controller.transaction():
+			controller.create_patient(9790016666, "Ann Doe", "2000-10-10", "250 203 1010", "ann.doe@gmail.com", "300 Moss St, Victoria")
+		controller.close()
+		controller = self.start()
+		self.assertFalse(controller.search_patient(9790012000).record.note_dao.is_loaded())
+		self.assertEqual("Ann Doe", controller.search_patient(9790016666).name)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest import main
+from benchmarks.synthetic import SyntheticClinic
+from clinic.controller import Controller
+from clinic.dao.patient_dao_json import PatientDAOJSON
+from clinic.storage_config import StorageConfig
+
+class WarmUpTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def snapshot(self, dao):
+		return {phn: (patient.record.note_dao.code_counter, [(note.code, note.text, note.timestamp)
+			for note in patient.record.list_notes()]) for phn, patient in dao.patients.items()}
+
+	def test_parallel_load_matches_serial_load(self):
+		for record_store in ('files', 'segments'):
+			config = StorageConfig(os.path.join(self.root, record_store), record_store=record_store)
+			clinic = SyntheticClinic(300, seed=3)
+			clinic.write(config)
+			serial = self.snapshot(PatientDAOJSON(True, config))
+			self.assertEqual(300, len(serial))
+			self.assertEqual(serial, self.snapshot(PatientDAOJSON(True, config, load_workers=8)))
+
+	def test_parallel_load_sets_torn_record_aside(self):
+		config = StorageConfig(self.root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), config.users_path())
+		controller = Controller(autosave=True, config=config)
+		controller.login("user", "123456")
+		controller.create_patient(9790012000, "John Doe", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		controller.set_current_patient(9790012000)
+		controller.create_note("Patient comes with headache.")
+		controller.create_note("Follow up in a week.")
+		path = config.record_path(9790012000)
+		with open(path, 'r+b') as file:
+			file.truncate(os.path.getsize(path) // 2)
+
+		# records keep no previous generation, what is left is moved aside for inspection
+		with self.assertLogs('clinic.durable_io', 'ERROR'):
+			controller = Controller(autosave=True, config=config, load_workers=4)
+		self.assertTrue(os.path.exists(path + '.corrupt'))
+		controller.login("user", "123456")
+		controller.set_current_patient(9790012000)
+		self.assertEqual([], controller.list_notes())
+		self.assertEqual(1, controller.create_note("Second try.").code)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from unittest import main
+from clinic.controller import Controller
+from clinic.storage_config import StorageConfig
+from clinic.events import PatientCreated, PatientUpdated, PatientDeleted, NoteCreated, NoteUpdated, NoteDeleted
+
+class WatcherTest(TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.config = StorageConfig(self.root)
+		shutil.copy(os.path.join('clinic', 'users.txt'), self.config.users_path())
+		# two workstations sharing the data directory
+		self.desk = self.start()
+		self.other = self.start()
+		self.create_patient(self.other, 9790012000, "John Doe")
+		self.create_patient(self.other, 9790014444, "Jane Doe")
+		self.other.set_current_patient(9790012000)
+		self.other.create_note("Patient comes with headache.")
+		self.other.create_note("Follow up in a week.")
+		self.other.unset_current_patient()
+		self.desk.refresh()
+
+	def tearDown(self):
+		self.desk.stop_watching()
+		shutil.rmtree(self.root)
+
+	def start(self):
+		controller = Controller(autosave=True, config=self.config)
+		controller.login("user", "123456")
+		return controller
+
+	def create_patient(self, controller, phn, name):
+		controller.create_patient(phn, name, "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+
+	def test_merge_patients(self):
+		self.assertEqual(["John Doe", "Jane Doe"], [patient.name for patient in self.desk.list_patients()])
+		john = self.desk.search_patient(9790012000)
+
+		self.create_patient(self.other, 9790015555, "Ann Doe")
+		self.other.update_patient(9790012000, 9790012000, "John Smith", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.other.delete_patient(9790014444)
+		events = self.desk.refresh()
+
+		self.assertEqual([PatientDeleted, PatientUpdated, PatientCreated], [type(event) for event in events])
+		self.assertEqual("John Doe", events[1].original_name)
+		self.assertIs(john, self.desk.search_patient(9790012000), "a patient that stays keeps its object")
+		self.assertEqual(["John Smith", "Ann Doe"], [patient.name for patient in self.desk.list_patients()])
+		self.assertEqual([], self.desk.refresh())
+
+	def test_reload_changed_record(self):
+		self.desk.set_current_patient(9790012000)
+		self.assertEqual(2, len(self.desk.list_notes()))
+		self.other.set_current_patient(9790012000)
+
+		self.other.update_note(1, "Patient comes with migraine.")
+		self.other.delete_note(2)
+		self.other.create_note("Prescribed rest.")
+		events = self.desk.refresh()
+
+		self.assertEqual([NoteDeleted, NoteUpdated, NoteCreated], [type(event) for event in events])
+		self.assertEqual("Patient comes with headache.", events[1].old_text)
+		self.assertEqual(["Prescribed rest.", "Patient comes with migraine."], [note.text for note in self.desk.list_notes()])
+		self.assertEqual(4, self.desk.create_note("Next visit.").code)
+
+	def test_replaced_change_log(self):
+		self.desk.set_current_patient(9790012000)
+		self.assertEqual(2, len(self.desk.list_notes()))
+		self.other.set_current_patient(9790012000)
+		self.other.create_note("Prescribed rest.")
+		# without the entries that named it, every loaded record is looked at
+		os.remove(self.config.changes_path())
+		self.assertEqual([NoteCreated], [type(event) for event in self.desk.refresh()])
+		self.assertEqual(3, len(self.desk.list_notes()))
+
+	def test_own_changes_are_not_reloaded(self):
+		self.create_patient(self.desk, 9790015555, "Ann Doe")
+		self.desk.set_current_patient(9790012000)
+		self.desk.create_note("Prescribed rest.")
+		with self.desk.transaction():
+			self.desk.create_note("Next visit.")
+			self.desk.update_patient(9790014444, 9790014444, "Jane Smith", "2000-10-10", "250 203 1010", "john.doe@gmail.com", "300 Moss St, Victoria")
+		self.assertFalse(self.desk.patient_dao.changed_on_disk(), "the next mutation does not refresh")
+		self.assertEqual([], self.desk.refresh())
+
+	def test_watch_notifies_subscribers(self):
+		received = threading.Event()
+		events = []
+		def callback(event):
+			events.append(event)
+			received.set()
+		self.desk.subscribe(callback, PatientCreated)
+		self.desk.watch(interval=0.01)
+		self.create_patient(self.other, 9790015555, "Ann Doe")
+		self.assertTrue(received.wait(5))
+		self.assertEqual(9790015555, events[0].patient.phn)
+		self.assertEqual("Ann Doe", self.desk.search_patient(9790015555).name)
+
+if __name__ == '__main__':
+	main()